@@ -3,10 +3,39 @@
 import sys
 import os
 import argparse
+import json
+from datetime import datetime
 from configparser import ConfigParser
-import tweepy
 from elasticsearch_tweepy import ElasticSearchTweepy
-from elasticsearch import Elasticsearch
+from es_client import create_es_client
+from response_cache import CachingSession, ResponseCache, DEFAULT_MAX_BYTES
+from credential_pool import CredentialPool, credential_sections, make_auth
+from es_spool import EsSpool
+from pipeline_metrics import METRICS, start_metrics_server
+from tracing import Tracer, run_profiled
+import async_pipeline
+import local_analytics
+import columnar_store
+import offline_index
+from tweet_graph import TweetGraph, EDGE_KINDS
+from friend_graph import FriendGraph
+import projection
+import multi_term
+import engagement
+from sharding import Shard, ListCheckpoint, SHARD_METHODS, parse_shard
+from search_budget import SearchBudget
+from raw_archive import RawArchive, transform_archive, swap_alias
+from elasticsearch_index_conf import set_es_index, set_rollup_index, index_options
+import mapping_benchmark
+import rollup
+from es_bulk import push_bulk
+
+# Modes that do not need the ElasticSearch password.
+OFFLINE_MODES = ('term_to_file', 'terms_to_file', 'user_to_file', 'analyse_file', 'export_columnar',
+                 'build_offline_index', 'search_offline_index', 'graph_file',
+                 'graph_neighbours', 'bubble', 'projection_report')
+# Modes spending the search quota.
+SEARCH_MODES = ('term', 'terms', 'term_to_file', 'terms_to_file')
 
 
 def set_arguments():
@@ -26,17 +55,74 @@ def set_arguments():
                         help = 'Enable verbose output. Optional')
     parser.add_argument('-s', dest = 'term', type = str,
                         help = 'Search tweets with this term.')
+    parser.add_argument('--terms', dest = 'terms', type = str,
+                        help = 'File with one search term per line. Used with terms and ' +
+                               'terms_to_file.')
+    parser.add_argument('--annotate-terms', dest = 'annotate_terms', action = 'store_true',
+                        help = 'Store the matched terms in the search_terms field.')
     parser.add_argument('-m', dest = 'mode', type = str,
-                        help = 'Mode of operation: user, term, list, generate.')
+                        help = 'Mode of operation: user, term, terms, list, hydrate, refresh, ' +
+                               'generate, user_to_file, term_to_file, terms_to_file, ' +
+                               'analyse_file, export_columnar, build_offline_index, ' +
+                               'search_offline_index, graph_file, graph_neighbours, bubble, ' +
+                               'projection_report, reindex_from_archive, benchmark_mapping, ' +
+                               'rollup_backfill.')
+    parser.add_argument('--days', dest = 'days', type = int,
+                        help = 'In refresh mode update the counters of tweets this many days old.')
     parser.add_argument('-j', dest = 'proc_count', type = int,
                         help = 'Number of parallel processes used in list mode.')
     parser.add_argument('-i', dest = 'index', type = str,
                         help = 'Name of the index to be used.')
     parser.add_argument('-p', dest = 'path', type = str,
-                        help = 'Path to file where the timeline will be stored. Used with _to_file')
+                        help = 'Path to file where the timeline will be stored. Used with _to_file' +
+                               '. In hydrate mode the file of tweet ids.')
     parser.add_argument('-q', dest = 'time_path', type = str,
-                        help = 'Path to timestamp file')
-    parser.set_defaults(debug = False, mode = 'user', proc_count = 4)
+                        help = 'Path to timestamp file. Checkpoint file in term, terms and hydrate modes.')
+    parser.add_argument('-o', dest = 'out_path', type = str,
+                        help = 'Path to output file or folder. Used with analyse_file, ' +
+                               'export_columnar and the offline index modes.')
+    parser.add_argument('--top', dest = 'top', type = int,
+                        help = 'Number of values listed per aggregation in analyse_file mode.')
+    parser.add_argument('--metrics-port', dest = 'metrics_port', type = int,
+                        help = 'Serve Prometheus metrics on this port while running.')
+    parser.add_argument('--metrics-file', dest = 'metrics_file', type = str,
+                        help = 'Write a JSON summary of the run metrics to this file.')
+    parser.add_argument('--pipeline', dest = 'pipeline', action = 'store_true',
+                        help = 'Overlap fetching and indexing in user, list and term modes.')
+    parser.add_argument('--queue-size', dest = 'queue_size', type = int,
+                        help = 'Batches buffered between the pipeline stages.')
+    parser.add_argument('--spool', dest = 'spool', type = str,
+                        help = 'Buffer ElasticSearch writes to this directory and ship them ' +
+                               'from the background.')
+    parser.add_argument('--graph', dest = 'graph', type = str,
+                        help = 'Folder of the hashtag and mention graph updated by this run.')
+    parser.add_argument('--min-seeds', dest = 'min_seeds', type = int,
+                        help = 'In bubble mode count the accounts followed by this many seeds.')
+    parser.add_argument('--projection', dest = 'projection', type = str,
+                        help = 'Field projection profile of the indexed tweets: full, default, ' +
+                               'lean or a [Projection <name>] section of the configuration.')
+    parser.add_argument('--raw-archive', dest = 'raw_archive', type = str,
+                        help = 'Archive the raw tweets to this folder. Read by ' +
+                               'reindex_from_archive.')
+    parser.add_argument('--rollup-index', dest = 'rollup_index', type = str,
+                        help = 'Keep hourly hashtag, domain, source and user counts in this ' +
+                               'index. Default: rollup_index of [ElasticSearch].')
+    parser.add_argument('--shard', dest = 'shard', type = str,
+                        help = 'In list mode fetch only shard K/N of the users, 1 <= K <= N.')
+    parser.add_argument('--shard-method', dest = 'shard_method', type = str,
+                        choices = SHARD_METHODS,
+                        help = 'modulo or jump (consistent hash). Default: modulo.')
+    parser.add_argument('--record', dest = 'record', type = str,
+                        help = 'Record the Twitter API responses to this cache folder.')
+    parser.add_argument('--replay', dest = 'replay', type = str,
+                        help = 'Answer the Twitter API calls from this cache folder. No network.')
+    parser.add_argument('--profile', dest = 'profile', type = str,
+                        help = 'Run under cProfile and store the pstats output to this file.')
+    parser.add_argument('--trace', dest = 'trace', type = str,
+                        help = 'Record wall and CPU time of each stage to this trace file.')
+    parser.set_defaults(debug = False, mode = 'user', proc_count = 4, min_seeds = 2,
+                        days = engagement.DEFAULT_DAYS, shard_method = 'modulo',
+                        top = local_analytics.DEFAULT_TOP)
 
     arguments = parser.parse_args()
     if arguments.config is None:
@@ -49,9 +135,45 @@ def set_arguments():
 
 def register_tweepy_to_twitter(api_conf):
     """ Give Twitter Api keys so that Tweepy library can fetch tweets. """
-    t_auth = tweepy.OAuthHandler(api_conf['api_key'], api_conf['api_secret'])
-    t_auth.set_access_token(api_conf['acc_token'], api_conf['acc_secret'])
-    return ElasticSearchTweepy(t_auth)
+    return ElasticSearchTweepy(make_auth(api_conf))
+
+
+def rollup_index_name(args, config, index_name):
+    """ Name of the rollup index. rollup_backfill falls back to <index>-rollup. """
+    name = args.rollup_index or config['ElasticSearch'].get('rollup_index')
+    if name is None and args.mode == 'rollup_backfill':
+        name = index_name + rollup.ROLLUP_SUFFIX
+    return name
+
+
+def connect_es(args, config, twitter_api, index_name, elastic_pass):
+    """ Creates the ElasticSearch client and sets the index. With a spool the writes go to disk
+    first and a background thread ships them, so the run continues even if the cluster is down. """
+    es = create_es_client(config['ElasticSearch'], elastic_pass, pool_size = args.proc_count + 2)
+
+    spool_path = args.spool
+    if spool_path is None and config.has_section('Local Storage'):
+        spool_path = config['Local Storage'].get('spool_path')
+    rollup_index = rollup_index_name(args, config, index_name)
+    if spool_path is None:
+        twitter_api.set_this_es_index(index_name, es, debug = args.debug)
+        if rollup_index is not None:
+            twitter_api.rollup = rollup.create_rollup(rollup_index, es, debug = args.debug)
+        return es
+
+    if rollup_index is not None:
+        twitter_api.rollup = rollup.Rollup(rollup_index)
+    try:
+        twitter_api.set_this_es_index(index_name, es, debug = args.debug)
+        if rollup_index is not None:
+            set_rollup_index(rollup_index, es, debug = args.debug)
+    except Exception as ex:
+        # The drainer creates the index once the cluster is reachable.
+        print('ElasticSearch is not available (%s). Spooling to %s.' % (ex, spool_path))
+        twitter_api.index = index_name
+    twitter_api.spool = EsSpool(spool_path)
+    twitter_api.spool.start_drainer(twitter_api.spool_pusher(es, debug = args.debug))
+    return es
 
 
 def main():
@@ -59,6 +181,35 @@ def main():
     if args is None:
         return -1
 
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = start_metrics_server(args.metrics_port, METRICS)
+
+    tracer = None
+    if args.trace is not None:
+        tracer = Tracer()
+        ElasticSearchTweepy.tracer = tracer
+
+    try:
+        if args.profile is not None:
+            ret = run_profiled(args.profile, run, args, parser)
+        else:
+            ret = run(args, parser)
+    finally:
+        if tracer is not None:
+            tracer.write(args.trace)
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        if args.metrics_file is not None:
+            METRICS.write_summary(args.metrics_file)
+        if args.debug:
+            print(json.dumps(METRICS.summary(), indent=2))
+
+    return ret
+
+
+def run(args, parser):
+    """ Executes the selected mode of operation. """
     config = ConfigParser()
     try:
         config.read(args.config)
@@ -76,7 +227,7 @@ def main():
     else:
         index_name = args.index
 
-    if not args.mode == "term_to_file" and not args.mode == "user_to_file":
+    if args.mode not in OFFLINE_MODES:
         try:
             elastic_pass = os.environ['ELASTICSEARCH_PASS']
         except KeyError:
@@ -103,6 +254,49 @@ def main():
         twitter_api_keys_tokens = config['Twitter API']
 
     twitter_api = register_tweepy_to_twitter(twitter_api_keys_tokens)
+    twitter_api.index_options = index_options(config['ElasticSearch'])
+    if credential_sections(config):
+        twitter_api.credential_pool = CredentialPool.from_config(config, twitter_api_keys_tokens)
+        if args.debug:
+            print('Using a pool of %d credentials' % len(twitter_api.credential_pool.credentials))
+
+    if args.record is not None and args.replay is not None:
+        print('Use either --record or --replay, not both.')
+        return -1
+    if args.record is not None or args.replay is not None:
+        max_bytes = config.getint('Local Storage', 'response_cache_max_bytes',
+                                  fallback = DEFAULT_MAX_BYTES)
+        cache = ResponseCache(args.record or args.replay, max_bytes = max_bytes)
+        # The credential pool copies the API object, the copies share this session.
+        twitter_api.session = CachingSession(cache, 'record' if args.record else 'replay')
+    if config.has_section('Local Storage'):
+        twitter_api.dead_letter_path = config['Local Storage'].get('dead_letter_path')
+
+    if args.graph is not None:
+        twitter_api.graph = TweetGraph.load(args.graph)
+
+    projection_name = args.projection
+    if projection_name is None and config.has_section('Local Storage'):
+        projection_name = config['Local Storage'].get('projection')
+    if projection_name is not None:
+        try:
+            twitter_api.projection = projection.load_profile(projection_name, config)
+        except ValueError as err:
+            print('ERROR: %s' % err)
+            return -1
+
+    raw_archive_path = args.raw_archive
+    if raw_archive_path is None and config.has_section('Local Storage'):
+        raw_archive_path = config['Local Storage'].get('raw_archive_path')
+    if raw_archive_path is not None and args.mode != 'reindex_from_archive':
+        twitter_api.raw_archive = RawArchive(raw_archive_path)
+
+    if args.mode in SEARCH_MODES:
+        history_path = None
+        if config.has_section('Local Storage'):
+            history_path = config['Local Storage'].get('search_history_path')
+        twitter_api.search_budget = SearchBudget(history_path)
+        twitter_api.search_budget.refresh_quota(twitter_api)
 
     if args.debug:
         print(twitter_api.me().name)
@@ -112,15 +306,15 @@ def main():
             print('When using this mode a target user must be specified.\n')
             parser.print_help()
             return -1
-        es = Elasticsearch(
-            [elasitc_url],
-            http_auth=(config['ElasticSearch']['auth_user'], elastic_pass),
-            use_ssl = (config['ElasticSearch']['use_ssl'] == 'True'),
-            verify_certs = (config['ElasticSearch']['verify_certs'] == 'True')
-        )
-        twitter_api.set_this_es_index(index_name, es, debug = args.debug)
-        twitter_api.user_timeline_to_es(args.target, es_handle = es,
-                                        with_id = False, debug = args.debug)
+        es = connect_es(args, config, twitter_api, index_name, elastic_pass)
+        if args.pipeline:
+            jobs = [async_pipeline.user_timeline_job(twitter_api, args.target, with_id = False,
+                                                     debug = args.debug)]
+            twitter_api.pipeline_to_es(jobs, es_handle = es, queue_size = args.queue_size,
+                                       debug = args.debug)
+        else:
+            twitter_api.user_timeline_to_es(args.target, es_handle = es,
+                                            with_id = False, debug = args.debug)
     elif args.mode == "user_to_file":
         if args.target is None:
             print('When using this mode a target user must be specified.\n')
@@ -134,29 +328,88 @@ def main():
         twitter_api.user_timeline_to_file(args.target, file_path=args.path)
 
     elif args.mode == "list":
-        es = Elasticsearch(
-            [elasitc_url],
-            http_auth=(config['ElasticSearch']['auth_user'], elastic_pass),
-            use_ssl = (config['ElasticSearch']['use_ssl'] == 'True'),
-            verify_certs = (config['ElasticSearch']['verify_certs'] == 'True')
-        )
-        twitter_api.set_this_es_index(index_name, es, args.debug)
+        es = connect_es(args, config, twitter_api, index_name, elastic_pass)
         storage_path = config['Local Storage']['users_path']
-        twitter_api.list_timeline_to_es(storage_path, args.proc_count, es_handle = es,
-                                        debug = args.debug)
+        shard = None
+        if args.shard is not None:
+            try:
+                shard = Shard(*parse_shard(args.shard), method = args.shard_method)
+            except ValueError as err:
+                print('ERROR: %s' % err)
+                return -1
+        if args.pipeline:
+            checkpoint = None
+            if shard is not None:
+                checkpoint = ListCheckpoint(shard.checkpoint_path(storage_path))
+            jobs = async_pipeline.user_list_jobs(twitter_api, storage_path, debug = args.debug,
+                                                 shard = shard, checkpoint = checkpoint)
+            twitter_api.pipeline_to_es(jobs, es_handle = es, parallels = args.proc_count,
+                                       queue_size = args.queue_size, debug = args.debug)
+            if checkpoint is not None and all(job.target in checkpoint.done for job in jobs):
+                checkpoint.finish()
+        else:
+            twitter_api.list_timeline_to_es(storage_path, args.proc_count, es_handle = es,
+                                            debug = args.debug, shard = shard)
     elif args.mode == "term":
         if args.term is None:
             print("When using this mode a search term is required!\n")
             parser.print_help()
             return -1
-        es = Elasticsearch(
-            [elasitc_url],
-            http_auth=(config['ElasticSearch']['auth_user'], elastic_pass),
-            use_ssl = (config['ElasticSearch']['use_ssl'] == 'True'),
-            verify_certs = (config['ElasticSearch']['verify_certs'] == 'True')
-        )
-        twitter_api.set_this_es_index(index_name, es, args.debug)
-        twitter_api.search_term_to_es(args.term, es_handle = es, debug = args.debug)
+        checkpoint_path = args.time_path
+        if checkpoint_path is None and config.has_section('Local Storage'):
+            checkpoint_path = config['Local Storage'].get('term_checkpoint_path')
+        es = connect_es(args, config, twitter_api, index_name, elastic_pass)
+        if args.pipeline:
+            most_recent = twitter_api.get_id_most_recent_tweet_in_es_index(es_handle = es,
+                                                                           debug = args.debug)
+            jobs = [async_pipeline.search_job(twitter_api, args.term, most_recent,
+                                              debug = args.debug,
+                                              checkpoint_path = checkpoint_path)]
+            twitter_api.pipeline_to_es(jobs, es_handle = es, queue_size = args.queue_size,
+                                       debug = args.debug)
+        else:
+            twitter_api.search_term_to_es(args.term, es_handle = es,
+                                          checkpoint_path = checkpoint_path, debug = args.debug)
+
+    elif args.mode in ("terms", "terms_to_file"):
+        if args.terms is None:
+            print("When using this mode a file of search terms is required!\n")
+            parser.print_help()
+            return -1
+        checkpoint_path = args.time_path
+        if checkpoint_path is None and config.has_section('Local Storage'):
+            checkpoint_path = config['Local Storage'].get('term_checkpoint_path')
+        if checkpoint_path is None:
+            print("Give the term checkpoint file with -q or term_checkpoint_path in " +
+                  "[Local Storage].")
+            return -1
+        terms = multi_term.read_terms(args.terms)
+        if args.mode == "terms":
+            es = connect_es(args, config, twitter_api, index_name, elastic_pass)
+            twitter_api.search_terms_to_es(terms, checkpoint_path, es_handle = es,
+                                           annotate = args.annotate_terms, debug = args.debug)
+        else:
+            if args.path is None:
+                print("In this mode a path to storage file needs to be defined.")
+                parser.print_help()
+                return -1
+            twitter_api.index = index_name
+            twitter_api.search_terms_to_file(terms, args.path, checkpoint_path,
+                                             annotate = args.annotate_terms, debug = args.debug)
+
+    elif args.mode == "hydrate":
+        if args.path is None:
+            print("Give the file of tweet ids with -p.")
+            parser.print_help()
+            return -1
+        checkpoint_path = args.time_path or args.path + '.checkpoint'
+        es = connect_es(args, config, twitter_api, index_name, elastic_pass)
+        twitter_api.hydrate_ids_to_es(args.path, checkpoint_path, es_handle = es,
+                                      debug = args.debug)
+
+    elif args.mode == "refresh":
+        es = connect_es(args, config, twitter_api, index_name, elastic_pass)
+        twitter_api.refresh_engagement(es, days = args.days, debug = args.debug)
 
     elif args.mode == "generate":
         if args.target is None:
@@ -164,7 +417,8 @@ def main():
             parser.print_help()
             return -1
         storage_path = config['Local Storage']['users_path']
-        twitter_api.save_friends_file(args.target, storage_path, args.debug)
+        twitter_api.save_friends_file(args.target, storage_path, args.debug,
+                                      config['Local Storage'].get('friend_graph_path'))
         twitter_api.clean_up_friends_file(storage_path, args.debug)
 
     elif args.mode == "term_to_file":
@@ -182,10 +436,162 @@ def main():
 
     elif args.mode == "analyse_file":
         if args.path is None:
-            print("Deprecated: In this mode a path to storage file (pickle) needs to be defined.")
+            print("In this mode a path to stored file or folder of files needs to be defined.")
             parser.print_help()
             return -1
-        return -1
+        if columnar_store.is_columnar_archive(args.path):
+            analysis = columnar_store.analyse_columnar(args.path)
+        else:
+            analysis = local_analytics.analyse_path(args.path)
+        report = analysis.report(top = args.top)
+        print(local_analytics.format_report(report))
+        if args.out_path is not None:
+            local_analytics.write_report(report, args.out_path)
+
+    elif args.mode == "export_columnar":
+        if args.path is None or args.out_path is None:
+            print("In this mode the stored files (-p) and the output folder (-o) are required.")
+            parser.print_help()
+            return -1
+        rows = columnar_store.export_columnar(args.path, args.out_path, debug = args.debug)
+        print('Exported %d new tweets to %s' % (rows, args.out_path))
+
+    elif args.mode == "build_offline_index":
+        if args.path is None or args.out_path is None:
+            print("In this mode the stored files (-p) and the index folder (-o) are required.")
+            parser.print_help()
+            return -1
+        documents = offline_index.OfflineIndex(args.out_path).add_path(args.path,
+                                                                       debug = args.debug)
+        print('Indexed %d new tweets to %s' % (documents, args.out_path))
+
+    elif args.mode == "search_offline_index":
+        if args.term is None or args.out_path is None:
+            print("In this mode a query (-s) and the index folder (-o) are required.")
+            parser.print_help()
+            return -1
+        ids = offline_index.OfflineIndex(args.out_path).search(args.term)
+        print('%d matching tweets' % len(ids))
+        for tweet_id in ids[:args.top]:
+            print(tweet_id)
+
+    elif args.mode == "graph_file":
+        if args.path is None or args.graph is None:
+            print("In this mode the stored files (-p) and the graph folder (--graph) are required.")
+            parser.print_help()
+            return -1
+        documents = twitter_api.graph.add_path(args.path, debug = args.debug)
+        print('Added %d new tweets to the graph' % documents)
+        if args.out_path is not None:
+            twitter_api.graph.write_edge_lists(args.out_path)
+
+    elif args.mode == "graph_neighbours":
+        if args.term is None or args.graph is None:
+            print("In this mode a node (-s #hashtag or -s @user) and --graph are required.")
+            parser.print_help()
+            return -1
+        for kind in EDGE_KINDS:
+            print('%s:' % kind)
+            for name, count in twitter_api.graph.neighbours(args.term.lower(), kind, args.top):
+                print('  %8d %s' % (count, name))
+
+    elif args.mode == "bubble":
+        try:
+            friend_graph_path = config['Local Storage']['friend_graph_path']
+        except KeyError:
+            print("Define friend_graph_path in [Local Storage] and run generate mode first.")
+            return -1
+        graph = FriendGraph.load(friend_graph_path)
+        print('Seed overlap (Jaccard):')
+        for seed_a, seed_b, overlap in graph.pairwise_jaccard(top = args.top):
+            print('  %.3f %s %s' % (overlap, seed_a, seed_b))
+        print('Most shared friends:')
+        for user_id, count in graph.most_shared(args.top):
+            print('  %4d %d' % (count, user_id))
+        print('%d accounts are followed by at least %d seeds.' % (
+            len(graph.followed_by_at_least(args.min_seeds)), args.min_seeds))
+
+    elif args.mode == "projection_report":
+        if args.path is None:
+            print('Give the stored tweets with -p.')
+            return -1
+        profiles = []
+        for name in projection.profile_names(config):
+            try:
+                profiles.append((name, projection.load_profile(name, config)))
+            except ValueError as err:
+                print('ERROR: %s' % err)
+                return -1
+        sizes = projection.measure_savings(args.path, profiles)
+        baseline = sizes[0][1]
+        print('%-16s %12s %8s' % ('profile', 'bytes/doc', 'saved'))
+        for name, size in sizes:
+            saved = 100.0 * (baseline - size) / baseline if baseline else 0.0
+            print('%-16s %12.1f %7.1f%%' % (name, size, saved))
+
+    elif args.mode == "reindex_from_archive":
+        if raw_archive_path is None:
+            print('Give the raw archive with --raw-archive or raw_archive_path in [Local Storage].')
+            return -1
+        es = create_es_client(config['ElasticSearch'], elastic_pass,
+                              pool_size = args.proc_count + 2)
+        # index_name becomes an alias pointing to the newest rebuilt index.
+        if es.indices.exists(index = index_name) and not es.indices.exists_alias(name = index_name):
+            print('%s is an index. Its tweets missing from the archive are copied to the new '
+                  'index, after which it is replaced by an alias.' % index_name)
+        new_index = '%s-%s' % (index_name, datetime.now().strftime('%Y%m%d%H%M%S'))
+        set_es_index(new_index, es, debug = args.debug, projection = twitter_api.projection,
+                     **twitter_api.index_options)
+        failed = []
+
+        def push(bulk_string):
+            result = push_bulk(es, bulk_string, new_index,
+                               dead_letter_path = twitter_api.dead_letter_path,
+                               tracer = twitter_api.tracer, debug = args.debug)
+            failed.append(result.failed)
+
+        batches = transform_archive(RawArchive(raw_archive_path), push, twitter_api.projection,
+                                    workers = args.proc_count)
+        if sum(failed):
+            print('%d tweets failed to index. Alias %s was not moved to %s.' % (
+                sum(failed), index_name, new_index))
+            return -1
+        old_indices = swap_alias(es, index_name, new_index)
+        print('Indexed %d batches to %s. Alias %s moved from %s.' % (
+            batches, new_index, index_name, ', '.join(old_indices) or 'nowhere'))
+
+    elif args.mode == "rollup_backfill":
+        es = create_es_client(config['ElasticSearch'], elastic_pass)
+        rollup_index = rollup_index_name(args, config, index_name)
+        # The counts are added to the existing buckets, so the rollups are rebuilt in a new index
+        # and rollup_index becomes an alias pointing to it once every upsert has succeeded.
+        new_index = '%s-%s' % (rollup_index, datetime.now().strftime('%Y%m%d%H%M%S'))
+        backfill_rollup = rollup.create_rollup(new_index, es, debug = args.debug)
+        failed = []
+
+        def push(bulk_string):
+            result = push_bulk(es, bulk_string, new_index,
+                               dead_letter_path = twitter_api.dead_letter_path, debug = args.debug)
+            failed.append(result.failed)
+
+        documents = rollup.backfill(es, index_name, backfill_rollup, push, debug = args.debug)
+        if sum(failed):
+            print('%d rollup buckets failed to index. %s was not replaced by %s.' % (
+                sum(failed), rollup_index, new_index))
+            return -1
+        old_indices = rollup.replace_index(es, rollup_index, new_index)
+        print('Rolled up %d tweets of %s to %s. Alias %s replaced %s.' % (
+            documents, index_name, new_index, rollup_index, ', '.join(old_indices) or 'nothing'))
+
+    elif args.mode == "benchmark_mapping":
+        if args.path is None:
+            print('Give the recorded tweets used in the benchmark with -p.')
+            return -1
+        es = create_es_client(config['ElasticSearch'], elastic_pass)
+        results = mapping_benchmark.run_benchmark(es, args.path, index_name,
+                                                  projection = twitter_api.projection,
+                                                  debug = args.debug)
+        print(mapping_benchmark.format_results(results))
 
     elif args.mode == "clean":
         storage_path = config['Local Storage']['users_path']
@@ -194,6 +600,17 @@ def main():
         print("ERROR: unknown mode")
         return -1
 
+    if twitter_api.graph is not None:
+        twitter_api.graph.save(args.graph)
+
+    if twitter_api.search_budget is not None:
+        twitter_api.search_budget.save()
+
+    if twitter_api.spool is not None:
+        drain_timeout = config.getfloat('Local Storage', 'spool_drain_timeout', fallback = 60.0)
+        if not twitter_api.spool.close(drain_timeout = drain_timeout):
+            print('Some batches are still in the spool. They will be shipped on the next run.')
+
     return 0
 
 
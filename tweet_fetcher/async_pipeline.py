@@ -0,0 +1,235 @@
+"""
+Asynchronous fetch -> transform -> index pipeline. The stages run concurrently and are joined with
+bounded queues. Tweepy and the ElasticSearch client are blocking, so the network calls run in a
+thread pool while the event loop moves the batches between the stages. When the cluster is slow
+the queues fill up and fetching waits instead of piling tweets into memory.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+import tweepy.errors
+
+import multi_term
+from es_bulk import BulkResult
+
+DEFAULT_QUEUE_SIZE = 4
+MAX_TRIES = 5
+_DONE = object()
+
+
+def user_timeline_job(twitter_api, target, with_id=True, debug=False):
+    """ Job fetching the timeline of a single user. """
+    def job(emit):
+        emit(twitter_api.fetch_user_timeline(target, with_id=with_id, debug=debug))
+    job.target = target
+    job.label = str(target)
+    job.endpoint = 'user_timeline'
+    return job
+
+
+def user_list_jobs(twitter_api, storage_path, debug=False, shard=None, checkpoint=None):
+    """ Jobs for every user id listed in the file. Same file format as in list mode. With a
+    shard only the users of the shard get a job. With a checkpoint the users done earlier are
+    skipped and a user is marked done once its tweets have been indexed. """
+    with open(storage_path, 'r') as handle:
+        user_ids = [int(line) for line in handle]
+    if shard is not None:
+        user_ids = shard.select(user_ids)
+    if checkpoint is not None:
+        user_ids = [user_id for user_id in user_ids if user_id not in checkpoint.done]
+    jobs = []
+    for user_id in user_ids:
+        job = user_timeline_job(twitter_api, user_id, debug=debug)
+        if checkpoint is not None:
+            job.on_done = partial(checkpoint.mark, user_id)
+        jobs.append(job)
+    return jobs
+
+
+def search_job(twitter_api, search_term, most_recent_id, debug=False, checkpoint_path=None):
+    """ Job searching tweets. Each page of results is passed on as soon as it arrives. With
+    checkpoint_path a search cut short by the page budget is continued where the previous run
+    stopped, and the progress is stored once every batch has been indexed. """
+    checkpoints = {}
+    if checkpoint_path is not None:
+        checkpoints = multi_term.load_checkpoints(checkpoint_path)
+    since_id, max_id = multi_term.search_window(checkpoints, search_term, most_recent_id)
+    newest = []
+
+    def job(emit):
+        def emit_page(tweets):
+            newest.append(max(tweet.id for tweet in tweets))
+            emit(tweets)
+        twitter_api.fetch_search_results_from_twitter(search_term, most_recent_id=since_id,
+                                                      debug=debug, page_callback=emit_page,
+                                                      max_id=max_id)
+        job.resume_id = twitter_api.last_search_resume_id
+
+    def save_progress():
+        multi_term.record_search(checkpoints, search_term, since_id,
+                                 max(newest) if newest else None, job.resume_id)
+        multi_term.save_checkpoints(checkpoint_path, checkpoints)
+
+    job.label = search_term
+    job.endpoint = 'search'
+    if checkpoint_path is not None:
+        job.on_done = save_progress
+    return job
+
+
+class TweetPipeline(object):
+    """ Runs fetch jobs through the pipeline. A job is a callable that gets an emit function and
+    calls it with each list of fetched tweets. Emit blocks while the next stage is full. When the
+    job has an on_done attribute, it is called once the job has been fetched and every batch of
+    it has been indexed cleanly. """
+    def __init__(self, twitter_api, es_handle, fetch_workers=1, index_workers=1, queue_size=None,
+                 debug=False, test=False):
+        self.twitter_api = twitter_api
+        self.es_handle = es_handle
+        self.fetch_workers = max(1, fetch_workers)
+        self.index_workers = max(1, index_workers)
+        self.queue_size = queue_size or DEFAULT_QUEUE_SIZE
+        self.debug = debug
+        self.test = test
+        self.simulate_sleep = []
+        self.results = []
+        self._batches = {}  # job -> batches still in the pipeline
+        self._fetched = set()
+        self._failed = set()
+
+    def run(self, jobs):
+        """ Runs all the jobs. Returns True when every batch was indexed cleanly. """
+        return asyncio.run(self._run(list(jobs)))
+
+    async def _run(self, jobs):
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self.fetch_workers + self.index_workers + 1)
+        job_queue = asyncio.Queue()
+        fetched = asyncio.Queue(maxsize=self.queue_size)
+        transformed = asyncio.Queue(maxsize=self.queue_size)
+        for job in jobs:
+            job_queue.put_nowait(job)
+
+        try:
+            fetchers = [asyncio.create_task(self._fetch(loop, executor, job_queue, fetched))
+                        for _ in range(self.fetch_workers)]
+            transformer = asyncio.create_task(
+                self._transform(loop, executor, fetched, transformed))
+            indexers = [asyncio.create_task(self._index(loop, executor, transformed))
+                        for _ in range(self.index_workers)]
+
+            await asyncio.gather(*fetchers)
+            await fetched.put(_DONE)
+            await transformer
+            for _ in indexers:
+                await transformed.put(_DONE)
+            await asyncio.gather(*indexers)
+        finally:
+            executor.shutdown(wait=True)
+
+        return all(result.ok for result in self.results)
+
+    async def _put_batch(self, fetched, job, tweets):
+        self._batches[job] = self._batches.get(job, 0) + 1
+        await fetched.put((job, tweets))
+
+    def _batch_done(self, job, ok):
+        self._batches[job] -= 1
+        if not ok:
+            self._failed.add(job)
+        self._check_done(job)
+
+    def _check_done(self, job):
+        if job in self._fetched and not self._batches.get(job) and job not in self._failed:
+            self._fetched.discard(job)
+            on_done = getattr(job, 'on_done', None)
+            if on_done is not None:
+                on_done()
+
+    async def _fetch(self, loop, executor, job_queue, fetched):
+        while not job_queue.empty():
+            job = job_queue.get_nowait()
+
+            def emit(tweets, job=job):
+                # Called from the worker thread. Waits until the transform stage has room.
+                if len(tweets) > 0:
+                    asyncio.run_coroutine_threadsafe(
+                        self._put_batch(fetched, job, tweets), loop).result()
+
+            i = 0
+            while i < MAX_TRIES:
+                try:
+                    await loop.run_in_executor(executor, job, emit)
+                    self._fetched.add(job)
+                    self._check_done(job)
+                    break
+                except tweepy.errors.TooManyRequests:
+                    i += 1
+                    # Same schedule as in list mode, but only this worker waits.
+                    sleep_seconds = 61 * (i * i)
+                    endpoint = getattr(job, 'endpoint', 'unknown')
+                    self.twitter_api.metrics.inc('rate_limit_waits_total', endpoint=endpoint)
+                    self.twitter_api.metrics.inc('rate_limit_wait_seconds_total', sleep_seconds,
+                                                 endpoint=endpoint)
+                    print('{} | Ratelimit.. Sleeping for {} seconds.'.format(
+                        str(datetime.now().strftime('%Y-%m-%d %H:%M:%S')), sleep_seconds))
+                    if self.test:
+                        self.simulate_sleep.append(sleep_seconds)
+                    else:
+                        await asyncio.sleep(sleep_seconds)
+                except Exception as ex:
+                    print('{} | {}: {}'.format(
+                        str(datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+                        getattr(job, 'label', job), ex))
+                    print('----')
+                    # Errors of the job (e.g. protected account) do not repeat it.
+                    self._fetched.add(job)
+                    self._check_done(job)
+                    break
+
+    async def _transform(self, loop, executor, fetched, transformed):
+        while True:
+            item = await fetched.get()
+            if item is _DONE:
+                break
+            job, tweets = item
+            try:
+                bulk_string = await loop.run_in_executor(
+                    executor, self.twitter_api.create_es_bulk_string_from_timeline, tweets)
+            except Exception as ex:
+                # The stage goes on with the next batch. A dead consumer would leave the
+                # fetchers blocked on a full queue.
+                self._failed_batch('transform', ex)
+                self._batch_done(job, False)
+                continue
+            if bulk_string:
+                await transformed.put((job, bulk_string))
+            else:
+                self._batch_done(job, bulk_string is not False)
+
+    async def _index(self, loop, executor, transformed):
+        while True:
+            item = await transformed.get()
+            if item is _DONE:
+                break
+            job, bulk_string = item
+            try:
+                result = await loop.run_in_executor(
+                    executor, self.twitter_api.es_bulk, self.es_handle, bulk_string, self.debug)
+            except Exception as ex:
+                self._failed_batch('index', ex)
+                self._batch_done(job, False)
+                continue
+            self.results.append(result)
+            self._batch_done(job, result.ok)
+
+    def _failed_batch(self, stage, ex):
+        """ Records a batch lost in a stage, so that the run is reported as failed. """
+        print('{} | {} stage failed: {}'.format(
+            str(datetime.now().strftime('%Y-%m-%d %H:%M:%S')), stage, ex))
+        self.twitter_api.metrics.inc('pipeline_failed_batches_total', stage=stage)
+        result = BulkResult()
+        result.failed = 1
+        self.results.append(result)
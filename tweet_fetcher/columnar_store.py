@@ -0,0 +1,290 @@
+"""
+Columnar layout for stored tweet archives. Numeric fields are stored as fixed width arrays that
+can be memory-mapped. String fields are dictionary encoded: a JSON list of the distinct values and
+an array of integer codes. Multi valued fields (hashtags, domains) have an extra offsets array
+telling where the values of each tweet start.
+
+The export is incremental. Files already converted are skipped and new rows are appended to the
+columns. A tweet recorded in several files, or already in the archive, is exported once. The manifest, which holds the dictionaries, is written after every COMMIT_FILES files and
+at the end of the export, so a crash in the middle leaves the archive readable at the row count of
+the last manifest and the files after it are converted again by the next export.
+"""
+import json
+import mmap
+import os
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timezone
+
+import local_analytics
+
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+# Converted files per manifest write. The manifest grows with the dictionaries, writing it after
+# every file would make the export quadratic.
+COMMIT_FILES = 50
+
+# name: (array typecode, function extracting the value from a document)
+NUMERIC_COLUMNS = {
+    'id': ('q', lambda doc: doc['id']),
+    'timestamp': ('q', lambda doc: int(datetime.fromisoformat(doc['@timestamp'])
+                                       .replace(tzinfo=timezone.utc).timestamp())),
+    'time_of_day': ('i', lambda doc: doc['time_of_day']),
+    'favorite_count': ('q', lambda doc: doc.get('favorite_count') or 0),
+    'retweet_count': ('q', lambda doc: doc.get('retweet_count') or 0),
+    'user_id': ('q', lambda doc: int(doc['user']['id_str'])),
+    'is_retweet': ('b', lambda doc: int(doc['is_retweet_status'])),
+    'is_quote': ('b', lambda doc: int(doc['is_quote_status'])),
+}
+STRING_COLUMNS = {
+    'source': lambda doc: doc['source'],
+    'screen_name': lambda doc: doc['user']['screen_name'],
+}
+MULTI_STRING_COLUMNS = {
+    'hashtags': lambda doc: doc['entities']['hashtags'],
+    'domains': lambda doc: [url['display_url'] for url in doc['entities']['urls']],
+}
+CODE_TYPE = 'i'
+OFFSET_TYPE = 'q'
+
+
+def _column_files(name):
+    """ Data files belonging to a column and their typecodes. """
+    if name in NUMERIC_COLUMNS:
+        return [(name + '.col', NUMERIC_COLUMNS[name][0])]
+    if name in STRING_COLUMNS:
+        return [(name + '.codes', CODE_TYPE)]
+    return [(name + '.codes', CODE_TYPE), (name + '.offsets', OFFSET_TYPE)]
+
+
+def _file_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+class ColumnarWriter(object):
+    """ Appends documents to the columnar archive in out_dir. """
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        self.manifest = self._read_manifest()
+        self.rows = self.manifest['rows']
+        self.dictionaries = {}
+        for name in list(STRING_COLUMNS) + list(MULTI_STRING_COLUMNS):
+            values = self.manifest['dictionaries'].get(name, [])
+            self.dictionaries[name] = (values, dict((v, i) for i, v in enumerate(values)))
+        self.offsets = dict((name, self.manifest['offsets'].get(name, 0))
+                            for name in MULTI_STRING_COLUMNS)
+        self._truncate_to_manifest()
+        self.seen = self._read_ids()  # sorted ids of the rows in the archive
+        self.new_ids = set()
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.out_dir, MANIFEST), 'r') as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return {'version': FORMAT_VERSION, 'rows': 0, 'files': {}, 'dictionaries': {},
+                    'offsets': {}}
+
+    def _truncate_to_manifest(self):
+        """ Drops rows appended after the last completed export. """
+        for name in list(NUMERIC_COLUMNS) + list(STRING_COLUMNS):
+            file_name, typecode = _column_files(name)[0]
+            self._truncate(file_name, self.rows * array(typecode).itemsize)
+        for name in MULTI_STRING_COLUMNS:
+            self._truncate(name + '.codes', self.offsets[name] * array(CODE_TYPE).itemsize)
+            self._truncate(name + '.offsets', (self.rows + 1) * array(OFFSET_TYPE).itemsize)
+            if self.rows == 0:
+                with open(os.path.join(self.out_dir, name + '.offsets'), 'wb') as handle:
+                    array(OFFSET_TYPE, [0]).tofile(handle)
+
+    def _truncate(self, file_name, size):
+        path = os.path.join(self.out_dir, file_name)
+        with open(path, 'ab') as handle:
+            if handle.tell() > size:
+                handle.truncate(size)
+
+    def _read_ids(self):
+        ids = array(NUMERIC_COLUMNS['id'][0])
+        with open(os.path.join(self.out_dir, 'id.col'), 'rb') as handle:
+            ids.fromfile(handle, self.rows)
+        return array(ids.typecode, sorted(ids))
+
+    def is_seen(self, tweet_id):
+        position = bisect_left(self.seen, tweet_id)
+        if position < len(self.seen) and self.seen[position] == tweet_id:
+            return True
+        return tweet_id in self.new_ids
+
+    def _new_documents(self, batch):
+        """ The documents of the batch not in the archive yet, each id once. """
+        new = []
+        for doc in batch:
+            if not self.is_seen(doc['id']):
+                self.new_ids.add(doc['id'])
+                new.append(doc)
+        return new
+
+    def _encode(self, name, value):
+        values, lookup = self.dictionaries[name]
+        try:
+            return lookup[value]
+        except KeyError:
+            lookup[value] = len(values)
+            values.append(value)
+            return lookup[value]
+
+    def append_batch(self, batch):
+        """ Converts a batch of documents to columns and appends them to the files. Tweets
+        already exported are skipped. """
+        batch = self._new_documents(batch)
+        if not batch:
+            return
+        for name, (typecode, extract) in NUMERIC_COLUMNS.items():
+            self._append(name + '.col', array(typecode, map(extract, batch)))
+        for name, extract in STRING_COLUMNS.items():
+            self._append(name + '.codes',
+                         array(CODE_TYPE, [self._encode(name, extract(doc)) for doc in batch]))
+        for name, extract in MULTI_STRING_COLUMNS.items():
+            codes = array(CODE_TYPE)
+            offsets = array(OFFSET_TYPE)
+            end = self.offsets[name]
+            for doc in batch:
+                values = extract(doc)
+                codes.extend(self._encode(name, value) for value in values)
+                end += len(values)
+                offsets.append(end)
+            self.offsets[name] = end
+            self._append(name + '.codes', codes)
+            self._append(name + '.offsets', offsets)
+        self.rows += len(batch)
+
+    def _append(self, file_name, values):
+        with open(os.path.join(self.out_dir, file_name), 'ab') as handle:
+            values.tofile(handle)
+
+    def is_exported(self, file_path):
+        return self.manifest['files'].get(os.path.abspath(file_path)) == \
+            _file_signature(file_path)
+
+    def mark_exported(self, file_path):
+        self.manifest['files'][os.path.abspath(file_path)] = _file_signature(file_path)
+
+    def commit(self):
+        """ Stores the manifest. Rows appended before this are part of the archive. """
+        self.manifest['rows'] = self.rows
+        self.manifest['offsets'] = self.offsets
+        self.manifest['dictionaries'] = dict((name, values) for name, (values, _) in
+                                             self.dictionaries.items())
+        path = os.path.join(self.out_dir, MANIFEST)
+        with open(path + '.tmp', 'w') as handle:
+            json.dump(self.manifest, handle)
+        os.replace(path + '.tmp', path)
+
+
+def export_columnar(src_path, out_dir, batch_size=local_analytics.BATCH_SIZE,
+                    commit_files=COMMIT_FILES, debug=False):
+    """ Converts the stored bulk files under src_path to the columnar archive in out_dir. Files
+    converted by earlier runs are skipped. Returns the number of new rows. """
+    writer = ColumnarWriter(out_dir)
+    start_rows = writer.rows
+    uncommitted = 0
+    for file_path in local_analytics.stored_files(src_path):
+        if writer.is_exported(file_path):
+            if debug:
+                print('Skipping already exported file [{}]'.format(file_path))
+            continue
+        for batch in local_analytics.iter_batches(file_path, batch_size):
+            writer.append_batch(batch)
+        writer.mark_exported(file_path)
+        uncommitted += 1
+        if uncommitted >= commit_files:
+            writer.commit()
+            uncommitted = 0
+        if debug:
+            print('Exported [{}]: {} rows in the archive'.format(file_path, writer.rows))
+    if uncommitted:
+        writer.commit()
+    return writer.rows - start_rows
+
+
+def is_columnar_archive(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST))
+
+
+class ColumnarArchive(object):
+    """ Read access to a columnar archive. Columns are memory-mapped when first used. """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST), 'r') as handle:
+            self.manifest = json.load(handle)
+        self.rows = self.manifest['rows']
+        self._maps = []
+        self._views = []
+
+    def _map(self, file_name, typecode, length):
+        if length == 0:
+            return memoryview(array(typecode))
+        with open(os.path.join(self.directory, file_name), 'rb') as handle:
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        view = memoryview(mapped)
+        sliced = view[:length * array(typecode).itemsize]
+        column = sliced.cast(typecode)
+        self._views.extend([view, sliced, column])
+        return column
+
+    def column(self, name):
+        """ The values of a numeric column as a read-only memoryview. """
+        return self._map(name + '.col', NUMERIC_COLUMNS[name][0], self.rows)
+
+    def dictionary(self, name):
+        """ Distinct values of a string column. Codes index into this list. """
+        return self.manifest['dictionaries'][name]
+
+    def codes(self, name):
+        """ Dictionary codes of a string column. For multi valued columns these are the codes of
+        all values of all rows, use offsets() to split them per row. """
+        if name in MULTI_STRING_COLUMNS:
+            return self._map(name + '.codes', CODE_TYPE, self.manifest['offsets'][name])
+        return self._map(name + '.codes', CODE_TYPE, self.rows)
+
+    def offsets(self, name):
+        """ Row i of a multi valued column has the codes codes[offsets[i]:offsets[i + 1]]. """
+        return self._map(name + '.offsets', OFFSET_TYPE, self.rows + 1)
+
+    def close(self):
+        """ Unmaps the columns. Views returned earlier can not be used after this. """
+        for view in reversed(self._views):
+            view.release()
+        for mapped in self._maps:
+            mapped.close()
+        self._views = []
+        self._maps = []
+
+
+def analyse_columnar(directory, max_distinct=local_analytics.MAX_DISTINCT):
+    """ Runs the local analysis from the columnar archive. Only the needed columns are read and
+    the counting happens on integer codes. """
+    archive = ColumnarArchive(directory)
+    analysis = local_analytics.TweetAnalysis(max_distinct=max_distinct)
+    analysis.total = archive.rows
+    if archive.rows == 0:
+        return analysis
+
+    try:
+        analysis.retweets = sum(archive.column('is_retweet'))
+        analysis.quotes = sum(archive.column('is_quote'))
+        for seconds, count in Counter(archive.column('time_of_day')).items():
+            analysis.hours[seconds // 3600] += count
+        for counter_name, column_name in (('hashtags', 'hashtags'), ('domains', 'domains'),
+                                          ('source', 'source'), ('user', 'screen_name')):
+            values = archive.dictionary(column_name)
+            code_counts = Counter(archive.codes(column_name))
+            analysis.counters[counter_name] = Counter(
+                dict((values[code], count) for code, count in code_counts.items()))
+    finally:
+        archive.close()
+    return analysis
@@ -0,0 +1,170 @@
+"""
+Pool of Twitter API credentials. Every request is sent with the credential that has the most
+quota left for the endpoint, as reported by the rate limit headers of its earlier responses. A
+credential that gets rate limited is skipped for that endpoint until its window resets, and a
+credential that is rejected as unauthorized is dropped from the pool. The request fails only when
+no credential can serve it.
+
+The credentials are configured as extra sections next to [Twitter API]:
+
+    [Twitter API second_app]
+    api_key = ...
+"""
+import copy
+import threading
+import time
+
+import tweepy
+import tweepy.errors
+from tweepy import API
+
+SECTION_PREFIX = 'Twitter API '
+# Used when a rate limited response does not tell when the window resets.
+DEFAULT_WINDOW_SECONDS = 15 * 60
+
+
+def make_auth(api_conf):
+    """ OAuth handler from a section or dict with the api keys and access tokens. """
+    t_auth = tweepy.OAuthHandler(api_conf['api_key'], api_conf['api_secret'])
+    t_auth.set_access_token(api_conf['acc_token'], api_conf['acc_secret'])
+    return t_auth
+
+
+def credential_sections(config):
+    """ Names of the extra credential sections of the configuration. """
+    return [section for section in config.sections() if section.startswith(SECTION_PREFIX)]
+
+
+class Credential(object):
+    """ One set of keys and what is known about its quota per endpoint. """
+    def __init__(self, name, auth):
+        self.name = name
+        self.auth = auth
+        self.api = None
+        self.limits = {}  # endpoint -> (remaining, reset epoch seconds)
+        self.revoked = False
+
+    def remaining(self, endpoint, now):
+        """ Remaining calls, None when unknown or the window has reset since. """
+        try:
+            remaining, reset = self.limits[endpoint]
+        except KeyError:
+            return None
+        if reset is not None and reset <= now:
+            return None
+        return remaining
+
+
+class CredentialPool(object):
+    """ Chooses the credential of each request. Thread safe. """
+    def __init__(self, credentials, clock=time.time):
+        self.credentials = list(credentials)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.rate_limit_error = None
+
+    @classmethod
+    def from_config(cls, config, default_conf=None):
+        """ Pool of the default credential (the [Twitter API] section or the environment) and the
+        [Twitter API <name>] sections. """
+        credentials = []
+        if default_conf is not None:
+            credentials.append(Credential('default', make_auth(default_conf)))
+        for section in credential_sections(config):
+            credentials.append(Credential(section[len(SECTION_PREFIX):],
+                                          make_auth(config[section])))
+        return cls(credentials)
+
+    def choose(self, endpoint, exclude=()):
+        """ The usable credential with the most quota left. Unknown quota counts as a full window.
+        Returns None when every credential is exhausted or revoked. """
+        now = self.clock()
+        best = None
+        best_remaining = None
+        with self.lock:
+            for credential in self.credentials:
+                if credential.revoked or credential.name in exclude:
+                    continue
+                remaining = credential.remaining(endpoint, now)
+                if remaining is not None and remaining <= 0:
+                    continue
+                if best is None or remaining is None or \
+                        (best_remaining is not None and remaining > best_remaining):
+                    best = credential
+                    best_remaining = remaining
+                    if remaining is None:
+                        break
+        return best
+
+    def update(self, credential, endpoint, headers):
+        """ Stores the quota reported by the rate limit headers of a response. """
+        if headers is None or 'x-rate-limit-remaining' not in headers:
+            return
+        reset = headers.get('x-rate-limit-reset')
+        with self.lock:
+            credential.limits[endpoint] = (int(headers['x-rate-limit-remaining']),
+                                           int(reset) if reset is not None else None)
+
+    def exhausted(self, credential, endpoint, headers=None):
+        """ Marks the endpoint used up for the credential until its window resets. """
+        reset = None
+        if headers is not None:
+            reset = headers.get('x-rate-limit-reset')
+        reset = int(reset) if reset is not None else int(self.clock()) + DEFAULT_WINDOW_SECONDS
+        with self.lock:
+            credential.limits[endpoint] = (0, reset)
+
+    def revoke(self, credential):
+        with self.lock:
+            credential.revoked = True
+
+    def _api_for(self, api, credential):
+        """ A shallow copy of the API object using the credential. The copies share the session
+        but not the auth, so parallel requests do not interfere. """
+        if credential.api is None:
+            credential.api = copy.copy(api)
+            credential.api.auth = credential.auth
+            credential.api.credential_pool = None
+        return credential.api
+
+    def credential_apis(self, api):
+        """ API objects of the usable credentials. """
+        return [self._api_for(api, credential) for credential in self.credentials
+                if not credential.revoked]
+
+    def request(self, api, method, endpoint, *args, **kwargs):
+        """ Sends the request with the best credential. Fails over to the next one when the
+        credential is rate limited or unauthorized. """
+        tried = set()
+        last_error = None
+        while True:
+            credential = self.choose(endpoint, exclude=tried)
+            if credential is None:
+                # Rate limited credentials come back, so callers may wait and retry.
+                if self.rate_limit_error is not None and \
+                        any(not c.revoked for c in self.credentials):
+                    raise self.rate_limit_error
+                if last_error is not None:
+                    raise last_error
+                raise tweepy.errors.TweepyException('No usable credentials for %s' % endpoint)
+            tried.add(credential.name)
+            credential_api = self._api_for(api, credential)
+            try:
+                result = API.request(credential_api, method, endpoint, *args, **kwargs)
+            except tweepy.errors.TooManyRequests as err:
+                self.exhausted(credential, endpoint, getattr(err.response, 'headers', None))
+                self.rate_limit_error = err
+                api.metrics.inc('credential_failovers_total', reason='rate_limit')
+                last_error = err
+                continue
+            except tweepy.errors.Unauthorized as err:
+                print('Credential %s was rejected. Removing it from the pool.' % credential.name)
+                self.revoke(credential)
+                api.metrics.inc('credential_failovers_total', reason='unauthorized')
+                last_error = err
+                continue
+            finally:
+                api.last_response = getattr(credential_api, 'last_response', None)
+            self.update(credential, endpoint, getattr(api.last_response, 'headers', None))
+            api.metrics.inc('credential_requests_total', credential=credential.name)
+            return result
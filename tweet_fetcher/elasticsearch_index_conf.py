@@ -2,7 +2,30 @@
 Functions for setting up an ElasticSearch index for tweets
 """
 
-def set_es_index(index_name, es_handle, debug = False):
+# Not indexed and without doc values. The value is only shown with the document.
+DISPLAY_ONLY_KEYWORD = {"type": "keyword", "index": False, "doc_values": False}
+DISPLAY_ONLY_LONG = {"type": "long", "index": False, "doc_values": False}
+# Stored in _source only. Nothing inside is parsed.
+BLOB = {"type": "object", "enabled": False}
+
+
+def user_properties():
+    """ Mapping of the trimmed user object. """
+    return {
+        "id_str": {"type": "keyword"},
+        "name": {"type": "keyword"},
+        "screen_name": {"type": "keyword"},
+        "location": {"type": "keyword"},
+        "description": {"type": "text"},
+        "protected": {"type": "boolean"},
+        "followers_count": {"type": "long"},
+        "utc_offset": {"type": "integer"},
+        "created_at": {"type": "date"}
+    }
+
+
+def set_es_index(index_name, es_handle, debug = False, projection = None,
+                 best_compression = False, sort_by_timestamp = False):
     """ Set the index to be used. """
 
     if es_handle.indices.exists(index=index_name):
@@ -11,10 +34,139 @@ def set_es_index(index_name, es_handle, debug = False):
     else:
         if debug:
             print("index %s must be created" % index_name)
-        create_index(index_name, es_handle)
+        create_index(index_name, es_handle, projection, best_compression, sort_by_timestamp)
+
+def create_index(index_name, es_handle, projection = None, best_compression = False,
+                 sort_by_timestamp = False):
+    """ Creats a new index with given name. Uses standard config. Fields left out by the
+    projection profile are left out of the mapping too. """
+    request_body = index_body(projection, best_compression, sort_by_timestamp)
+    return es_handle.indices.create(index=index_name, body = request_body)
+
+def index_options(es_conf):
+    """ Index creation options from the [ElasticSearch] section. """
+    return {
+        "best_compression": es_conf.get("index_codec", "default") == "best_compression",
+        "sort_by_timestamp": es_conf.getboolean("index_sort_by_timestamp", fallback = False)
+    }
+
+def index_body(projection = None, best_compression = False, sort_by_timestamp = False):
+    """ Settings and mappings of a new tweet index. Every field the transform leaves in the
+    document is mapped explicitly. Strings not listed are keywords, so no text plus keyword
+    multi-fields are created dynamically. Optionally the stored fields use best_compression and
+    the segments are sorted by @timestamp, newest first. """
+    settings = {
+        "number_of_replicas": 0
+    }
+    if best_compression:
+        settings["index.codec"] = "best_compression"
+    if sort_by_timestamp:
+        settings["index.sort.field"] = "@timestamp"
+        settings["index.sort.order"] = "desc"
+
+    request_body = {
+        "settings": settings,
+        "mappings": {
+            "dynamic_templates": [
+                {
+                    "strings_as_keywords": {
+                        "match_mapping_type": "string",
+                        "mapping": {"type": "keyword", "ignore_above": 1024}
+                    }
+                }
+            ],
+            "properties": {
+                "@timestamp": {"type": "date"},
+                "id": {"type": "long"},
+                "id_str": {"type": "keyword"},
+                "full_text": {"type": "text"},
+                "source": {"type": "keyword"},
+                "lang": {"type": "keyword"},
+                "time_of_day": {"type": "integer"},
+                "favorite_count": {"type": "long"},
+                "retweet_count": {"type": "long"},
+                "favorited": {"type": "boolean"},
+                "retweeted": {"type": "boolean"},
+                "truncated": {"type": "boolean"},
+                "possibly_sensitive": {"type": "boolean"},
+                "is_quote_status": {"type": "boolean"},
+                "is_retweet_status": {"type": "boolean"},
+                "search_terms": {"type": "keyword"},
+                "display_text_range": DISPLAY_ONLY_LONG,
+                "in_reply_to_screen_name": {"type": "keyword"},
+                "in_reply_to_status_id": DISPLAY_ONLY_LONG,
+                "in_reply_to_status_id_str": {"type": "keyword"},
+                "in_reply_to_user_id": DISPLAY_ONLY_LONG,
+                "in_reply_to_user_id_str": {"type": "keyword"},
+                "quoted_status_id": DISPLAY_ONLY_LONG,
+                "quoted_status_id_str": {"type": "keyword"},
+                "quoted_status_permalink": BLOB,
+                "place": BLOB,
+                "geo": BLOB,
+                "coordinates": BLOB,
+                "contributors": BLOB,
+                "user": {"properties": user_properties()},
+                "retweeted_status": {
+                    "properties": {
+                        "id_str": {"type": "keyword"},
+                        "created_at": {"type": "date"},
+                        "user": {"properties": user_properties()}
+                    }
+                },
+                "quoted_status": {
+                    "properties": {
+                        "created_at": {"type": "date"},
+                        "user": {"properties": user_properties()}
+                    }
+                },
+                "entities": {
+                    "properties": {
+                        "hashtags": {"type": "keyword"},
+                        "symbols": BLOB,
+                        "urls": {
+                            "properties": {
+                                "display_url": {"type": "keyword"},
+                                "expanded_url": {"type": "keyword"},
+                                "url": DISPLAY_ONLY_KEYWORD,
+                                "indices": DISPLAY_ONLY_LONG
+                            }
+                        },
+                        "user_mentions": {
+                            "properties": {
+                                "screen_name": {"type": "keyword"},
+                                "id_str": {"type": "keyword"},
+                                "name": DISPLAY_ONLY_KEYWORD,
+                                "id": DISPLAY_ONLY_LONG,
+                                "indices": DISPLAY_ONLY_LONG
+                            }
+                        },
+                        "media": {
+                            "properties": {
+                                "expanded_url": {"type": "keyword"},
+                                "source_status_id_str": {"type": "keyword"},
+                                "source_user_id_str": {"type": "keyword"},
+                                "type": {"type": "keyword"},
+                                "id": DISPLAY_ONLY_LONG,
+                                "url": DISPLAY_ONLY_KEYWORD,
+                                "indices": DISPLAY_ONLY_LONG,
+                                "source_status_id": DISPLAY_ONLY_LONG,
+                                "source_user_id": DISPLAY_ONLY_LONG
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+    if projection is not None:
+        projection.prune_mapping(request_body["mappings"]["properties"])
+    return request_body
 
-def create_index(index_name, es_handle):
-    """ Creats a new index with given name. Uses standard config. """
+
+def dynamic_index_body():
+    """ The earlier mapping: a few fields mapped, the rest mapped dynamically. Kept as the
+    baseline of the mapping benchmark. """
     request_body = {
         "settings": {
             "number_of_replicas": 0
@@ -66,6 +218,9 @@ def create_index(index_name, es_handle):
                 "source": {
                     "type": "keyword"
                 },
+                "search_terms": {
+                    "type": "keyword"
+                },
                 "time_of_day": {
                     "type": "long"
                 },
@@ -85,4 +240,32 @@ def create_index(index_name, es_handle):
         }
     }
 
-    return es_handle.indices.create(index=index_name, body = request_body)
+    return request_body
+
+def set_rollup_index(index_name, es_handle, debug = False):
+    """ Set up the companion index of the hourly rollups. """
+    if es_handle.indices.exists(index=index_name):
+        if debug:
+            print("rollup index %s exists" % index_name)
+    else:
+        if debug:
+            print("rollup index %s must be created" % index_name)
+        es_handle.indices.create(index=index_name, body = rollup_index_body())
+
+def rollup_index_body():
+    """ Settings and mappings of the rollup index. One document per hour, dimension and value. """
+    return {
+        "settings": {
+            "number_of_replicas": 0
+        },
+        "mappings": {
+            "dynamic": "strict",
+            "properties": {
+                "@timestamp": {"type": "date"},
+                "hour_of_day": {"type": "byte"},
+                "dimension": {"type": "keyword"},
+                "value": {"type": "keyword"},
+                "count": {"type": "long"}
+            }
+        }
+    }
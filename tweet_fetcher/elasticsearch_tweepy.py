@@ -1,88 +1,234 @@
 from tweepy import API
 from elasticsearch import Elasticsearch
 from datetime import timedelta, datetime
-from elasticsearch_index_conf import set_es_index
+from elasticsearch_index_conf import set_es_index, set_rollup_index
 from time import sleep
+from itertools import islice
 
+import json
 import tweepy.errors
 import twitter_es_schema
+import async_pipeline
+import multi_term
+import hydrate
+import engagement
+import sharding
+from search_budget import MAX_SEARCH_PAGES, PAGE_SIZE
+from friend_graph import FriendGraph
+from es_bulk import BulkResult, push_bulk, bulk_item_ids
+from pipeline_metrics import METRICS
+from tracing import NULL_TRACER
 
 MAX_TRIES = 5
 
 class ElasticSearchTweepy(API):
     """Extention to tweepy's Twitter API. It provides Functions for integrating with ElasticSearch."""
+    metrics = METRICS
+    tracer = NULL_TRACER
+    dead_letter_path = None
+    spool = None
+    graph = None
+    projection = None
+    raw_archive = None
+    search_budget = None
+    credential_pool = None
+    index_options = {}
+    rollup = None
+    last_bulk_result = None
+    last_search_resume_id = None
+
+    def request(self, method, endpoint, *args, **kwargs):
+        """ All API calls pass here. With a credential pool the pool picks the credential. """
+        if self.credential_pool is None:
+            return API.request(self, method, endpoint, *args, **kwargs)
+        return self.credential_pool.request(self, method, endpoint, *args, **kwargs)
 
     def set_this_es_index(self, index_name, es_handle, debug = False):
         """ Set the index to be used. """
         self.index = index_name
 
-        set_es_index(self.index, es_handle=es_handle, debug=debug)
+        set_es_index(self.index, es_handle=es_handle, debug=debug, projection=self.projection,
+                     **self.index_options)
 
-    def create_es_bulk_string_from_timeline(self, timeline):
-        """ Create a string that can be pushed to ElasticSearch bulk API from a timeline. """
+    def create_es_bulk_string_from_timeline(self, timeline, search_terms = None, to_file = False):
+        """ Create a string that can be pushed to ElasticSearch bulk API from a timeline. When
+        search_terms (tweet id -> matched terms) is given, the terms are added to the documents
+        as the search_terms field. The graph and the rollup get the full documents, the
+        projection only shapes what is sent to ElasticSearch. With to_file the documents are
+        recorded for the local tools, they are neither projected nor staged for the rollup. """
         bulk_string = ""
+        if self.raw_archive is not None:
+            # populate modifies the tweet objects, archive them before.
+            with self.tracer.span('raw_archive'):
+                self.raw_archive.append_batch(tweet._json for tweet in timeline)
         for tweet in timeline:
             raw_tweet = tweet._json
             schema = twitter_es_schema.TwitterEsSchema()
             try:
-                schema.populate(raw_tweet)
-                bulk_string += '{ "index": { "_id": %d} }\n' % raw_tweet['id']
-                bulk_string += '%s\n' % schema.get_json()
+                with self.tracer.span('populate'):
+                    schema.populate(raw_tweet)
+                if search_terms is not None:
+                    schema.tweet['search_terms'] = search_terms.get(raw_tweet['id'], [])
+                if self.graph is not None:
+                    self.graph.add_document(schema.tweet)
+                if not to_file:
+                    if self.rollup is not None:
+                        self.rollup.stage(schema.tweet)
+                    if self.projection is not None:
+                        self.projection.apply(schema.tweet)
+                with self.tracer.span('json_encode'):
+                    bulk_string += '{ "index": { "_id": %d} }\n' % raw_tweet['id']
+                    bulk_string += '%s\n' % schema.get_json()
             except ValueError:
                 print("...")
+                self.metrics.inc('tweets_skipped_total')
+                if self.rollup is not None and not to_file:
+                    self.rollup.discard(tweet._json['id'] for tweet in timeline)
                 return False
+            self.metrics.inc('tweets_transformed_total')
 
         return bulk_string
 
+    def es_bulk(self, es_handle, bulk_string, debug = False):
+        """ Calls ElasticSearch bulk API. Rejected items are retried and permanently failed items
+        are written to the dead-letter file. Returns a BulkResult. When a spool is in use the
+        bulk string is only appended to it and the spool's drainer takes care of the rest,
+        including the rollups of the documents. """
+        if self.spool is not None:
+            if bulk_string:
+                with self.tracer.span('spool_append'):
+                    self.spool.append(self.index, bulk_string)
+            self.last_bulk_result = BulkResult()
+            return self.last_bulk_result
+        try:
+            self.last_bulk_result = push_bulk(es_handle, bulk_string, self.index,
+                                              dead_letter_path=self.dead_letter_path,
+                                              metrics=self.metrics, tracer=self.tracer,
+                                              debug=debug)
+        except Exception:
+            if self.rollup is not None:
+                self.rollup.discard(bulk_item_ids(bulk_string))
+            raise
+        if self.rollup is not None:
+            self.rollup.commit(self.last_bulk_result.created, self.last_bulk_result.item_ids)
+            self.flush_rollup(es_handle, debug = debug)
+        return self.last_bulk_result
+
+    def flush_rollup(self, es_handle, debug = False):
+        """ Upserts the hourly rollup buckets to the rollup index. The counts of a failed flush
+        are sent with the next one. """
+        rollup_string, buckets = self.rollup.bulk_string()
+        if not rollup_string:
+            return
+        try:
+            with self.tracer.span('rollup_flush'):
+                result = push_bulk(es_handle, rollup_string, self.rollup.index,
+                                   dead_letter_path=self.dead_letter_path,
+                                   metrics=self.metrics, tracer=self.tracer, debug=debug)
+        except Exception as ex:
+            print('Flushing the rollups failed: %s' % ex)
+            self.rollup.restore(buckets)
+            return
+        self.metrics.inc('rollup_upserts_total', result.succeeded)
+
+    def fetch_user_timeline(self, target_handle, _count=200, with_id=True,
+                            _tweet_mode="extended", debug=False):
+        """ Fetches the timeline of a single user. """
+        self.metrics.inc('api_calls_total', endpoint='user_timeline')
+        with self.tracer.span('twitter_fetch', endpoint='user_timeline'):
+            if with_id:
+                user_timeline = self.user_timeline(
+                    user_id=target_handle, count=_count, tweet_mode=_tweet_mode)
+            else:
+                user_timeline = self.user_timeline(
+                    screen_name=target_handle, count=_count, tweet_mode=_tweet_mode)
+        self.metrics.inc('tweets_fetched_total', len(user_timeline))
+
+        if debug:
+            print("Fetched %d tweets from user: %s" % (len(user_timeline), target_handle))
+
+        return user_timeline
+
+    def spool_pusher(self, es_handle, debug = False):
+        """ Returns the function used by the spool drainer to ship a batch. The index is created
+        before the first batch is shipped to it. Items that can never be indexed are written to
+        the dead-letter file, the one in the spool directory when dead_letter_path is not set,
+        and the batch is acknowledged. The function raises when the request failed or items were
+        still rejected with a retryable status, so that the drainer keeps the segment and ships
+        the batch again. The rollups are counted from the responses of the tweet index and
+        flushed after each batch. """
+        ready = set()
+        dead_letter_path = self.dead_letter_path
+        if dead_letter_path is None and self.spool is not None:
+            dead_letter_path = self.spool.dead_letter_path
+
+        def push(index, bulk_string):
+            if index not in ready:
+                if self.rollup is not None and index == self.rollup.index:
+                    set_rollup_index(index, es_handle, debug=debug)
+                else:
+                    set_es_index(index, es_handle=es_handle, debug=debug,
+                                 projection=self.projection, **self.index_options)
+                ready.add(index)
+            counted = self.rollup is not None and index == self.index
+            if counted:
+                self.rollup.stage_bulk(bulk_string)
+            result = push_bulk(es_handle, bulk_string, index, dead_letter_path=dead_letter_path,
+                               metrics=self.metrics, tracer=self.tracer,
+                               dead_letter_retryable=False, debug=debug)
+            if counted:
+                # Items rejected now are staged again from the bulk string when the batch is
+                # shipped again.
+                self.rollup.commit(result.created, result.item_ids)
+                self.flush_rollup(es_handle, debug = debug)
+            if result.failed > result.dead_lettered:
+                raise RuntimeError('%d items were not indexed to %s' % (
+                    result.failed - result.dead_lettered, index))
+
+        return push
+
     def user_timeline_to_es(self, target_handle, es_handle, _count=200,
                             with_id=True, _tweet_mode="extended", debug=False):
         """ Fetches timeline from a single user and pushes the tweets using ElasticSearch
         Bulk command. """
 
-        if with_id:
-            user_timeline = self.user_timeline(
-                user_id=target_handle, count=_count, tweet_mode=_tweet_mode)
-        else:
-            user_timeline = self.user_timeline(
-                screen_name=target_handle, count=_count, tweet_mode=_tweet_mode)
-
-        if debug:
-            print("Fetched %d tweets from user: %s" % (len(user_timeline), target_handle))
-
-        bulk_string = self.create_es_bulk_string_from_timeline(user_timeline)
+        user_timeline = self.fetch_user_timeline(target_handle, _count=_count, with_id=with_id,
+                                                 _tweet_mode=_tweet_mode, debug=debug)
 
-        res = es_handle.bulk(bulk_string, index=self.index)
+        with self.tracer.span('transform'):
+            bulk_string = self.create_es_bulk_string_from_timeline(user_timeline)
 
-        if res['errors']:
-            if debug:
-                print("At least some ingests FAILED!")
-            return False
-        else:
-            if debug:
-                print("Clean run!")
-        return True
+        return self.es_bulk(es_handle, bulk_string, debug = debug).ok
 
     def user_timeline_to_file(self, target_handle, file_path, _count=200, _tweet_mode="extended",
                               debug=False):
         """ Fetches timeline from a single user and stores the tweets to a file. """
         file_path_stamp = ''
 
-        user_timeline = self.user_timeline(
-            target_handle, count=_count, tweet_mode=_tweet_mode)
+        self.metrics.inc('api_calls_total', endpoint='user_timeline')
+        with self.tracer.span('twitter_fetch', endpoint='user_timeline'):
+            user_timeline = self.user_timeline(
+                target_handle, count=_count, tweet_mode=_tweet_mode)
+        self.metrics.inc('tweets_fetched_total', len(user_timeline))
 
         if debug:
             print("Fetched %d tweets from user: %s" % (len(user_timeline), target_handle))
 
         if len(user_timeline) > 0:        # In case there was no results. Do nothing.
-            bulk_string = self.create_es_bulk_string_from_timeline(user_timeline)
+            with self.tracer.span('transform'):
+                bulk_string = self.create_es_bulk_string_from_timeline(user_timeline,
+                                                                       to_file = True)
             file_path_stamp = file_path + datetime.now().strftime("-%y%m%d-%H%M%S") + '.txt'
             with open(file_path_stamp, 'w') as handle:
                 handle.write(bulk_string)
 
         return file_path_stamp
 
-    def list_timeline_to_es(self, storage_path, parallels, es_handle, debug= False, test = False):
-        """ Fetches timelines of all users listed in the given file. """
+    def list_timeline_to_es(self, storage_path, parallels, es_handle, debug= False, test = False,
+                            shard = None):
+        """ Fetches timelines of all users listed in the given file. With a shard only the users
+        of the shard are fetched and the users done are checkpointed, so a restarted run
+        continues the pass where it stopped. """
 
         if test:
             self.simulate_sleep = []
@@ -91,12 +237,26 @@ class ElasticSearchTweepy(API):
             for line in handle:
                 target_list.append(int(line))
 
+        checkpoint = None
+        if shard is not None:
+            target_list = shard.select(target_list)
+            checkpoint = sharding.ListCheckpoint(shard.checkpoint_path(storage_path))
+            if debug:
+                print('Shard %d/%d has %d users, %d done earlier' % (
+                    shard.k, shard.n, len(target_list), len(checkpoint.done)))
+        incomplete = 0
+
         for target_id in target_list:
+            if checkpoint is not None and target_id in checkpoint.done:
+                continue
+            done = False
             i = 0
             while i < MAX_TRIES:
                 try:
-                    self.user_timeline_to_es(target_id, es_handle=es_handle,
-                                             debug=debug)
+                    with self.tracer.span('user', user_id=target_id):
+                        self.user_timeline_to_es(target_id, es_handle=es_handle,
+                                                 debug=debug)
+                    done = True
                     break
                 except tweepy.errors.TooManyRequests:
                     print('{} | Ratelimit.. Waiting...'.format(
@@ -106,6 +266,9 @@ class ElasticSearchTweepy(API):
                     i += 1
                     # Note: This is NOT exponential back off, but it suits well here.
                     sleep_seconds = 61 * (i * i)
+                    self.metrics.inc('rate_limit_waits_total', endpoint='user_timeline')
+                    self.metrics.inc('rate_limit_wait_seconds_total', sleep_seconds,
+                                     endpoint='user_timeline')
                     print('{} | Sleeping for {} seconds.'.format(
                         str(datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
                         sleep_seconds
@@ -122,10 +285,30 @@ class ElasticSearchTweepy(API):
                     )
                     )
                     print('----')
+                    # Errors of the user (e.g. protected account) do not repeat the user.
+                    done = isinstance(ex, Exception)
                     break
-
+            if checkpoint is not None:
+                if done:
+                    checkpoint.mark(target_id)
+                else:
+                    incomplete += 1
+
+        if checkpoint is not None and incomplete == 0:
+            checkpoint.finish()
         return True
 
+    def pipeline_to_es(self, jobs, es_handle, parallels=1, queue_size=None, debug=False,
+                       test=False):
+        """ Runs the fetch jobs through the asynchronous fetch -> transform -> index pipeline.
+        Fetching overlaps indexing and a slow cluster slows down fetching. """
+        pipeline = async_pipeline.TweetPipeline(self, es_handle, fetch_workers=parallels,
+                                                queue_size=queue_size, debug=debug, test=test)
+        ret = pipeline.run(jobs)
+        if test:
+            self.simulate_sleep = pipeline.simulate_sleep
+        return ret
+
     def get_most_recent_id_from_es():
         """ Query the id of the most recent tweet from ElasticSearch. In case no matches
         in the search return -1. """
@@ -138,7 +321,7 @@ class ElasticSearchTweepy(API):
 
     def get_id_most_recent_tweet_in_es_index(self, es_handle, debug = False):
         """ Returns the ID of the tweet with most recent @timestamp in the index. Returns -1,
-        when index is empty. """
+        when index is empty or, with a spool, when the cluster cannot be reached. """
         query = """
         {
             "query":
@@ -154,7 +337,17 @@ class ElasticSearchTweepy(API):
                     ]
         }
         """
-        most_recent_tweet = es_handle.search(index=self.index, body = query)
+        try:
+            with self.tracer.span('es_search'), \
+                    self.metrics.timer('es_latency_seconds', operation='search'):
+                most_recent_tweet = es_handle.search(index=self.index, body = query)
+        except Exception as ex:
+            if self.spool is None:
+                raise
+            # The writes are spooled, so the run can go on without the cluster. Already indexed
+            # tweets are fetched again and only overwrite their documents.
+            print('ElasticSearch is not available (%s). Searching without since_id.' % ex)
+            return '-1'
 
         try:
             # Fetch the time of the previous search from the ElasticSearch
@@ -169,57 +362,111 @@ class ElasticSearchTweepy(API):
 
         return most_recent_id
 
-    def fetch_search_results_from_twitter(self, search_term, most_recent_id, debug = False):
+    def fetch_search_results_from_twitter(self, search_term, most_recent_id, debug = False,
+                                          page_callback = None, max_pages = None, max_id = -1):
         """ Fetches some tweets matching to search term. Returns them as a list of JSON objects
-        in a string.
+        in a string. When page_callback is given each page is handed to it as soon as it has been
+        fetched instead of collecting them to the returned list. The number of pages is planned
+        by search_budget when one is set, otherwise at most max_pages are fetched. The pages
+        come newest first, starting from max_id when it is given. When the search stops before
+        the results run out, last_search_resume_id is set to the max_id it would continue from,
+        otherwise it is None.
         https://developer.twitter.com/en/docs/twitter-api/v1/tweets/search/api-reference/get-search-tweets """
-        current_id = -1
+        current_id = max_id
+        complete = False
         search_results = []
+        budget = self.search_budget
+        if max_pages is None:
+            max_pages = budget.pages_for(search_term) if budget is not None else MAX_SEARCH_PAGES
+        if debug:
+            print('Page budget of %s: %d' % (search_term, max_pages))
 
-        for i in range(80):
+        i = 0
+        fetched = 0
+        while i < max_pages:
             if debug:
                 print(i, end=', ', flush = True)
+            self.metrics.inc('api_calls_total', endpoint='search')
             try:
-                current_results = self.search(search_term, count=100, result_type='recent',
-                                              max_id=current_id, since_id=most_recent_id)
+                with self.tracer.span('twitter_fetch', endpoint='search', page=i):
+                    current_results = self.search(search_term, count=100, result_type='recent',
+                                                  max_id=current_id, since_id=most_recent_id)
             except tweepy.errors.TooManyRequests:
                 print('Rate limit exceeded!')
+                self.metrics.inc('rate_limit_hits_total', endpoint='search')
+                if budget is not None:
+                    budget.remaining = 0
                 break
+            finally:
+                if budget is not None and self.credential_pool is None:
+                    last_response = getattr(self, 'last_response', None)
+                    budget.consume(getattr(last_response, 'headers', None))
+                elif budget is not None:
+                    # The headers only tell the quota of one credential of the pool.
+                    budget.consume()
+            i += 1
 
             if len(current_results) <= 0:
                 if debug:
                     print ('The search has been exhausted')
+                complete = True
                 break
             current_id = current_results[-1].id - 1
-            search_results.extend(current_results)
-
+            if page_callback is not None:
+                page_callback(current_results)
+            else:
+                search_results.extend(current_results)
+            fetched += len(current_results)
+            self.metrics.inc('tweets_fetched_total', len(current_results))
+            if i == max_pages and budget is not None and \
+                    len(current_results) >= PAGE_SIZE:
+                # A quiet term got busy. Continue with its fair share.
+                max_pages += budget.extend(search_term, i)
+            # A page that is not full is the last one.
+            complete = len(current_results) < PAGE_SIZE
+
+        self.last_search_resume_id = None if complete else current_id
+        if budget is not None:
+            budget.record(search_term, i, fetched)
+        self.metrics.inc('search_pages_total', i)
         return search_results
 
     def push_bulk_string_tweets_to_es(self, es_handle, bulk_string, debug = False):
-        """ Push the tweets in bulk_string method to give Elastic Search. """
-        res = es_handle.bulk(bulk_string, index=self.index)
-
-        if res['errors']:
-            if debug:
-                print("At least some ingests FAILED!")
-            return False
-        else:
-            if debug:
-                print("Clean run!")
-        return True
+        """ Push the tweets in bulk_string method to give Elastic Search. Returns True only when
+        every tweet was indexed. Details are in last_bulk_result. """
+        return self.es_bulk(es_handle, bulk_string, debug = debug).ok
 
-    def search_term_to_es(self, search_term, es_handle, debug = False):
+    def search_term_to_es(self, search_term, es_handle, checkpoint_path = None, debug = False):
         """ This method has been changed to a wrapper. Searches tweets matching the given search
-        term and pushes them to ElasticSearch. """
-
+        term and pushes them to ElasticSearch. The search continues from the newest tweet in the
+        index. When the page budget cuts a search short, the rest of it is stored to
+        checkpoint_path and searched first by the next run. """
+        checkpoints = {}
+        if checkpoint_path is not None:
+            checkpoints = multi_term.load_checkpoints(checkpoint_path)
         most_recent = self.get_id_most_recent_tweet_in_es_index(es_handle = es_handle,
                                                                 debug = debug)
+        since_id, max_id = multi_term.search_window(checkpoints, search_term, most_recent)
         results = self.fetch_search_results_from_twitter(search_term,
-                                                         most_recent_id = most_recent,
-                                                         debug = debug)
-        bulk_string = self.create_es_bulk_string_from_timeline(results)
-
-        return self.push_bulk_string_tweets_to_es(es_handle, bulk_string, debug = debug)
+                                                         most_recent_id = since_id,
+                                                         debug = debug, max_id = max_id)
+        resume_id = self.last_search_resume_id
+        indexed = True
+        if results:
+            with self.tracer.span('transform'):
+                bulk_string = self.create_es_bulk_string_from_timeline(results)
+            indexed = bool(bulk_string) and \
+                self.push_bulk_string_tweets_to_es(es_handle, bulk_string, debug = debug)
+        if not indexed:
+            return False
+        if checkpoint_path is not None:
+            multi_term.advance_checkpoints(checkpoints, [], results,
+                                           (search_term, since_id, resume_id))
+            multi_term.save_checkpoints(checkpoint_path, checkpoints)
+        elif resume_id is not None:
+            print('The page budget stopped the search of %s before %d. Give a checkpoint file '
+                  'with -q to search the older tweets on the next run.' % (search_term, resume_id))
+        return True
 
     def write_fetched_tweets_to_file(self, file_path, tweets, time_stamp, debug=False):
         """ Writes the tweets (e.g. from a search) to a text file formated as ElasticSearch string.
@@ -228,34 +475,242 @@ class ElasticSearchTweepy(API):
 
         if len(tweets) > 0:        # In case there was no results. Do nothing.
             most_recent_id = tweets[0].id
-            bulk_string = self.create_es_bulk_string_from_timeline(tweets)
+            with self.tracer.span('transform'):
+                bulk_string = self.create_es_bulk_string_from_timeline(tweets, to_file = True)
 
             file_path_stamp = file_path + datetime.now().strftime("-%y%m%d-%H%M%S") + '.txt'
             with open(file_path_stamp, 'w') as handle:
                 handle.write(bulk_string)
 
-            with open(time_stamp, 'w') as handle:
-                handle.write(str(most_recent_id))
+            if time_stamp is not None:
+                with open(time_stamp, 'w') as handle:
+                    handle.write(str(most_recent_id))
 
         return file_path_stamp
 
     def search_term_to_file(self, search_term, file_path, time_stamp, debug=False):
-        """ Searches tweets matching the given search term and store them in a text file. """
+        """ Searches tweets matching the given search term and store them in a text file. The
+        time stamp file holds the id of the newest stored tweet. While a search cut short by the
+        page budget has not been finished, it holds the window left to search as JSON. """
 
+        checkpoints = {}
         try:
             with open(time_stamp, 'r') as handle:
-                most_recent = int(handle.read())
+                content = handle.read()
+            if content.startswith('{'):
+                checkpoints = {multi_term.RESUME_KEY: {search_term: json.loads(content)}}
+                most_recent = -1
+            else:
+                most_recent = int(content)
         except FileNotFoundError:
             # Starting from scratch. Getting everything we can from Twitter.
             most_recent = -1
 
+        since_id, max_id = multi_term.search_window(checkpoints, search_term, most_recent)
         results = self.fetch_search_results_from_twitter(search_term,
-                                                         most_recent_id = most_recent,
-                                                         debug = debug)
-
-        return self.write_fetched_tweets_to_file(
-            file_path=file_path, tweets=results, time_stamp=time_stamp
+                                                         most_recent_id = since_id,
+                                                         debug = debug, max_id = max_id)
+        newest = multi_term.record_search(
+            checkpoints, search_term, since_id,
+            max(tweet.id for tweet in results) if results else None, self.last_search_resume_id)
+
+        file_path_stamp = self.write_fetched_tweets_to_file(
+            file_path=file_path, tweets=results, time_stamp=None
         )
+        resume = checkpoints.get(multi_term.RESUME_KEY, {}).get(search_term)
+        if newest is not None or resume is not None:
+            with open(time_stamp, 'w') as handle:
+                handle.write(str(newest) if newest is not None else json.dumps(resume))
+        return file_path_stamp
+
+    def search_term_groups(self, terms, checkpoints, debug = False):
+        """ Searches the terms with combined OR queries, one query at a time. Yields the terms of
+        the query, its tweets, a dict from tweet id to the terms it matches and the progress of
+        the search for multi_term.advance_checkpoints. A tweet is routed to a term only when it
+        is newer than the checkpoint of the term. The caller advances the checkpoints. """
+        matcher = multi_term.TermMatcher(terms)
+        queries = multi_term.pack_terms(terms)
+        seen = set()
+        if self.search_budget is not None:
+            self.search_budget.start(len(queries))
+        for query, group in queries:
+            since_id, max_id = multi_term.search_window(
+                checkpoints, query, min(int(checkpoints.get(term, -1)) for term in group))
+            if debug:
+                print('\nSearching %d terms: %s' % (len(group), query))
+            results = self.fetch_search_results_from_twitter(query, most_recent_id = since_id,
+                                                             debug = debug, max_id = max_id)
+            progress = (query, since_id, self.last_search_resume_id)
+            routes = {}
+            for tweet in results:
+                routes[tweet.id] = sorted(term for term in matcher.match(tweet._json)
+                                          if tweet.id > int(checkpoints.get(term, -1)))
+                if tweet.id in seen:
+                    continue
+                seen.add(tweet.id)
+                if not routes[tweet.id]:
+                    self.metrics.inc('search_unrouted_total')
+                for term in routes[tweet.id]:
+                    self.metrics.inc('term_tweets_total', term=term)
+            yield group, results, routes, progress
+
+    def fetch_search_results_for_terms(self, terms, checkpoints, debug = False):
+        """ Searches all the terms. Returns the distinct tweets, newest first, and a dict from
+        tweet id to the terms it matches. checkpoints is updated in place. """
+        tweets = {}
+        routes = {}
+        for group, results, group_routes, progress in self.search_term_groups(terms, checkpoints,
+                                                                              debug):
+            for tweet in results:
+                tweets[tweet.id] = tweet
+                routes.setdefault(tweet.id, set()).update(group_routes[tweet.id])
+            multi_term.advance_checkpoints(checkpoints, group, results, progress)
+        ordered = [tweets[tweet_id] for tweet_id in sorted(tweets, reverse=True)]
+        return ordered, dict((tweet_id, sorted(matched)) for tweet_id, matched in routes.items())
+
+    def search_terms_to_es(self, terms, checkpoint_path, es_handle, annotate = False,
+                           debug = False):
+        """ Searches the terms and pushes the tweets of each query to ElasticSearch. The
+        checkpoints of the terms of a query are stored when all its tweets were indexed, so a
+        failed query does not hold back the others. Returns True when every push succeeded. """
+        checkpoints = multi_term.load_checkpoints(checkpoint_path)
+        success = True
+        pushed = set()
+        for group, results, routes, progress in self.search_term_groups(terms, checkpoints, debug):
+            new_tweets = [tweet for tweet in results if tweet.id not in pushed]
+            indexed = True
+            if new_tweets:
+                with self.tracer.span('transform'):
+                    bulk_string = self.create_es_bulk_string_from_timeline(
+                        new_tweets, routes if annotate else None)
+                indexed = bool(bulk_string) and \
+                    self.push_bulk_string_tweets_to_es(es_handle, bulk_string, debug = debug)
+            if indexed:
+                pushed.update(tweet.id for tweet in new_tweets)
+                multi_term.advance_checkpoints(checkpoints, group, results, progress)
+                multi_term.save_checkpoints(checkpoint_path, checkpoints)
+            else:
+                print('Indexing the tweets of %s failed. They are searched again on the next run.'
+                      % ', '.join(group))
+            success = success and indexed
+        return success
+
+    def search_terms_to_file(self, terms, file_path, checkpoint_path, annotate = False,
+                             debug = False):
+        """ Searches all the terms and stores the tweets in a text file. Returns the path of the
+        file, or an empty string when nothing new was found. """
+        checkpoints = multi_term.load_checkpoints(checkpoint_path)
+        results, routes = self.fetch_search_results_for_terms(terms, checkpoints, debug = debug)
+
+        file_path_stamp = ''
+        if len(results) > 0:
+            with self.tracer.span('transform'):
+                bulk_string = self.create_es_bulk_string_from_timeline(
+                    results, routes if annotate else None, to_file = True)
+            file_path_stamp = file_path + datetime.now().strftime("-%y%m%d-%H%M%S") + '.txt'
+            with open(file_path_stamp, 'w') as handle:
+                handle.write(bulk_string)
+
+        multi_term.save_checkpoints(checkpoint_path, checkpoints)
+        return file_path_stamp
+
+    def wait_rate_limit(self, sleep_seconds, endpoint, test = False):
+        """ Sleeps over a rate limit. In test mode the sleep is only recorded. """
+        self.metrics.inc('rate_limit_waits_total', endpoint=endpoint)
+        self.metrics.inc('rate_limit_wait_seconds_total', sleep_seconds, endpoint=endpoint)
+        print('{} | Sleeping for {} seconds.'.format(
+            str(datetime.now().strftime('%Y-%m-%d %H:%M:%S')), sleep_seconds))
+        if not test:
+            sleep(sleep_seconds)
+        else:
+            self.simulate_sleep.append(sleep_seconds)
+
+    def lookup_tweets(self, tweet_ids, debug = False, test = False):
+        """ Looks up at most 100 tweets by id. Deleted and protected tweets are left out of the
+        result. When the window is used up, waits for its reset before returning. Returns None
+        when rate limited MAX_TRIES times in a row. """
+        i = 0
+        while i < MAX_TRIES:
+            self.metrics.inc('api_calls_total', endpoint='statuses_lookup')
+            try:
+                with self.tracer.span('twitter_fetch', endpoint='statuses_lookup'):
+                    tweets = self.lookup_statuses(tweet_ids, tweet_mode='extended')
+            except tweepy.errors.TooManyRequests:
+                print('{} | Ratelimit.. Waiting...'.format(
+                    str(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))))
+                i += 1
+                # Note: This is NOT exponential back off, but it suits well here.
+                self.wait_rate_limit(61 * (i * i), 'statuses_lookup', test)
+                continue
+            self.metrics.inc('tweets_fetched_total', len(tweets))
+            if debug:
+                print('Looked up %d ids, found %d tweets' % (len(tweet_ids), len(tweets)))
+
+            headers = getattr(getattr(self, 'last_response', None), 'headers', {})
+            # With a credential pool the next request goes to another credential instead.
+            if self.credential_pool is None and headers.get('x-rate-limit-remaining') == '0':
+                reset_in = int(headers.get('x-rate-limit-reset', 0)) - \
+                    int(datetime.now().timestamp())
+                self.wait_rate_limit(max(1, reset_in + 1), 'statuses_lookup', test)
+            return tweets
+        return None
+
+    def hydrate_ids_to_es(self, id_path, checkpoint_path, es_handle, debug = False, test = False):
+        """ Looks up the tweets listed in the id file in batches of 100 and pushes them to
+        ElasticSearch. Progress is checkpointed after each batch, a new run continues from the
+        last completed batch. Returns True when the whole file was processed. """
+        if test:
+            self.simulate_sleep = []
+        state = hydrate.HydrationState(checkpoint_path, id_path)
+        for tweet_ids, offset in hydrate.iter_id_batches(id_path, state.offset, state.seen):
+            tweets = self.lookup_tweets(tweet_ids, debug = debug, test = test)
+            if tweets is None:
+                print('Rate limited. Run again later to continue from the last completed batch.')
+                return False
+            if tweets:
+                with self.tracer.span('transform'):
+                    bulk_string = self.create_es_bulk_string_from_timeline(tweets)
+                if not bulk_string or \
+                        not self.push_bulk_string_tweets_to_es(es_handle, bulk_string, debug):
+                    print('Indexing failed. The batch will be looked up again on the next run.')
+                    return False
+            state.complete(tweet_ids, offset, len(tweets))
+            if debug:
+                print('%d tweets hydrated, %d missing' % (state.hydrated, state.missing))
+        return True
+
+    def refresh_engagement(self, es_handle, days = engagement.DEFAULT_DAYS, debug = False,
+                           test = False):
+        """ Looks up the tweets indexed during the last days again and updates their favorite
+        and retweet counts. Only changed counters are written. Returns True when every update
+        was accepted. """
+        if test:
+            self.simulate_sleep = []
+        success = True
+        # Read before the lookups. Waiting for the rate limit would let the scroll expire.
+        counters = iter(list(engagement.recent_counters(es_handle, self.index, days)))
+        while True:
+            batch = list(islice(counters, hydrate.LOOKUP_BATCH_SIZE))
+            if not batch:
+                break
+            stored = dict(batch)
+            tweets = self.lookup_tweets(list(stored), debug = debug, test = test)
+            if tweets is None:
+                print('Rate limited. Stopping the refresh.')
+                return False
+            changes = []
+            for tweet in tweets:
+                changed = engagement.changed_counters(stored[tweet.id], tweet._json)
+                if changed:
+                    changes.append((tweet.id, changed))
+            self.metrics.inc('engagement_updates_total', len(changes))
+            self.metrics.inc('engagement_unchanged_total', len(tweets) - len(changes))
+            if debug:
+                print('%d of %d looked up tweets changed' % (len(changes), len(stored)))
+            if changes:
+                bulk_string = engagement.update_bulk_string(changes)
+                success = self.es_bulk(es_handle, bulk_string, debug = debug).ok and success
+        return success
 
     def clean_up_friends_file(self, storage_path, debug=True, test=False):
         """ Cleans up the generated file of user_ids. For example users that have not tweeted for
@@ -274,6 +729,7 @@ class ElasticSearchTweepy(API):
                             line.strip()
                         )
                         )
+                        self.metrics.inc('api_calls_total', endpoint='user_timeline')
                         user_timeline = self.user_timeline(int(line), count=2)
                         break
                     except RateLimitError:
@@ -284,6 +740,9 @@ class ElasticSearchTweepy(API):
                         i += 1
                         # Note: This is NOT exponential back off, but it suits well here.
                         sleep_seconds = 61 * (i * i)
+                        self.metrics.inc('rate_limit_waits_total', endpoint='user_timeline')
+                        self.metrics.inc('rate_limit_wait_seconds_total', sleep_seconds,
+                                         endpoint='user_timeline')
                         print('{} | Sleeping for {} seconds.'.format(
                             str(datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
                             sleep_seconds
@@ -309,11 +768,14 @@ class ElasticSearchTweepy(API):
                 handle.write('%d\n' % uid)
         return True
 
-    def save_friends_file(self, target_handle, storage_path, debug=False):
+    def save_friends_file(self, target_handle, storage_path, debug=False, friend_graph_path=None):
         """ Generates list that can be used in list mode. Utilizes target account's followed field.
         Because the basic API keeps hitting rate limits this uses user_id instead of full objects.
-        Max number of friends returned with friends_ids() is 5000 where as with friends() is 20."""
+        Max number of friends returned with friends_ids() is 5000 where as with friends() is 20.
+        When friend_graph_path is given the target's friends are also stored as a row of the
+        seed -> friend graph. """
         unique = set()
+        self.metrics.inc('api_calls_total', endpoint='friends_ids')
         user_ids = self.friends_ids(screen_name=target_handle)
 
         try:
@@ -334,4 +796,10 @@ class ElasticSearchTweepy(API):
             for u in unique:
                 handle.write('%d\n' % u)
 
+        if friend_graph_path is not None:
+            graph = FriendGraph.load(friend_graph_path).with_seed(target_handle, user_ids)
+            graph.save(friend_graph_path)
+            if debug:
+                print("Friend graph has %d seeds." % len(graph.seeds))
+
         return True
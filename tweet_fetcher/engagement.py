@@ -0,0 +1,39 @@
+"""
+Refreshing the engagement counters of indexed tweets. The counters of recent tweets are read from
+the index, the tweets are looked up again in batches and only the counters that changed are sent
+as partial bulk updates. Unchanged tweets cause no writes at all.
+"""
+import json
+
+from elasticsearch.helpers import scan
+
+COUNTER_FIELDS = ('favorite_count', 'retweet_count')
+DEFAULT_DAYS = 7
+SCAN_PAGE_SIZE = 1000
+
+
+def recent_counters(es_handle, index, days=DEFAULT_DAYS):
+    """ Yields (tweet id, counters) of the tweets indexed with @timestamp within the last days. """
+    query = {
+        'query': {'range': {'@timestamp': {'gte': 'now-%dd' % days}}},
+        '_source': list(COUNTER_FIELDS),
+    }
+    for hit in scan(es_handle, index=index, query=query, size=SCAN_PAGE_SIZE):
+        source = hit.get('_source', {})
+        yield int(hit['_id']), dict((field, source.get(field)) for field in COUNTER_FIELDS)
+
+
+def changed_counters(stored, raw_tweet):
+    """ The counters of the looked up tweet that differ from the stored ones. """
+    return dict((field, raw_tweet[field]) for field in COUNTER_FIELDS
+                if field in raw_tweet and raw_tweet[field] != stored.get(field))
+
+
+def update_bulk_string(changes):
+    """ Bulk update actions carrying only the changed fields. changes is a list of
+    (tweet id, changed fields). """
+    bulk_string = ''
+    for tweet_id, fields in changes:
+        bulk_string += '{ "update": { "_id": %d} }\n' % tweet_id
+        bulk_string += '%s\n' % json.dumps({'doc': fields})
+    return bulk_string
@@ -0,0 +1,208 @@
+"""
+Pushing bulk strings to ElasticSearch with per item error handling. Items that were rejected
+because the cluster was busy, and whole requests that failed to connect or were rejected, are sent
+again with jittered exponential back off. Items that can never succeed (e.g. mapping errors) are
+written to a dead-letter file with the reason.
+"""
+import json
+import random
+from datetime import datetime
+from time import sleep
+
+from elasticsearch import exceptions as es_exceptions
+
+from pipeline_metrics import METRICS
+from tracing import NULL_TRACER
+
+MAX_BULK_RETRIES = 5
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 60.0
+RETRYABLE_STATUS = (429, 502, 503, 504)
+
+
+class BulkResult(object):
+    """ Outcome of a bulk push. The push is ok only when every item was accepted. """
+    def __init__(self):
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.created = set()  # _ids of the documents the push created
+        self.item_ids = set()  # _ids of every item with a response
+
+    @property
+    def ok(self):
+        return self.failed == 0
+
+    @property
+    def partial(self):
+        return self.failed > 0 and self.succeeded > 0
+
+    def __repr__(self):
+        return 'BulkResult(succeeded=%d, failed=%d, retried=%d, dead_lettered=%d)' % (
+            self.succeeded, self.failed, self.retried, self.dead_lettered)
+
+
+def split_bulk_string(bulk_string):
+    """ Splits a bulk string to a list of (action line, source line) pairs. Delete actions have no
+    source line and are paired with None. """
+    lines = [line for line in bulk_string.split('\n') if line.strip()]
+    items = []
+    i = 0
+    while i < len(lines):
+        action = lines[i]
+        if 'delete' in json.loads(action):
+            items.append((action, None))
+            i += 1
+        else:
+            items.append((action, lines[i + 1]))
+            i += 2
+    return items
+
+
+def bulk_item_ids(bulk_string):
+    """ The _ids of the actions of a bulk string as strings. """
+    return [str(next(iter(json.loads(action).values())).get('_id'))
+            for action, _ in split_bulk_string(bulk_string)]
+
+
+def join_bulk_items(items):
+    """ Inverse of split_bulk_string. """
+    lines = []
+    for action, source in items:
+        lines.append(action)
+        if source is not None:
+            lines.append(source)
+    return '\n'.join(lines) + '\n'
+
+
+def backoff_seconds(attempt, base=RETRY_BASE_SECONDS, cap=RETRY_MAX_SECONDS):
+    """ Full jitter back off: a random delay up to base * 2^attempt. """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def write_dead_letters(dead_letter_path, index, failures):
+    """ Appends permanently failed items to a NDJSON file. One line per item. """
+    now = datetime.now().isoformat()
+    with open(dead_letter_path, 'a') as handle:
+        for (action, source), status, error in failures:
+            record = {
+                'time': now,
+                'index': index,
+                'status': status,
+                'error': error,
+                'action': json.loads(action),
+                'source': json.loads(source) if source is not None else None,
+            }
+            handle.write(json.dumps(record) + '\n')
+
+
+def add_item(result, response):
+    """ Notes the _id of an answered item and whether the push created the document. """
+    if '_id' not in response:
+        return
+    result.item_ids.add(str(response['_id']))
+    if response.get('result') == 'created':
+        result.created.add(str(response['_id']))
+
+
+def is_retryable(ex):
+    """ Whether a failed bulk request is worth sending again. """
+    if isinstance(ex, es_exceptions.ConnectionError):
+        return True
+    return isinstance(ex, es_exceptions.TransportError) and ex.status_code in RETRYABLE_STATUS
+
+
+def push_bulk(es_handle, bulk_string, index, dead_letter_path=None, max_retries=MAX_BULK_RETRIES,
+              metrics=METRICS, tracer=NULL_TRACER, sleep_function=sleep,
+              dead_letter_retryable=True, debug=False):
+    """ Pushes the bulk string to ElasticSearch. Only the items that failed with a retryable
+    status are sent again. Returns a BulkResult. Without dead_letter_retryable the items still
+    rejected with a retryable status after the retries are not written to the dead-letter file,
+    they are only counted as failed so that the caller can send the batch again later. """
+    result = BulkResult()
+    body = bulk_string
+    pending = None
+    attempt = 0
+
+    while True:
+        try:
+            with tracer.span('es_bulk', attempt=attempt), \
+                    metrics.timer('es_latency_seconds', operation='bulk'):
+                res = es_handle.bulk(body, index=index)
+        except es_exceptions.TransportError as ex:
+            if not is_retryable(ex) or attempt >= max_retries:
+                raise
+            attempt += 1
+            metrics.inc('bulk_request_retries_total')
+            delay = backoff_seconds(attempt - 1)
+            print('Bulk request failed (%s). Retrying in %.1f seconds.' % (ex, delay))
+            sleep_function(delay)
+            continue
+        metrics.record_bulk_response(body, res)
+
+        if not res.get('errors'):
+            result.succeeded += len(pending) if pending is not None else len(res.get('items', []))
+            for response in res.get('items', []):
+                add_item(result, next(iter(response.values())))
+            break
+
+        if pending is None:
+            pending = split_bulk_string(bulk_string) if bulk_string else []
+        items = res.get('items')
+        if not items or len(items) != len(pending):
+            # Without per item information there is no way to tell what went wrong.
+            result.failed += max(len(pending), 1)
+            print('Bulk request to %s failed without item information. %d items were not '
+                  'indexed.' % (index, max(len(pending), 1)))
+            break
+
+        retry = []
+        failures = []
+        for item, response in zip(pending, items):
+            response = next(iter(response.values()))
+            add_item(result, response)
+            if 'error' not in response:
+                result.succeeded += 1
+            elif response.get('status') in RETRYABLE_STATUS and attempt < max_retries:
+                retry.append(item)
+            elif response.get('status') in RETRYABLE_STATUS and not dead_letter_retryable:
+                result.failed += 1
+            else:
+                failures.append((item, response.get('status'), response['error']))
+
+        if failures:
+            result.failed += len(failures)
+            if dead_letter_path is not None:
+                write_dead_letters(dead_letter_path, index, failures)
+                result.dead_lettered += len(failures)
+                metrics.inc('bulk_dead_lettered_total', len(failures))
+            else:
+                _, status, error = failures[0]
+                reason = error.get('type', error) if isinstance(error, dict) else error
+                print('%d items failed to index to %s and were dropped, e.g. %s %s. Set '
+                      'dead_letter_path in [Local Storage] to keep them.' % (
+                          len(failures), index, status, reason))
+
+        if not retry:
+            break
+
+        attempt += 1
+        result.retried += len(retry)
+        metrics.inc('bulk_retried_items_total', len(retry))
+        delay = backoff_seconds(attempt - 1)
+        if debug:
+            print('Retrying %d rejected items in %.1f seconds.' % (len(retry), delay))
+        sleep_function(delay)
+        pending = retry
+        body = join_bulk_items(retry)
+
+    if debug:
+        if result.ok:
+            print("Clean run!")
+        elif result.partial:
+            print("Partial success: %d items indexed, %d FAILED!" % (result.succeeded,
+                                                                    result.failed))
+        else:
+            print("At least some ingests FAILED!")
+    return result
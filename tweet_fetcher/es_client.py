@@ -0,0 +1,37 @@
+"""
+Factory for the ElasticSearch client shared by the fetcher and the uploader. All the transport
+settings are read from the [ElasticSearch] section of the configuration file.
+"""
+from elasticsearch import Elasticsearch
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 3
+
+
+def es_client_options(es_conf, password, pool_size=None):
+    """ Collects the keyword arguments for the client from the configuration section. Bulk
+    bodies of tweet JSON compress very well, so gzip is on unless disabled. The connection pool is
+    at least as large as the number of threads that will talk to the cluster. """
+    maxsize = es_conf.getint('pool_maxsize', fallback=DEFAULT_POOL_SIZE)
+    if pool_size is not None:
+        maxsize = max(maxsize, pool_size)
+
+    options = {
+        'http_auth': (es_conf['auth_user'], password),
+        'use_ssl': es_conf.getboolean('use_ssl', fallback=False),
+        'verify_certs': es_conf.getboolean('verify_certs', fallback=True),
+        'http_compress': es_conf.getboolean('http_compress', fallback=True),
+        'maxsize': maxsize,
+        'timeout': es_conf.getint('timeout', fallback=DEFAULT_TIMEOUT),
+        'max_retries': es_conf.getint('max_retries', fallback=DEFAULT_MAX_RETRIES),
+        'retry_on_timeout': es_conf.getboolean('retry_on_timeout', fallback=True),
+    }
+    if es_conf.getboolean('keep_alive', fallback=True):
+        options['headers'] = {'Connection': 'keep-alive'}
+    return options
+
+
+def create_es_client(es_conf, password, pool_size=None):
+    """ Returns a configured ElasticSearch client. es_conf is the [ElasticSearch] section. """
+    return Elasticsearch([es_conf['url']], **es_client_options(es_conf, password, pool_size))
@@ -0,0 +1,257 @@
+"""
+Append-only local spool for ElasticSearch writes. Fetching appends bulk strings to segment files on
+disk and a background drainer ships them to the cluster at whatever rate it accepts. Segments
+are removed once every batch in them has been acknowledged, so nothing that has been fetched is
+lost when the cluster is slow or down. Whatever is left at exit is shipped by the next run.
+
+Each record in a segment is a header with the payload length and CRC32 followed by the payload:
+the index name, a newline and the bulk string.
+
+Several runs may share a spool directory. A segment is created exclusively and its writer holds
+an fcntl lock on it until it is sealed, and a drainer holds the lock while shipping it. A drainer
+skips locked segments, so it never ships a segment that is still written or shipped by another
+run. The segments of a run that crashed are unlocked and shipped by the next one.
+"""
+import fcntl
+import os
+import random
+import struct
+import threading
+import zlib
+from time import monotonic, sleep
+
+from pipeline_metrics import METRICS
+
+SEGMENT_MAX_BYTES = 8 * 1024 * 1024
+SEGMENT_MAX_AGE = 5.0
+FSYNC_EVERY = 16
+FSYNC_INTERVAL = 1.0
+DRAIN_BACKOFF_BASE = 1.0
+DRAIN_BACKOFF_MAX = 120.0
+IDLE_POLL_SECONDS = 0.5
+# How long close() waits for a push in flight after telling the drainer to stop.
+STOP_TIMEOUT_SECONDS = 10.0
+
+_HEADER = struct.Struct('>II')
+_SEGMENT_PREFIX = 'segment-'
+_SEGMENT_SUFFIX = '.spool'
+_ACK_SUFFIX = '.ack'
+DEAD_LETTER_FILE = 'dead_letters.ndjson'
+
+
+def segment_name(sequence):
+    return '%s%012d%s' % (_SEGMENT_PREFIX, sequence, _SEGMENT_SUFFIX)
+
+
+def read_records(segment_path, offset=0):
+    """ Yields (index, bulk_string, end offset) for each complete record after offset. Reading
+    stops at a torn or corrupted record. """
+    with open(segment_path, 'rb') as handle:
+        handle.seek(offset)
+        while True:
+            header = handle.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            length, checksum = _HEADER.unpack(header)
+            payload = handle.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                return
+            index, bulk_string = payload.decode('utf-8').split('\n', 1)
+            yield index, bulk_string, handle.tell()
+
+
+class EsSpool(object):
+    """ Write-ahead spool in a directory. append() never talks to ElasticSearch. """
+    def __init__(self, directory, segment_max_bytes=SEGMENT_MAX_BYTES,
+                 segment_max_age=SEGMENT_MAX_AGE, fsync_every=FSYNC_EVERY,
+                 fsync_interval=FSYNC_INTERVAL, metrics=METRICS):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_age = segment_max_age
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.metrics = metrics
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._handle = None
+        self._unsynced = 0
+        self._last_sync = monotonic()
+        self._opened = monotonic()
+        self._active = None
+
+        self._drainer = None
+        self._stop = threading.Event()
+        self._draining = threading.Event()
+
+    @staticmethod
+    def _sequence(name):
+        return int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+
+    @property
+    def dead_letter_path(self):
+        """ Default dead-letter file for items the drainer can never index. """
+        return os.path.join(self.directory, DEAD_LETTER_FILE)
+
+    def segments(self):
+        """ Names of the segment files in order. """
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX))
+
+    def append(self, index, bulk_string):
+        """ Appends one bulk string. The data is fsynced in batches of records. """
+        payload = ('%s\n%s' % (index, bulk_string)).encode('utf-8')
+        with self._lock:
+            if self._handle is None:
+                self._open_segment()
+            self._handle.write(_HEADER.pack(len(payload), zlib.crc32(payload)))
+            self._handle.write(payload)
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or \
+                    monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+            if self._handle.tell() >= self.segment_max_bytes:
+                self._seal()
+        self.metrics.inc('spool_appended_batches_total')
+        self.metrics.inc('spool_appended_bytes_total', len(payload))
+
+    def _open_segment(self):
+        """ Creates a new segment after the existing ones. The file is locked under a temporary
+        name and then linked to its segment name, so that no drainer sees it unlocked. Another
+        run may take the same name first, the next sequence number is tried then. """
+        temporary = os.path.join(self.directory, '.writing-%d' % os.getpid())
+        handle = open(temporary, 'wb')
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        sequences = [self._sequence(name) for name in self.segments()]
+        sequence = max(sequences) + 1 if sequences else 0
+        while True:
+            try:
+                os.link(temporary, os.path.join(self.directory, segment_name(sequence)))
+                break
+            except FileExistsError:
+                sequence += 1
+        os.remove(temporary)
+        self._handle = handle
+        self._active = segment_name(sequence)
+        self._opened = monotonic()
+
+    def _sync(self):
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._unsynced = 0
+        self._last_sync = monotonic()
+
+    def _seal(self):
+        """ Closes the active segment so that a drainer may ship it. Closing releases the lock.
+        Caller holds the lock. """
+        if self._handle is None:
+            return
+        self._sync()
+        self._handle.close()
+        self._handle = None
+        self._active = None
+
+    def seal(self):
+        with self._lock:
+            self._seal()
+
+    def pending_segments(self):
+        """ Segments not written by this spool. Segments still written or shipped by another
+        run are among them, drain_segment skips those. """
+        with self._lock:
+            return [name for name in self.segments() if name != self._active]
+
+    def drain_segment(self, name, push):
+        """ Ships the records of one sealed segment. push(index, bulk_string) raises when the
+        cluster did not accept the batch. The acknowledged offset is stored after each batch and
+        the segment is removed when it has been shipped completely. Returns False without
+        shipping anything when another run holds the segment or has already removed it. """
+        path = os.path.join(self.directory, name)
+        ack_path = path + _ACK_SUFFIX
+        try:
+            segment = open(path, 'rb')
+        except FileNotFoundError:
+            return False
+        with segment:
+            try:
+                fcntl.flock(segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            if os.fstat(segment.fileno()).st_nlink == 0:
+                # Shipped and removed by another run after it was listed.
+                return False
+            try:
+                with open(ack_path, 'r') as handle:
+                    offset = int(handle.read())
+            except FileNotFoundError:
+                offset = 0
+
+            for index, bulk_string, end in read_records(path, offset):
+                push(index, bulk_string)
+                with open(ack_path + '.tmp', 'w') as handle:
+                    handle.write(str(end))
+                os.replace(ack_path + '.tmp', ack_path)
+                self.metrics.inc('spool_drained_batches_total')
+
+            if os.path.exists(ack_path):
+                os.remove(ack_path)
+            os.remove(path)
+        return True
+
+    def drain(self, push, stop=None):
+        """ Ships sealed segments until there is nothing left or stop is set. Failed pushes are
+        retried with jittered back off. Returns True when the spool is empty and False when it
+        was stopped or only segments held by other runs are left. """
+        attempt = 0
+        while stop is None or not stop.is_set():
+            with self._lock:
+                if self._handle is not None and \
+                        monotonic() - self._opened >= self.segment_max_age:
+                    self._seal()
+            pending = self.pending_segments()
+            if not pending:
+                return True
+            try:
+                shipped = False
+                for name in pending:
+                    if self.drain_segment(name, push):
+                        shipped = True
+                        break
+                if not shipped:
+                    return False
+                attempt = 0
+            except Exception as ex:
+                attempt += 1
+                delay = random.uniform(0, min(DRAIN_BACKOFF_MAX, DRAIN_BACKOFF_BASE * 2 ** attempt))
+                print('Spool: ElasticSearch did not accept a batch (%s). Retrying in %.1f seconds.'
+                      % (ex, delay))
+                self.metrics.inc('spool_drain_failures_total')
+                if stop is not None:
+                    stop.wait(delay)
+                else:
+                    sleep(delay)
+        return False
+
+    def start_drainer(self, push):
+        """ Starts shipping the spool from a background thread. """
+        def run():
+            while not self._stop.is_set():
+                self.drain(push, stop=self._stop)
+                if self._draining.is_set():
+                    return
+                self._stop.wait(IDLE_POLL_SECONDS)
+
+        self._drainer = threading.Thread(target=run, daemon=True)
+        self._drainer.start()
+
+    def close(self, drain_timeout=None):
+        """ Seals the active segment and gives the drainer drain_timeout seconds to ship what
+        is left. Returns True when the spool is empty. A push still in flight after that is
+        abandoned, its batch stays in the spool. """
+        self.seal()
+        if self._drainer is not None:
+            self._draining.set()
+            self._drainer.join(drain_timeout)
+            self._stop.set()
+            self._drainer.join(STOP_TIMEOUT_SECONDS)
+        return not self.segments()
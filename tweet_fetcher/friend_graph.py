@@ -0,0 +1,123 @@
+"""
+Seed -> friend adjacency stored in compressed sparse row (CSR) form. indptr has one entry per seed
+plus one and the sorted friend ids of seed i are indices[indptr[i]:indptr[i + 1]]. Both arrays
+are plain 64 bit integer files that are memory-mapped when the graph is loaded, so the overlap
+queries only touch the rows they need. Seeds are screen names, kept in lowercase.
+"""
+import json
+import mmap
+import os
+from array import array
+from collections import Counter
+from itertools import combinations
+
+SEEDS_FILE = 'seeds.json'
+INDPTR_FILE = 'indptr.q'
+INDICES_FILE = 'indices.q'
+ID_TYPE = 'q'
+
+
+def _map_array(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return memoryview(array(ID_TYPE))
+    with open(path, 'rb') as handle:
+        mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped).cast(ID_TYPE)
+
+
+class FriendGraph(object):
+    """ CSR adjacency of seed accounts and the ids they follow. """
+    def __init__(self, seeds=None, indptr=None, indices=None):
+        self.seeds = seeds or []
+        self.indptr = indptr if indptr is not None else array(ID_TYPE, [0])
+        self.indices = indices if indices is not None else array(ID_TYPE)
+        self.seed_rows = dict((seed.lower(), i) for i, seed in enumerate(self.seeds))
+
+    @classmethod
+    def load(cls, directory):
+        """ Memory-maps a stored graph. Returns an empty graph when there is nothing stored. """
+        try:
+            with open(os.path.join(directory, SEEDS_FILE), 'r') as handle:
+                seeds = json.load(handle)
+        except FileNotFoundError:
+            return cls()
+        return cls(seeds, _map_array(os.path.join(directory, INDPTR_FILE)),
+                   _map_array(os.path.join(directory, INDICES_FILE)))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for file_name, values in ((INDPTR_FILE, self.indptr), (INDICES_FILE, self.indices)):
+            path = os.path.join(directory, file_name)
+            with open(path + '.tmp', 'wb') as handle:
+                handle.write(values.tobytes())
+            os.replace(path + '.tmp', path)
+        path = os.path.join(directory, SEEDS_FILE)
+        with open(path + '.tmp', 'w') as handle:
+            json.dump(self.seeds, handle)
+        os.replace(path + '.tmp', path)
+
+    def _row(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def row(self, seed):
+        """ Sorted friend ids of the seed. """
+        return self._row(self.seed_rows[seed.lower()])
+
+    def with_seed(self, seed, friend_ids):
+        """ Returns a new graph where the row of the seed is replaced by friend_ids. """
+        seed = seed.lower()
+        kept = [i for i, s in enumerate(self.seeds) if s.lower() != seed]
+        indptr = array(ID_TYPE, [0])
+        indices = array(ID_TYPE)
+        for i in kept:
+            indices.frombytes(self._row(i).tobytes())
+            indptr.append(len(indices))
+        indices.extend(sorted(set(friend_ids)))
+        indptr.append(len(indices))
+        return FriendGraph([self.seeds[i] for i in kept] + [seed], indptr, indices)
+
+    def jaccard(self, seed_a, seed_b):
+        a = set(self.row(seed_a))
+        b = set(self.row(seed_b))
+        union = len(a | b)
+        return len(a & b) / union if union else 0.0
+
+    def followers(self):
+        """ Inverted rows: friend id -> ascending rows of the seeds following it. """
+        followers = {}
+        for i in range(len(self.seeds)):
+            for friend in self._row(i):
+                followers.setdefault(friend, []).append(i)
+        return followers
+
+    def pairwise_jaccard(self, top=None):
+        """ Jaccard overlap of every pair of seeds, largest first. Only the friends followed by
+        several seeds can be shared. They are numbered from the inverted rows and each seed gets
+        a bitmask of the ones it follows, so counting the shared friends of a pair is an AND and
+        a bit count. """
+        shared_friends = [rows for rows in self.followers().values() if len(rows) > 1]
+        bits = [bytearray((len(shared_friends) + 7) // 8) for _ in self.seeds]
+        for column, rows in enumerate(shared_friends):
+            for i in rows:
+                bits[i][column >> 3] |= 1 << (column & 7)
+        masks = [int.from_bytes(row_bits, 'little') for row_bits in bits]
+        sizes = [self.indptr[i + 1] - self.indptr[i] for i in range(len(self.seeds))]
+        pairs = []
+        for a, b in combinations(range(len(self.seeds)), 2):
+            shared = (masks[a] & masks[b]).bit_count()
+            union = sizes[a] + sizes[b] - shared
+            pairs.append((self.seeds[a], self.seeds[b], shared / union if union else 0.0))
+        pairs.sort(key=lambda pair: -pair[2])
+        return pairs[:top] if top is not None else pairs
+
+    def follow_counts(self):
+        """ Counter of how many seeds follow each id. Counted over the whole indices array. """
+        return Counter(self.indices)
+
+    def most_shared(self, k=10):
+        """ The ids followed by the largest number of seeds. """
+        return self.follow_counts().most_common(k)
+
+    def followed_by_at_least(self, k):
+        """ Sorted ids followed by at least k seeds. """
+        return sorted(user_id for user_id, count in self.follow_counts().items() if count >= k)
@@ -0,0 +1,76 @@
+"""
+Reading tweet id lists for hydration. The ids are streamed from the file in batches of the
+statuses lookup limit. Progress is stored after every completed batch: the byte offset in the id
+file to resume from and the ids already looked up, so a restarted run neither repeats lookups
+nor pushes the same tweets again.
+"""
+import json
+import os
+
+LOOKUP_BATCH_SIZE = 100
+
+
+def iter_id_batches(id_path, offset=0, seen=(), batch_size=LOOKUP_BATCH_SIZE):
+    """ Yields (ids, end offset) from the id file starting at the byte offset. The id is the
+    first field of a line. Lines without an id, duplicates and seen ids are skipped. """
+    batch = []
+    queued = set()
+    with open(id_path, 'rb') as handle:
+        handle.seek(offset)
+        while True:
+            line = handle.readline()
+            if not line:
+                break
+            fields = line.replace(b',', b' ').split()
+            if not fields or not fields[0].isdigit():
+                continue
+            tweet_id = int(fields[0])
+            if tweet_id in seen or tweet_id in queued:
+                continue
+            batch.append(tweet_id)
+            queued.add(tweet_id)
+            if len(batch) == batch_size:
+                yield batch, handle.tell()
+                batch = []
+        if batch:
+            yield batch, handle.tell()
+
+
+class HydrationState(object):
+    """ Checkpoint of a hydration run. The looked up ids are appended to a side file. """
+    def __init__(self, checkpoint_path, id_path):
+        self.checkpoint_path = checkpoint_path
+        self.seen_path = checkpoint_path + '.seen'
+        self.id_path = os.path.abspath(id_path)
+        self.offset = 0
+        self.hydrated = 0
+        self.missing = 0
+        try:
+            with open(checkpoint_path, 'r') as handle:
+                stored = json.load(handle)
+            # The offset is only valid for the same id file.
+            if stored.get('input') == self.id_path:
+                self.offset = stored['offset']
+            self.hydrated = stored.get('hydrated', 0)
+            self.missing = stored.get('missing', 0)
+        except FileNotFoundError:
+            pass
+        self.seen = set()
+        try:
+            with open(self.seen_path, 'r') as handle:
+                self.seen.update(int(line) for line in handle if line.strip())
+        except FileNotFoundError:
+            pass
+
+    def complete(self, ids, offset, found):
+        """ Records a batch as done. """
+        with open(self.seen_path, 'a') as handle:
+            handle.write(''.join('%d\n' % tweet_id for tweet_id in ids))
+        self.seen.update(ids)
+        self.offset = offset
+        self.hydrated += found
+        self.missing += len(ids) - found
+        with open(self.checkpoint_path + '.tmp', 'w') as handle:
+            json.dump({'input': self.id_path, 'offset': self.offset, 'hydrated': self.hydrated,
+                       'missing': self.missing}, handle)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
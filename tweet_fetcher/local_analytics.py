@@ -0,0 +1,173 @@
+"""
+Local analytics over tweets recorded with the _to_file modes. The stored bulk files are streamed
+and the columns are built while the documents are parsed, one batch at a time. The columns are
+counted with Counter.update, which does the counting in C. Memory use depends on the number of
+distinct values, not on the number of tweets.
+
+The speed is bound by parsing every document with json.loads and picking its fields in a Python
+loop, so every analysis of the recorded files pays for a full parse. For repeated analyses the
+files are exported once with columnar_store, whose analysis counts integer codes only.
+"""
+import json
+import os
+from collections import Counter
+
+BATCH_SIZE = 10000
+DEFAULT_TOP = 20
+# Counters are pruned to the most common keys when they grow past this. Counts of the kept keys
+# are then lower bounds, and the report lists the pruned counters.
+MAX_DISTINCT = 1000000
+
+
+def stored_files(path):
+    """ Lists the record files. path may be a single file or a folder of files as written by
+    the _to_file modes. """
+    if os.path.isdir(path):
+        return [os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.endswith('txt')]
+    return [path]
+
+
+def iter_documents(path):
+    """ Yields the tweet documents stored in the bulk files. Action lines are skipped. """
+    for file_path in stored_files(path):
+        with open(file_path, 'r') as handle:
+            for line in handle:
+                if line.startswith('{ "index"') or not line.strip():
+                    continue
+                yield json.loads(line)
+
+
+def iter_batches(path, batch_size=BATCH_SIZE):
+    """ Yields lists of documents of at most batch_size. """
+    batch = []
+    for doc in iter_documents(path):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+COLUMNS = ('hashtags', 'domains', 'source', 'hour', 'user', 'is_retweet', 'is_quote')
+
+
+def _add_to_columns(columns, doc):
+    entities = doc['entities']
+    columns['hashtags'].extend(entities['hashtags'])
+    columns['domains'].extend(url['display_url'] for url in entities['urls'])
+    columns['source'].append(doc['source'])
+    columns['hour'].append(doc['time_of_day'] // 3600)
+    columns['user'].append(doc['user']['screen_name'])
+    columns['is_retweet'].append(doc['is_retweet_status'])
+    columns['is_quote'].append(doc['is_quote_status'])
+
+
+def to_columns(batch):
+    """ Turns a batch of documents to columns. Multi valued fields are flattened. """
+    columns = dict((name, []) for name in COLUMNS)
+    for doc in batch:
+        _add_to_columns(columns, doc)
+    return columns
+
+
+def iter_column_batches(path, batch_size=BATCH_SIZE):
+    """ Like iter_batches but yields the batches as columns, filled as the documents are parsed
+    without keeping the documents of the batch. """
+    columns = dict((name, []) for name in COLUMNS)
+    for doc in iter_documents(path):
+        _add_to_columns(columns, doc)
+        if len(columns['source']) >= batch_size:
+            yield columns
+            columns = dict((name, []) for name in COLUMNS)
+    if columns['source']:
+        yield columns
+
+
+def _prune(counter, max_distinct):
+    """ Keeps the max_distinct // 2 most common keys of a counter grown past max_distinct.
+    Returns True when keys were dropped. """
+    if len(counter) <= max_distinct:
+        return False
+    kept = counter.most_common(max_distinct // 2)
+    counter.clear()
+    counter.update(dict(kept))
+    return True
+
+
+class TweetAnalysis(object):
+    """ Aggregations we normally build in Kibana. Feed batches with add_batch. """
+    COUNTED = ('hashtags', 'domains', 'source', 'user')
+
+    def __init__(self, max_distinct=MAX_DISTINCT):
+        self.max_distinct = max_distinct
+        self.total = 0
+        self.retweets = 0
+        self.quotes = 0
+        self.hours = Counter()
+        self.counters = dict((name, Counter()) for name in self.COUNTED)
+        self.pruned = set()
+
+    def add_columns(self, columns):
+        self.total += len(columns['source'])
+        self.retweets += sum(columns['is_retweet'])
+        self.quotes += sum(columns['is_quote'])
+        self.hours.update(columns['hour'])
+        for name in self.COUNTED:
+            self.counters[name].update(columns[name])
+            if _prune(self.counters[name], self.max_distinct):
+                self.pruned.add(name)
+
+    def add_batch(self, batch):
+        self.add_columns(to_columns(batch))
+
+    def report(self, top=DEFAULT_TOP):
+        """ Returns the results as a dictionary. 'pruned' lists the counters whose counts are
+        lower bounds because the long tail was pruned. """
+        return {
+            'tweets': self.total,
+            'retweet_ratio': self.retweets / self.total if self.total else 0.0,
+            'quote_ratio': self.quotes / self.total if self.total else 0.0,
+            'time_of_day': [self.hours.get(hour, 0) for hour in range(24)],
+            'top_hashtags': self.counters['hashtags'].most_common(top),
+            'top_domains': self.counters['domains'].most_common(top),
+            'top_sources': self.counters['source'].most_common(top),
+            'top_users': self.counters['user'].most_common(top),
+            'pruned': sorted(self.pruned),
+        }
+
+
+def analyse_path(path, batch_size=BATCH_SIZE, max_distinct=MAX_DISTINCT):
+    """ Streams all stored tweets under path through the analysis. """
+    analysis = TweetAnalysis(max_distinct=max_distinct)
+    for columns in iter_column_batches(path, batch_size):
+        analysis.add_columns(columns)
+    return analysis
+
+
+def format_report(report):
+    """ Human readable version of the report. """
+    lines = ['Tweets: %d' % report['tweets'],
+             'Retweets: %.1f %%' % (100 * report['retweet_ratio']),
+             'Quotes: %.1f %%' % (100 * report['quote_ratio']),
+             '', 'Time of day (UTC):']
+    peak = max(report['time_of_day']) or 1
+    for hour, count in enumerate(report['time_of_day']):
+        lines.append('  %02d %8d %s' % (hour, count, '#' * int(40 * count / peak)))
+    for title, key in (('Hashtags', 'top_hashtags'), ('Domains', 'top_domains'),
+                       ('Sources', 'top_sources'), ('Users', 'top_users')):
+        lines.append('')
+        lines.append('%s:' % title)
+        for value, count in report[key]:
+            lines.append('  %8d %s' % (count, value))
+    if report.get('pruned'):
+        lines.append('')
+        lines.append('Counts of %s are lower bounds: their least common values were pruned.'
+                     % ', '.join(report['pruned']))
+    return '\n'.join(lines)
+
+
+def write_report(report, file_path):
+    with open(file_path, 'w') as handle:
+        json.dump(report, handle, indent=2)
@@ -0,0 +1,86 @@
+"""
+Before/after comparison of index mappings. The same recorded tweets are bulk loaded to one index
+per mapping and the indexing rate and the store size after a force merge are reported.
+"""
+import json
+from time import perf_counter
+
+import local_analytics
+from elasticsearch_index_conf import dynamic_index_body, index_body
+from es_bulk import push_bulk
+
+BENCHMARK_BATCH_SIZE = 1000
+
+
+def benchmark_bodies(projection=None):
+    """ (name, index body) of the compared mappings. """
+    return [
+        ('dynamic', dynamic_index_body()),
+        ('explicit', index_body(projection)),
+        ('explicit_compressed_sorted', index_body(projection, best_compression=True,
+                                                  sort_by_timestamp=True)),
+    ]
+
+
+def bulk_strings(src_path, batch_size=BENCHMARK_BATCH_SIZE):
+    """ The stored documents as bulk strings, read to memory so that reading the files is not
+    part of the measured time. """
+    batches = []
+    for batch in local_analytics.iter_batches(src_path, batch_size):
+        batches.append(''.join('{ "index": { "_id": %d} }\n%s\n' % (doc['id'], json.dumps(doc))
+                               for doc in batch))
+    return batches
+
+
+def measure(es_handle, index, body, batches, debug=False):
+    """ Loads the batches to a new index with the given body. Returns a dict of the results. """
+    if es_handle.indices.exists(index=index):
+        es_handle.indices.delete(index=index)
+    es_handle.indices.create(index=index, body=body)
+    documents = 0
+    failed = 0
+    start = perf_counter()
+    for bulk_string in batches:
+        result = push_bulk(es_handle, bulk_string, index, debug=debug)
+        documents += result.succeeded
+        failed += result.failed
+    es_handle.indices.refresh(index=index)
+    seconds = perf_counter() - start
+    es_handle.indices.forcemerge(index=index, max_num_segments=1)
+    es_handle.indices.refresh(index=index)
+    stats = es_handle.indices.stats(index=index, metric='store')
+    store_bytes = stats['indices'][index]['primaries']['store']['size_in_bytes']
+    mapping = es_handle.indices.get_mapping(index=index)
+    return {
+        'documents': documents,
+        'failed': failed,
+        'seconds': seconds,
+        'docs_per_second': documents / seconds if seconds > 0 else 0.0,
+        'store_bytes': store_bytes,
+        'mapping_bytes': len(json.dumps(mapping)),
+    }
+
+
+def run_benchmark(es_handle, src_path, index_prefix, projection=None, keep=False, debug=False):
+    """ Measures every mapping of benchmark_bodies. Returns [(name, results)]. The benchmark
+    indices are deleted afterwards unless keep is set. """
+    batches = bulk_strings(src_path)
+    results = []
+    for name, body in benchmark_bodies(projection):
+        index = '%s-benchmark-%s' % (index_prefix, name.replace('_', '-'))
+        if debug:
+            print('Loading %s' % index)
+        results.append((name, measure(es_handle, index, body, batches, debug)))
+        if not keep:
+            es_handle.indices.delete(index=index)
+    return results
+
+
+def format_results(results):
+    lines = ['%-28s %10s %12s %14s %12s' % ('mapping', 'documents', 'docs/s', 'store bytes',
+                                            'mapping')]
+    for name, result in results:
+        lines.append('%-28s %10d %12.1f %14d %12d' % (
+            name, result['documents'], result['docs_per_second'], result['store_bytes'],
+            result['mapping_bytes']))
+    return '\n'.join(lines)
@@ -0,0 +1,164 @@
+"""
+Searching many terms with few API calls. The terms are packed to combined OR queries that fit the
+search API query length limit. The tweets returned by a combined query are routed back to the
+terms they match with a local matcher, and every term keeps its own checkpoint (the newest tweet
+id searched for it) in a JSON file.
+
+Search results come newest first. When the page budget stops a search before it reaches the
+checkpoint, the checkpoints stay and the rest of the window, below the oldest tweet fetched, is
+stored under RESUME_KEY. The next run searches that window before the checkpoints move.
+"""
+import json
+import os
+
+from offline_index import tokenize
+
+# Limit of the standard search API, operators included.
+MAX_QUERY_LENGTH = 500
+OR_SEPARATOR = ' OR '
+# Checkpoint key of the searches cut short, by query. Blank lines are not terms, so it cannot
+# clash with a term.
+RESUME_KEY = ''
+
+
+def read_terms(path):
+    """ One term per line. Blank lines are skipped and duplicates are dropped. """
+    terms = []
+    with open(path, 'r') as handle:
+        for line in handle:
+            term = line.strip()
+            if term and term not in terms:
+                terms.append(term)
+    return terms
+
+
+def query_term(term):
+    """ The term as written in a combined query. Multi word terms are searched as phrases. """
+    if ' ' in term and not term.startswith('"'):
+        return '"%s"' % term
+    return term
+
+
+def pack_terms(terms, max_length=MAX_QUERY_LENGTH):
+    """ Packs the terms greedily to groups whose OR query fits in max_length. A term too long to
+    share a query gets a query of its own. Returns a list of (query, terms). """
+    groups = []
+    current = []
+    length = 0
+    for term in terms:
+        part = query_term(term)
+        added = len(part) + (len(OR_SEPARATOR) if current else 0)
+        if current and length + added > max_length:
+            groups.append(current)
+            current = []
+            length = 0
+            added = len(part)
+        current.append(term)
+        length += added
+    if current:
+        groups.append(current)
+    return [(OR_SEPARATOR.join(query_term(term) for term in group), group) for group in groups]
+
+
+class TermMatcher(object):
+    """ Decides which of the terms a raw tweet object matches. Hashtags and mentions are compared
+    to the tweet entities, words to the tokens and phrases to the text. """
+    def __init__(self, terms):
+        self.hashtags = {}
+        self.mentions = {}
+        self.words = {}
+        self.phrases = []
+        for term in terms:
+            normalized = term.strip('"').lower()
+            if normalized.startswith('#'):
+                self.hashtags.setdefault(normalized[1:], []).append(term)
+            elif normalized.startswith('@'):
+                self.mentions.setdefault(normalized[1:], []).append(term)
+            elif ' ' in normalized:
+                self.phrases.append((normalized, term))
+            else:
+                self.words.setdefault(normalized, []).append(term)
+
+    def match(self, raw_tweet):
+        """ Sorted list of the matching terms. """
+        texts = [raw_tweet.get('full_text') or raw_tweet.get('text') or '']
+        entities = [raw_tweet.get('entities', {})]
+        for nested in ('retweeted_status', 'quoted_status'):
+            if nested in raw_tweet:
+                texts.append(raw_tweet[nested].get('full_text') or
+                             raw_tweet[nested].get('text') or '')
+                entities.append(raw_tweet[nested].get('entities', {}))
+
+        matched = set()
+        for entity in entities:
+            for tag in entity.get('hashtags', []):
+                matched.update(self.hashtags.get(tag['text'].lower(), ()))
+                matched.update(self.words.get(tag['text'].lower(), ()))
+            for mention in entity.get('user_mentions', []):
+                matched.update(self.mentions.get(mention['screen_name'].lower(), ()))
+        for text in texts:
+            lowered = text.lower()
+            for token in tokenize(lowered):
+                matched.update(self.words.get(token, ()))
+            for phrase, term in self.phrases:
+                if phrase in lowered:
+                    matched.add(term)
+        return sorted(matched)
+
+
+def load_checkpoints(path):
+    """ Term -> newest searched tweet id. """
+    try:
+        with open(path, 'r') as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return {}
+
+
+def search_window(checkpoints, query, since_id):
+    """ (since_id, max_id) of the next search of the query. A search cut short continues below
+    the oldest tweet it got. """
+    resume = checkpoints.get(RESUME_KEY, {}).get(query)
+    if resume is None:
+        return since_id, -1
+    return resume['since_id'], resume['max_id']
+
+
+def record_search(checkpoints, query, since_id, newest_id, resume_id):
+    """ Notes the progress of a search of the window from search_window. newest_id is the
+    newest tweet it got, None without tweets. resume_id is the max_id it would continue from,
+    None when it reached since_id. Returns the id the checkpoint may move to, None while the
+    window has not been searched completely. """
+    resumes = checkpoints.setdefault(RESUME_KEY, {})
+    resume = resumes.get(query)
+    newest = None
+    if resume is not None and resume_id is None:
+        newest = resumes.pop(query)['newest']
+    elif resume is not None:
+        resume['max_id'] = resume_id
+    elif resume_id is None:
+        newest = newest_id
+    elif newest_id is not None:
+        resumes[query] = {'since_id': int(since_id), 'max_id': resume_id, 'newest': newest_id}
+    if not resumes:
+        del checkpoints[RESUME_KEY]
+    return newest
+
+
+def advance_checkpoints(checkpoints, group, results, progress=None):
+    """ Moves the checkpoints of the searched terms to the newest tweet of their results.
+    progress is (query, since_id, resume_id) of a search planned with search_window. A search
+    cut short does not move the checkpoints until the rest of its window has been searched. """
+    newest = max(tweet.id for tweet in results) if results else None
+    if progress is not None:
+        query, since_id, resume_id = progress
+        newest = record_search(checkpoints, query, since_id, newest, resume_id)
+    if newest is not None:
+        for term in group:
+            checkpoints[term] = max(int(checkpoints.get(term, -1)), newest)
+
+
+def save_checkpoints(path, checkpoints):
+    with open(path + '.tmp', 'w') as handle:
+        json.dump(checkpoints, handle, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
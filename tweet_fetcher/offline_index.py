@@ -0,0 +1,262 @@
+"""
+Offline full-text index over recorded tweets. Each build run adds one segment: a lexicon mapping
+terms to their posting lists and a binary file with the sorted tweet ids of every posting list.
+Queries support implicit AND, OR and date ranges (since:YYYY-MM-DD, until:YYYY-MM-DD). Tweet ids
+are snowflakes that carry the creation time, so date ranges are id ranges and need no extra data.
+"""
+import heapq
+import json
+import mmap
+import os
+import re
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+import local_analytics
+
+MANIFEST = 'index.json'
+POSTING_TYPE = 'q'
+MAX_SEGMENTS = 16
+TWITTER_EPOCH_MS = 1288834974657
+MIN_TOKEN_LENGTH = 2
+# Posting list of every document. Tokens are never empty, so it cannot clash with a term.
+ALL_TERM = ''
+# Ids buffered per write when a segment is written.
+WRITE_CHUNK = 65536
+
+_URL_RE = re.compile(r'https?://\S+')
+_WORD_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """ Lowercase words of a text. Links are left out. """
+    return [word for word in _WORD_RE.findall(_URL_RE.sub(' ', text.lower()))
+            if len(word) >= MIN_TOKEN_LENGTH]
+
+
+def document_terms(doc):
+    """ Distinct terms of a stored tweet. Hashtags are indexed both as words and as #tag. """
+    terms = set(tokenize(doc.get('full_text') or ''))
+    for tag in doc['entities']['hashtags']:
+        terms.add('#' + tag)
+        terms.add(tag)
+    return terms
+
+
+def date_to_id(date_string):
+    """ The smallest tweet id that could have been created at the start of the given day. """
+    day = datetime.strptime(date_string, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    return max(0, int(day.timestamp() * 1000) - TWITTER_EPOCH_MS) << 22
+
+
+def _file_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+class OfflineIndex(object):
+    """ Inverted index in a directory. """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(os.path.join(directory, MANIFEST), 'r') as handle:
+                self.manifest = json.load(handle)
+        except FileNotFoundError:
+            self.manifest = {'segments': [], 'next_segment': 0, 'files': {}}
+        self._segments = None
+
+    def _save_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        with open(path + '.tmp', 'w') as handle:
+            json.dump(self.manifest, handle)
+        os.replace(path + '.tmp', path)
+        self._segments = None
+
+    def _write_segment(self, postings):
+        """ Writes postings, (term, sorted distinct ids) pairs in term order, as a new segment.
+        The ids are written in chunks, so a posting list does not have to fit in memory.
+        Returns the name of the segment. """
+        name = 'seg-%06d' % self.manifest['next_segment']
+        self.manifest['next_segment'] += 1
+        lexicon = {}
+        offset = 0
+        with open(os.path.join(self.directory, name + '.post'), 'wb') as handle:
+            for term, ids in postings:
+                count = 0
+                chunk = array(POSTING_TYPE)
+                for tweet_id in ids:
+                    chunk.append(tweet_id)
+                    if len(chunk) >= WRITE_CHUNK:
+                        chunk.tofile(handle)
+                        count += len(chunk)
+                        chunk = array(POSTING_TYPE)
+                chunk.tofile(handle)
+                count += len(chunk)
+                lexicon[term] = [offset, count]
+                offset += count
+        with open(os.path.join(self.directory, name + '.lex'), 'w') as handle:
+            json.dump(lexicon, handle)
+        return name
+
+    def add_path(self, src_path, debug=False):
+        """ Indexes the stored files under src_path that have not been indexed yet. Returns the
+        number of new documents. """
+        postings = {}
+        new_files = []
+        documents = 0
+        for file_path in local_analytics.stored_files(src_path):
+            key = os.path.abspath(file_path)
+            if self.manifest['files'].get(key) == _file_signature(file_path):
+                continue
+            for doc in local_analytics.iter_documents(file_path):
+                for term in document_terms(doc):
+                    postings.setdefault(term, []).append(doc['id'])
+                postings.setdefault(ALL_TERM, []).append(doc['id'])
+                documents += 1
+            new_files.append(file_path)
+            if debug:
+                print('Indexed [{}]'.format(file_path))
+
+        if not new_files:
+            return 0
+        self.manifest['segments'].append(self._write_segment(
+            (term, sorted(set(postings[term]))) for term in sorted(postings)))
+        for file_path in new_files:
+            self.manifest['files'][os.path.abspath(file_path)] = _file_signature(file_path)
+        self._save_manifest()
+        if len(self.manifest['segments']) > MAX_SEGMENTS:
+            self.compact()
+        return documents
+
+    def compact(self):
+        """ Merges all the segments to one. The sorted posting lists of each term are merged
+        from the mapped segments straight to the new segment file. """
+        segments = self.segments()
+        terms = sorted(set().union(*(segment.lexicon for segment in segments)))
+        old = self.manifest['segments']
+        self.manifest['segments'] = [self._write_segment(
+            (term, iter_unique([segment.postings(term) for segment in segments]))
+            for term in terms)]
+        self._save_manifest()
+        for name in old:
+            os.remove(os.path.join(self.directory, name + '.post'))
+            os.remove(os.path.join(self.directory, name + '.lex'))
+
+    def segments(self):
+        if self._segments is None:
+            self._segments = [_Segment(self.directory, name)
+                              for name in self.manifest['segments']]
+        return self._segments
+
+    def term_ids(self, term, low=None, high=None):
+        """ Sorted ids of the tweets containing the term, limited to low <= id < high. """
+        return merge_unique([segment.postings(term, low, high) for segment in self.segments()])
+
+    def all_ids(self, low=None, high=None):
+        """ Sorted ids of every indexed tweet, limited to low <= id < high. """
+        return merge_unique([segment.all_postings(low, high) for segment in self.segments()])
+
+    def search(self, query):
+        """ Returns the ids matching the query, newest first. A query of only date limits
+        returns every tweet of the range. A query whose terms are all dropped by the
+        tokenizer, like a link or a single letter, matches nothing. """
+        parsed = parse_query(query)
+        low = parsed['since']
+        high = parsed['until']
+        if not parsed['or']:
+            if parsed['has_terms'] or (low is None and high is None):
+                return []
+            return self.all_ids(low, high)[::-1]
+        groups = []
+        for and_group in parsed['or']:
+            lists = sorted((self.term_ids(term, low, high) for term in and_group), key=len)
+            matches = lists[0]
+            for other in lists[1:]:
+                matches = intersect_sorted(matches, other)
+            groups.append(matches)
+        return merge_unique(groups)[::-1]
+
+
+def iter_unique(sorted_lists):
+    """ Yields the union of sorted id lists in order without duplicates. """
+    previous = None
+    for tweet_id in heapq.merge(*sorted_lists):
+        if tweet_id != previous:
+            yield tweet_id
+            previous = tweet_id
+
+
+def merge_unique(sorted_lists):
+    """ Union of sorted id lists as one sorted list without duplicates. """
+    if len(sorted_lists) == 1:
+        return list(sorted_lists[0])
+    return list(iter_unique(sorted_lists))
+
+
+def intersect_sorted(small, large):
+    """ Intersection of two sorted id lists. Each id of the shorter list is looked up by
+    binary search in the rest of the longer one. """
+    matches = []
+    position = 0
+    for tweet_id in small:
+        position = bisect_left(large, tweet_id, position)
+        if position == len(large):
+            break
+        if large[position] == tweet_id:
+            matches.append(tweet_id)
+    return matches
+
+
+class _Segment(object):
+    def __init__(self, directory, name):
+        with open(os.path.join(directory, name + '.lex'), 'r') as handle:
+            self.lexicon = json.load(handle)
+        path = os.path.join(directory, name + '.post')
+        if os.path.getsize(path) > 0:
+            with open(path, 'rb') as handle:
+                self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            self._ids = memoryview(self._map).cast(POSTING_TYPE)
+        else:
+            self._ids = memoryview(array(POSTING_TYPE))
+
+    def postings(self, term, low=None, high=None):
+        """ Sorted posting list of the term, limited to low <= id < high. """
+        try:
+            offset, count = self.lexicon[term]
+        except KeyError:
+            return self._ids[0:0]
+        ids = self._ids[offset:offset + count]
+        start = bisect_left(ids, low) if low is not None else 0
+        end = bisect_left(ids, high) if high is not None else len(ids)
+        return ids[start:end]
+
+    def all_postings(self, low=None, high=None):
+        return self.postings(ALL_TERM, low, high)
+
+
+def parse_query(query):
+    """ Splits the query to OR'ed groups of AND'ed terms and the date limits. Terms are
+    normalized the same way as when indexing. has_terms tells whether the query had any other
+    tokens than the date limits, even if they all tokenized away. """
+    parsed = {'or': [], 'since': None, 'until': None, 'has_terms': False}
+    group = []
+    for token in query.split():
+        if not token.startswith(('since:', 'until:')):
+            parsed['has_terms'] = True
+        if token == 'OR':
+            if group:
+                parsed['or'].append(group)
+            group = []
+        elif token.startswith('since:'):
+            parsed['since'] = date_to_id(token[len('since:'):])
+        elif token.startswith('until:'):
+            parsed['until'] = date_to_id(token[len('until:'):])
+        elif token.startswith('#'):
+            group.append(token.lower())
+        else:
+            group.extend(tokenize(token))
+    if group:
+        parsed['or'].append(group)
+    return parsed
@@ -0,0 +1,187 @@
+"""
+Counters and latency histograms for the fetch -> transform -> index pipeline. The numbers can be
+served in Prometheus text format while a run is going on and dumped as a JSON summary at the end.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, time
+
+METRIC_PREFIX = 'tweet_fetcher_'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels):
+    """ Labels are stored as a sorted tuple so that they can be used as a dictionary key. """
+    return tuple(sorted(labels.items()))
+
+
+def _label_string(label_key):
+    if not label_key:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, v) for k, v in label_key) + '}'
+
+
+class _Timer(object):
+    """ Context manager observing the elapsed wall time to a histogram. """
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = perf_counter() - self.start
+        self.metrics.observe(self.name, self.elapsed, **self.labels)
+        return False
+
+
+class PipelineMetrics(object):
+    """ Thread safe collection of counters and histograms. """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.started = time()
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """ Increase a counter. """
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """ Add an observation to a histogram. """
+        key = (name, _label_key(labels))
+        with self._lock:
+            try:
+                hist = self.histograms[key]
+            except KeyError:
+                hist = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+                self.histograms[key] = hist
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    hist['counts'][i] += 1
+                    break
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def timer(self, name, **labels):
+        """ Returns a context manager that records the duration of the block. """
+        return _Timer(self, name, labels)
+
+    def get(self, name, **labels):
+        """ Current value of a counter. Zero when it has never been increased. """
+        with self._lock:
+            return self.counters.get((name, _label_key(labels)), 0)
+
+    def record_bulk_response(self, body, res):
+        """ Count one bulk request, its size and the items ElasticSearch refused. """
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.inc('bulk_requests_total')
+        self.inc('bulk_bytes_total', len(body) if body else 0)
+        if not res.get('errors'):
+            return
+        items = res.get('items')
+        if not items:
+            # The whole request failed or the response carries no per-item information.
+            self.inc('bulk_item_errors_total', reason='unknown')
+            return
+        for item in items:
+            result = next(iter(item.values()))
+            if 'error' in result:
+                self.inc('bulk_item_errors_total', reason=result['error'].get('type', 'unknown'))
+
+    def reset(self):
+        with self._lock:
+            self.started = time()
+            self.counters = {}
+            self.histograms = {}
+
+    def to_prometheus(self):
+        """ Render the metrics in Prometheus text exposition format. """
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((k, dict(v, counts=list(v['counts'])))
+                                for k, v in self.histograms.items())
+
+        typed = set()
+        for (name, label_key), value in counters:
+            full_name = METRIC_PREFIX + name
+            if full_name not in typed:
+                lines.append('# TYPE %s counter' % full_name)
+                typed.add(full_name)
+            lines.append('%s%s %s' % (full_name, _label_string(label_key), value))
+
+        for (name, label_key), hist in histograms:
+            full_name = METRIC_PREFIX + name
+            if full_name not in typed:
+                lines.append('# TYPE %s histogram' % full_name)
+                typed.add(full_name)
+            cumulative = 0
+            for upper, count in zip(self.buckets, hist['counts']):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    full_name, _label_string(label_key + (('le', upper),)), cumulative))
+            lines.append('%s_bucket%s %d' % (
+                full_name, _label_string(label_key + (('le', '+Inf'),)), hist['count']))
+            lines.append('%s_sum%s %f' % (full_name, _label_string(label_key), hist['sum']))
+            lines.append('%s_count%s %d' % (full_name, _label_string(label_key), hist['count']))
+
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """ Returns the metrics as a dictionary suitable for JSON serialization. """
+        summary = {'elapsed_seconds': round(time() - self.started, 3), 'counters': {},
+                   'histograms': {}}
+        with self._lock:
+            for (name, label_key), value in sorted(self.counters.items()):
+                summary['counters'].setdefault(name, {})[_label_string(label_key)] = value
+            for (name, label_key), hist in sorted(self.histograms.items()):
+                summary['histograms'].setdefault(name, {})[_label_string(label_key)] = {
+                    'count': hist['count'],
+                    'sum': round(hist['sum'], 6),
+                    'buckets': dict(zip([str(b) for b in self.buckets], hist['counts']))
+                }
+        return summary
+
+    def write_summary(self, file_path):
+        """ Stores the JSON summary to a file. """
+        with open(file_path, 'w') as handle:
+            json.dump(self.summary(), handle, indent=2)
+
+
+def start_metrics_server(port, metrics, host=''):
+    """ Serves the metrics on http://host:port/metrics from a daemon thread. Returns the server
+    so that the caller can shut it down. """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            payload = metrics.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            # Keep the scrapes out of the verbose output.
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+# Process wide instance used by the fetcher and the uploader.
+METRICS = PipelineMetrics()
@@ -0,0 +1,233 @@
+"""
+Field projection profiles for the documents pushed to ElasticSearch. A profile either drops the
+listed fields (blacklist) or keeps only them (whitelist). Fields are dotted paths into the
+document. Lists of objects (e.g. entities.urls) are projected element by element and the last
+part of a path may contain shell style wildcards (in_reply_to_*).
+
+Profiles are compiled once to a tree, so applying one is a single walk over the affected keys.
+The same profile prunes the index mapping, so the mapping never describes dropped fields.
+
+Custom profiles are defined in the configuration file:
+
+    [Projection compact]
+    extends = default
+    drop = place, lang
+"""
+import json
+from fnmatch import fnmatchcase
+
+import local_analytics
+
+# Fields that are always kept, whatever the profile drops or keeps. Without them the documents
+# can not be indexed or sorted.
+REQUIRED_FIELDS = ('id', 'id_str', '@timestamp')
+
+_DEFAULT_DROP = (
+    'geo', 'coordinates', 'contributors', 'truncated', 'display_text_range',
+    'quoted_status_permalink', 'entities.symbols', 'entities.urls.indices', 'entities.urls.url',
+    'entities.user_mentions.indices', 'entities.user_mentions.id', 'entities.media.indices',
+)
+_LEAN_DROP = _DEFAULT_DROP + (
+    'entities.user_mentions', 'in_reply_to_*', 'place', 'lang', 'favorited', 'retweeted',
+    'possibly_sensitive', 'quoted_status_id', 'quoted_status_id_str', 'user.description',
+    'user.location', 'user.utc_offset', 'retweeted_status.user.description',
+    'retweeted_status.user.location', 'retweeted_status.user.utc_offset',
+    'quoted_status.user.description', 'quoted_status.user.location',
+    'quoted_status.user.utc_offset', 'entities.media',
+)
+BUILTIN_PROFILES = {
+    'full': {'drop': ()},
+    'default': {'drop': _DEFAULT_DROP},
+    'lean': {'drop': _LEAN_DROP},
+}
+SECTION_PREFIX = 'Projection '
+
+
+def _split_list(value):
+    return tuple(item.strip() for item in value.replace('\n', ',').split(',') if item.strip())
+
+
+def _compile(paths):
+    """ Turns dotted paths into a tree. None marks the end of a path. """
+    tree = {}
+    for path in paths:
+        node = tree
+        parts = path.split('.')
+        for part in parts[:-1]:
+            child = node.get(part)
+            if child is None:
+                child = node[part] = {}
+            node = child
+        node[parts[-1]] = None
+    return tree
+
+
+class _Node(object):
+    """ One level of a compiled profile. Exact keys are dictionary lookups. Only wildcard keys
+    need matching. """
+    def __init__(self, tree):
+        self.exact = {}
+        self.patterns = []
+        for key, child in tree.items():
+            compiled = _Node(child) if child is not None else None
+            if any(c in key for c in '*?['):
+                self.patterns.append((key, compiled))
+            else:
+                self.exact[key] = compiled
+
+    def match(self, key):
+        """ Returns (matched, child node). """
+        if key in self.exact:
+            return True, self.exact[key]
+        for pattern, child in self.patterns:
+            if fnmatchcase(key, pattern):
+                return True, child
+        return False, None
+
+
+class ProjectionProfile(object):
+    """ Compiled projection. mode is 'drop' or 'keep'. """
+    def __init__(self, name, mode='drop', paths=()):
+        if mode not in ('drop', 'keep'):
+            raise ValueError('Projection mode must be drop or keep, not %s' % mode)
+        self.name = name
+        self.mode = mode
+        self.paths = tuple(paths)
+        if mode == 'keep':
+            self.paths += tuple(f for f in REQUIRED_FIELDS if f not in self.paths)
+        self.root = _Node(_compile(self.paths))
+
+    @property
+    def is_noop(self):
+        return self.mode == 'drop' and not self.paths
+
+    def apply(self, doc):
+        """ Projects the document in place and returns it. """
+        if self.mode == 'drop':
+            required = _required(doc)
+            _drop(doc, self.root)
+            doc.update(required)
+        else:
+            _keep(doc, self.root)
+        return doc
+
+    def prune_mapping(self, properties):
+        """ Removes the fields the profile leaves out from mapping properties in place. """
+        if self.mode == 'drop':
+            required = _required(properties)
+            _drop_mapping(properties, self.root)
+            properties.update(required)
+        else:
+            _keep_mapping(properties, self.root)
+        return properties
+
+
+def _required(fields):
+    """ The required fields present. A drop profile may name them or match them with a
+    wildcard, they are put back after dropping. """
+    return dict((field, fields[field]) for field in REQUIRED_FIELDS if field in fields)
+
+
+def _drop(value, node):
+    if isinstance(value, list):
+        for item in value:
+            _drop(item, node)
+        return
+    if not isinstance(value, dict):
+        return
+    for key in list(value.keys()):
+        matched, child = node.match(key)
+        if not matched:
+            continue
+        if child is None:
+            del value[key]
+        else:
+            _drop(value[key], child)
+
+
+def _keep(value, node):
+    if isinstance(value, list):
+        for item in value:
+            _keep(item, node)
+        return
+    if not isinstance(value, dict):
+        return
+    for key in list(value.keys()):
+        matched, child = node.match(key)
+        if not matched:
+            del value[key]
+        elif child is not None:
+            _keep(value[key], child)
+
+
+def _drop_mapping(properties, node):
+    for key in list(properties.keys()):
+        matched, child = node.match(key)
+        if not matched:
+            continue
+        if child is None:
+            del properties[key]
+        elif 'properties' in properties[key]:
+            _drop_mapping(properties[key]['properties'], child)
+
+
+def _keep_mapping(properties, node):
+    for key in list(properties.keys()):
+        matched, child = node.match(key)
+        if not matched:
+            del properties[key]
+        elif child is not None and 'properties' in properties[key]:
+            _keep_mapping(properties[key]['properties'], child)
+
+
+def _profile_definition(name, config, seen=()):
+    """ Returns (mode, paths) of the named profile. Configuration sections override built-ins. """
+    if name in seen:
+        raise ValueError('Projection %s extends itself' % name)
+    section = SECTION_PREFIX + name
+    if config is not None and config.has_section(section):
+        conf = config[section]
+        mode, paths = 'drop', ()
+        if 'extends' in conf:
+            mode, paths = _profile_definition(conf['extends'], config, seen + (name,))
+        if 'keep' in conf:
+            return 'keep', _split_list(conf['keep'])
+        return mode, paths + _split_list(conf.get('drop', ''))
+    try:
+        return 'drop', BUILTIN_PROFILES[name]['drop']
+    except KeyError:
+        raise ValueError('Unknown projection profile: %s' % name)
+
+
+def load_profile(name, config=None):
+    """ Compiles the named profile. Returns None for the full profile, nothing to project. """
+    mode, paths = _profile_definition(name, config)
+    profile = ProjectionProfile(name, mode, paths)
+    return None if profile.is_noop else profile
+
+
+def profile_names(config=None):
+    names = list(BUILTIN_PROFILES)
+    if config is not None:
+        for section in config.sections():
+            if section.startswith(SECTION_PREFIX) and section[len(SECTION_PREFIX):] not in names:
+                names.append(section[len(SECTION_PREFIX):])
+    return names
+
+
+def measure_savings(src_path, profiles, limit=None):
+    """ Average JSON bytes per stored document for each profile. profiles is a list of
+    (name, profile or None). Returns [(name, bytes per document)]. """
+    totals = dict((name, 0) for name, _ in profiles)
+    documents = 0
+    for doc in local_analytics.iter_documents(src_path):
+        encoded = json.dumps(doc)
+        for name, profile in profiles:
+            if profile is None:
+                totals[name] += len(encoded)
+            else:
+                totals[name] += len(json.dumps(profile.apply(json.loads(encoded))))
+        documents += 1
+        if limit is not None and documents >= limit:
+            break
+    return [(name, totals[name] / documents if documents else 0.0) for name, _ in profiles]
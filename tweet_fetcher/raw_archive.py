@@ -0,0 +1,192 @@
+"""
+Append-only archive of the raw tweet objects returned by the API. The transform to the index
+schema is lossy, so keeping the raw tweets allows rebuilding the index with a changed schema or
+projection without spending API quota.
+
+The archive is a folder of gzip compressed JSON line segments. Every appended batch is its own
+gzip member, so a segment is never rewritten. Each writer starts a new segment, so a batch torn
+by a crash is always at the end of a segment, and a new segment is started once the current one
+grows over segment_max_bytes. Reading skips a torn or corrupted member and resumes at the next
+one, so a crash loses only the batch being written.
+"""
+import gzip
+import json
+import os
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import twitter_es_schema
+
+SEGMENT_PREFIX = 'raw-'
+SEGMENT_SUFFIX = '.jsonl.gz'
+SEGMENT_MAX_BYTES = 8 * 1024 * 1024
+BATCH_SIZE = 1000
+# Segments being transformed or waiting to be pushed, per worker.
+SEGMENTS_IN_FLIGHT = 2
+REINDEX_TIMEOUT_SECONDS = 6 * 3600
+GZIP_MAGIC = b'\x1f\x8b\x08'
+
+
+class RawArchive(object):
+    """ Writer and reader of a raw tweet archive folder. """
+    def __init__(self, directory, segment_max_bytes=SEGMENT_MAX_BYTES):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._segment = None
+
+    def segments(self):
+        """ Paths of the segments, oldest first. """
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _current_segment(self):
+        """ Segment the next batch is appended to. The first batch of a writer starts a new
+        segment, the last one may end with a batch torn by the crash of an earlier writer. """
+        if self._segment is not None and os.path.getsize(self._segment) < self.segment_max_bytes:
+            return self._segment
+        segments = self.segments()
+        number = 0
+        if segments:
+            number = int(os.path.basename(segments[-1])[len(SEGMENT_PREFIX):
+                                                        -len(SEGMENT_SUFFIX)]) + 1
+        self._segment = os.path.join(self.directory,
+                                     '%s%06d%s' % (SEGMENT_PREFIX, number, SEGMENT_SUFFIX))
+        return self._segment
+
+    def append_batch(self, raw_tweets):
+        """ Appends raw tweet objects as one gzip member. Returns the number of tweets. """
+        lines = [json.dumps(raw_tweet) for raw_tweet in raw_tweets]
+        if not lines:
+            return 0
+        data = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+        with open(self._current_segment(), 'ab') as handle:
+            handle.write(data)
+            handle.flush()
+            os.fsync(handle.fileno())
+        return len(lines)
+
+    def __iter__(self):
+        for segment in self.segments():
+            yield from iter_segment(segment)
+
+
+def iter_members(data):
+    """ Yields the decompressed gzip members of data. A member cut short or corrupted is skipped
+    and reading resumes at the next gzip header after it. """
+    view = memoryview(data)
+    position = 0
+    while position < len(data):
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        try:
+            member = decompressor.decompress(view[position:])
+            if not decompressor.eof:
+                raise zlib.error('incomplete member')
+        except zlib.error as ex:
+            yield None, ex
+            position = data.find(GZIP_MAGIC, position + 1)
+            if position < 0:
+                return
+            continue
+        yield member, None
+        position = len(data) - len(decompressor.unused_data)
+
+
+def iter_segment(path):
+    """ Yields the raw tweets of a segment. Batches torn by a crash and lines that are not valid
+    JSON are skipped. """
+    with open(path, 'rb') as handle:
+        data = handle.read()
+    for member, error in iter_members(data):
+        if error is not None:
+            print('Skipping a damaged batch in segment [{}]: {}'.format(path, error))
+            continue
+        for line in member.decode('utf-8', errors='replace').splitlines():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print('Skipping a damaged line in segment [{}]'.format(path))
+
+
+def transform_segment(path, projection=None, batch_size=BATCH_SIZE):
+    """ Runs the current schema transform over a segment. Returns a list of bulk strings of at
+    most batch_size tweets each. """
+    bulk_strings = []
+    bulk_string = ''
+    count = 0
+    for raw_tweet in iter_segment(path):
+        schema = twitter_es_schema.TwitterEsSchema(projection)
+        try:
+            schema.populate(raw_tweet)
+        except (ValueError, KeyError):
+            continue
+        bulk_string += '{ "index": { "_id": %d} }\n' % raw_tweet['id']
+        bulk_string += '%s\n' % schema.get_json()
+        count += 1
+        if count == batch_size:
+            bulk_strings.append(bulk_string)
+            bulk_string = ''
+            count = 0
+    if bulk_string:
+        bulk_strings.append(bulk_string)
+    return bulk_strings
+
+
+def transform_archive(archive, push, projection=None, workers=4, batch_size=BATCH_SIZE):
+    """ Transforms the segments in worker processes and calls push(bulk_string) for every batch
+    in segment order. Only a few segments per worker are submitted ahead, so the transformed
+    archive is never held in memory at once. Returns the number of batches pushed. """
+    workers = max(1, workers)
+    batches = 0
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for segment in archive.segments():
+            in_flight.append(executor.submit(transform_segment, segment, projection, batch_size))
+            if len(in_flight) >= workers * SEGMENTS_IN_FLIGHT:
+                batches += push_all(in_flight.popleft().result(), push)
+        while in_flight:
+            batches += push_all(in_flight.popleft().result(), push)
+    return batches
+
+
+def push_all(bulk_strings, push):
+    for bulk_string in bulk_strings:
+        push(bulk_string)
+    return len(bulk_strings)
+
+
+def migrate_index(es_handle, index, new_index):
+    """ First reindex of a deployment whose tweets are in a concrete index. The tweets of the old
+    index missing from new_index, e.g. the ones fetched before the archive was kept, are copied
+    as they are. The old index is then deleted and its name added as an alias of new_index in
+    the same atomic update. """
+    res = es_handle.reindex(body={
+        'conflicts': 'proceed',
+        'source': {'index': index},
+        'dest': {'index': new_index, 'op_type': 'create'},
+    }, wait_for_completion=True, request_timeout=REINDEX_TIMEOUT_SECONDS)
+    if res.get('failures'):
+        raise RuntimeError('Copying %s to %s failed: %s' % (index, new_index,
+                                                            res['failures'][0]))
+    es_handle.indices.update_aliases(body={'actions': [
+        {'remove_index': {'index': index}},
+        {'add': {'index': new_index, 'alias': index}}]})
+
+
+def swap_alias(es_handle, alias, new_index):
+    """ Points the alias to new_index only, in one atomic update. When the alias name is still a
+    concrete index, the index is migrated with migrate_index. Returns the indices the alias
+    pointed to before. """
+    if es_handle.indices.exists(index=alias) and not es_handle.indices.exists_alias(name=alias):
+        migrate_index(es_handle, alias, new_index)
+        return [alias]
+    old_indices = []
+    if es_handle.indices.exists_alias(name=alias):
+        old_indices = list(es_handle.indices.get_alias(name=alias).keys())
+    actions = [{'remove': {'index': index, 'alias': alias}} for index in old_indices
+               if index != new_index]
+    actions.append({'add': {'index': new_index, 'alias': alias}})
+    es_handle.indices.update_aliases(body={'actions': actions})
+    return old_indices
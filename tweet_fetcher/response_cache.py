@@ -0,0 +1,185 @@
+"""
+Record and replay of Twitter API responses. The cache sits in place of the HTTP session of the
+API object, below tweepy's parsing, so every endpoint is covered and the replayed responses go
+through exactly the same code as live ones.
+
+Response bodies are stored gzip compressed under the SHA-256 of the body, so identical responses
+are stored once. An index maps the request (method, URL and parameters) to the body. When the
+bodies take more than max_bytes, the least recently used ones are evicted down to 90% of it.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import requests
+
+INDEX_FILE = 'index.jsonl'
+OBJECTS_DIR = 'objects'
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# Eviction frees space down to this fraction of max_bytes.
+LOW_WATER_MARK = 0.9
+# The appended index is compacted when it has twice as many lines as entries, and at least this.
+COMPACT_MIN_LINES = 1024
+# Headers kept with a response. Rate limit headers of recorded responses would only mislead the
+# quota planning of a replay.
+KEPT_HEADERS = ('content-type',)
+CACHE_MODES = ('record', 'replay')
+
+
+class ReplayMiss(Exception):
+    """ The request was not recorded. """
+
+
+def request_key(method, url, params=None):
+    """ Key of a request. Parameters are sorted, so their order does not matter. """
+    items = sorted((str(k), str(v)) for k, v in (params or {}).items())
+    return hashlib.sha256(json.dumps([method.upper(), url, items]).encode('utf-8')).hexdigest()
+
+
+class ResponseCache(object):
+    """ Content addressed store of response bodies in a directory. The least recently used order
+    of the bodies is kept in memory and persisted as the modification times of the files. """
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(directory, OBJECTS_DIR), exist_ok=True)
+        self.index = {}
+        self.index_lines = 0
+        try:
+            with open(os.path.join(directory, INDEX_FILE), 'r') as handle:
+                for line in handle:
+                    if line.endswith('\n'):
+                        entry = json.loads(line)
+                        self.index[entry['key']] = entry
+                        self.index_lines += 1
+        except FileNotFoundError:
+            pass
+        # digest -> compressed size, least recently used first
+        self.objects = OrderedDict((digest, size) for digest, size, _ in
+                                   sorted(self._objects(), key=lambda item: item[2]))
+        self.total_bytes = sum(self.objects.values())
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, OBJECTS_DIR, digest[:2], digest)
+
+    def get(self, key):
+        """ (status, headers, body) of a recorded request or None. """
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            path = self._object_path(entry['hash'])
+            try:
+                with open(path, 'rb') as handle:
+                    body = gzip.decompress(handle.read())
+            except FileNotFoundError:
+                del self.index[key]
+                return None
+            # The modification time tells the last use to the next run.
+            os.utime(path)
+            if entry['hash'] in self.objects:
+                self.objects.move_to_end(entry['hash'])
+        return entry['status'], entry['headers'], body
+
+    def put(self, key, status, headers, body):
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._object_path(digest)
+        entry = {'key': key, 'hash': digest, 'status': status,
+                 'headers': dict((h, headers[h]) for h in KEPT_HEADERS if h in headers)}
+        with self.lock:
+            if digest not in self.objects:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                compressed = gzip.compress(body)
+                with open(path + '.tmp', 'wb') as handle:
+                    handle.write(compressed)
+                os.replace(path + '.tmp', path)
+                self.objects[digest] = len(compressed)
+                self.total_bytes += len(compressed)
+            else:
+                os.utime(path)
+                self.objects.move_to_end(digest)
+            self.index[key] = entry
+            with open(os.path.join(self.directory, INDEX_FILE), 'a') as handle:
+                handle.write(json.dumps(entry) + '\n')
+            self.index_lines += 1
+            if self.index_lines > max(COMPACT_MIN_LINES, 2 * len(self.index)):
+                self._rewrite_index()
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def size(self):
+        return sum(size for _, size, _ in self._objects())
+
+    def _objects(self):
+        root = os.path.join(self.directory, OBJECTS_DIR)
+        for prefix in os.listdir(root):
+            for name in os.listdir(os.path.join(root, prefix)):
+                if name.endswith('.tmp'):
+                    continue
+                stat = os.stat(os.path.join(root, prefix, name))
+                yield name, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        """ Removes the least recently used bodies until the cache is down to LOW_WATER_MARK of
+        max_bytes, so that the next puts do not evict again right away. Returns the number of
+        removed bodies. """
+        with self.lock:
+            if self.total_bytes <= self.max_bytes:
+                return 0
+            target = self.max_bytes * LOW_WATER_MARK
+            removed = set()
+            while self.objects and self.total_bytes > target:
+                digest, size = self.objects.popitem(last=False)
+                try:
+                    os.remove(self._object_path(digest))
+                except FileNotFoundError:
+                    pass
+                removed.add(digest)
+                self.total_bytes -= size
+            self.index = dict((key, entry) for key, entry in self.index.items()
+                              if entry['hash'] not in removed)
+            self._rewrite_index()
+            return len(removed)
+
+    def _rewrite_index(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'w') as handle:
+            for entry in self.index.values():
+                handle.write(json.dumps(entry) + '\n')
+        os.replace(path + '.tmp', path)
+        self.index_lines = len(self.index)
+
+
+class CachingSession(requests.Session):
+    """ HTTP session that records successful responses to the cache, or in replay mode answers
+    only from the cache and never touches the network. """
+    def __init__(self, cache, mode='record'):
+        requests.Session.__init__(self)
+        if mode not in CACHE_MODES:
+            raise ValueError('Unknown cache mode %s' % mode)
+        self.cache = cache
+        self.mode = mode
+
+    def request(self, method, url, params=None, **kwargs):
+        key = request_key(method, url, params)
+        if self.mode == 'replay':
+            cached = self.cache.get(key)
+            if cached is None:
+                raise ReplayMiss('%s %s %s was not recorded' % (method, url, params))
+            status, headers, body = cached
+            response = requests.Response()
+            response.status_code = status
+            response.headers.update(headers)
+            response._content = body
+            response.encoding = 'utf-8'
+            response.url = url
+            return response
+
+        response = requests.Session.request(self, method, url, params=params, **kwargs)
+        if response.status_code == 200:
+            self.cache.put(key, response.status_code, response.headers, response.content)
+        return response
@@ -0,0 +1,192 @@
+"""
+Hourly rollups of the indexed tweets for dashboards. Every transformed document adds one to the
+bucket of its hour for each of its hashtags, link domains, its source and its user, and to the
+'all' bucket of the hour. The buckets are kept in memory and flushed after each batch to a
+companion index as scripted upserts, so a bucket document is created on its first flush and its
+count is incremented after that. Dashboards aggregate the small bucket documents instead of the
+raw tweets.
+
+A tweet is counted only when the bulk response tells that it was created in the tweet index.
+Tweets fetched again only update their document and do not inflate the counts. With a spool the
+response comes from the spool's drainer, so the staged documents wait there until their batch has
+been shipped.
+"""
+import hashlib
+import json
+import threading
+from urllib.parse import urlparse
+
+from elasticsearch.helpers import scan
+
+from elasticsearch_index_conf import set_rollup_index
+from es_bulk import split_bulk_string
+
+ROLLUP_SUFFIX = '-rollup'
+BACKFILL_BATCH_SIZE = 1000
+UPSERT_SCRIPT = 'ctx._source.count += params.count'
+
+
+def hour_of(timestamp):
+    """ '2020-09-02T05:16:23' -> '2020-09-02T05:00:00' """
+    return timestamp[:13] + ':00:00'
+
+
+def domain_of(url):
+    netloc = urlparse(url).netloc.lower()
+    return netloc[4:] if netloc.startswith('www.') else netloc
+
+
+def dimension_values(doc):
+    """ (dimension, value) pairs the transformed document is counted in. Each pair once per
+    document. """
+    entities = doc.get('entities') or {}
+    values = [('all', '')]
+    # The transform has already simplified the hashtags to lowercase strings.
+    values.extend(sorted(set(('hashtag', hashtag) for hashtag in entities.get('hashtags') or [])))
+    values.extend(sorted(set(('domain', domain_of(url['expanded_url']))
+                             for url in entities.get('urls') or [] if url.get('expanded_url'))))
+    if doc.get('source'):
+        values.append(('source', doc['source']))
+    user = doc.get('user') or {}
+    if user.get('screen_name'):
+        values.append(('user', user['screen_name']))
+    return values
+
+
+def bucket_id(hour, dimension, value):
+    return hashlib.sha1(json.dumps([hour, dimension, value]).encode('utf-8')).hexdigest()
+
+
+def upsert_bulk_string(buckets):
+    """ Bulk update actions adding the counts to the bucket documents, creating the missing
+    ones. buckets maps (hour, dimension, value) to the count. """
+    bulk_string = ''
+    for (hour, dimension, value), count in sorted(buckets.items()):
+        bulk_string += '{ "update": { "_id": "%s", "retry_on_conflict": 3} }\n' % \
+            bucket_id(hour, dimension, value)
+        bulk_string += '%s\n' % json.dumps({
+            'script': {'source': UPSERT_SCRIPT, 'lang': 'painless', 'params': {'count': count}},
+            'upsert': {'@timestamp': hour, 'hour_of_day': int(hour[11:13]),
+                       'dimension': dimension, 'value': value, 'count': count},
+        })
+    return bulk_string
+
+
+class Rollup(object):
+    """ Buckets not yet flushed to the rollup index. Thread safe, the pipeline transforms and
+    pushes batches from several threads. """
+    def __init__(self, index):
+        self.index = index
+        self.lock = threading.Lock()
+        self.staged = {}  # tweet _id -> (hour, dimension values)
+        self.buckets = {}
+
+    def stage(self, doc):
+        """ Remembers the contribution of a transformed document until the response of its bulk
+        push tells whether it was created. """
+        if '@timestamp' in doc:
+            with self.lock:
+                self.staged[str(doc['id'])] = (hour_of(doc['@timestamp']), dimension_values(doc))
+
+    def stage_bulk(self, bulk_string):
+        """ Stages the documents of a bulk string that are not staged yet, e.g. a batch spooled by
+        an earlier run or sent again after a failed push. The documents are the ones sent to the
+        index, so the fields a projection dropped are not counted. """
+        for action, source in split_bulk_string(bulk_string):
+            if source is None:
+                continue
+            doc = json.loads(source)
+            with self.lock:
+                if str(doc.get('id')) in self.staged:
+                    continue
+            self.stage(doc)
+
+    def discard(self, tweet_ids):
+        """ Forgets staged documents that will not be pushed. """
+        with self.lock:
+            for tweet_id in tweet_ids:
+                self.staged.pop(str(tweet_id), None)
+
+    def _add(self, hour, values):
+        for dimension, value in values:
+            key = (hour, dimension, value)
+            self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def add_document(self, doc):
+        if '@timestamp' in doc:
+            with self.lock:
+                self._add(hour_of(doc['@timestamp']), dimension_values(doc))
+
+    def commit(self, created_ids=None, item_ids=None):
+        """ Settles the staged documents of a push: the created ones are counted, the others
+        dropped. item_ids are the _ids the push got a response for. Without them every staged
+        document is counted. """
+        with self.lock:
+            if item_ids is None:
+                for hour, values in self.staged.values():
+                    self._add(hour, values)
+                self.staged = {}
+                return
+            for tweet_id in item_ids:
+                staged = self.staged.pop(tweet_id, None)
+                if staged is not None and tweet_id in created_ids:
+                    self._add(*staged)
+
+    def bulk_string(self):
+        """ The upserts of the buckets. The buckets are emptied. Returns (bulk string, buckets)
+        so that the counts can be restored if the flush fails. """
+        with self.lock:
+            buckets = self.buckets
+            self.buckets = {}
+        return upsert_bulk_string(buckets), buckets
+
+    def restore(self, buckets):
+        """ Puts the counts of a failed flush back to be sent with the next one. """
+        with self.lock:
+            for key, count in buckets.items():
+                self.buckets[key] = self.buckets.get(key, 0) + count
+
+
+def backfill(es_handle, index, rollup, push, batch_size=BACKFILL_BATCH_SIZE, debug=False):
+    """ Builds the rollups of the tweets already in the index. push is called with each bulk
+    string of upserts. Returns the number of documents counted. """
+    query = {'_source': ['@timestamp', 'source', 'user.screen_name', 'entities.hashtags',
+                         'entities.urls.expanded_url']}
+    documents = 0
+    for hit in scan(es_handle, index=index, query=query, size=batch_size):
+        rollup.add_document(hit.get('_source', {}))
+        documents += 1
+        if documents % batch_size == 0:
+            push(rollup.bulk_string()[0])
+            if debug:
+                print('%d documents rolled up' % documents)
+    if rollup.buckets:
+        push(rollup.bulk_string()[0])
+    return documents
+
+
+def replace_index(es_handle, alias, new_index):
+    """ Points the alias to the rebuilt new_index in one atomic update and deletes the rollup
+    indices it pointed to before. When the alias name is still a concrete index, that index is
+    removed in the same update. Returns the replaced indices. """
+    if es_handle.indices.exists(index=alias) and not es_handle.indices.exists_alias(name=alias):
+        es_handle.indices.update_aliases(body={'actions': [
+            {'remove_index': {'index': alias}},
+            {'add': {'index': new_index, 'alias': alias}}]})
+        return [alias]
+    old_indices = []
+    if es_handle.indices.exists_alias(name=alias):
+        old_indices = [index for index in es_handle.indices.get_alias(name=alias)
+                       if index != new_index]
+    actions = [{'remove': {'index': index, 'alias': alias}} for index in old_indices]
+    actions.append({'add': {'index': new_index, 'alias': alias}})
+    es_handle.indices.update_aliases(body={'actions': actions})
+    for index in old_indices:
+        es_handle.indices.delete(index=index)
+    return old_indices
+
+
+def create_rollup(index, es_handle, debug=False):
+    """ Rollup of the index, its companion index created when missing. """
+    set_rollup_index(index, es_handle, debug=debug)
+    return Rollup(index)
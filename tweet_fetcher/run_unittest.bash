@@ -2,3 +2,25 @@
 
 python3 test_twitter_schema.py -b
 python3 test_elasticsearch_tweepy.py -b
+python3 test_pipeline_metrics.py -b
+python3 test_tracing.py -b
+python3 test_es_bulk.py -b
+python3 test_async_pipeline.py -b
+python3 test_es_client.py -b
+python3 test_es_spool.py -b
+python3 test_local_analytics.py -b
+python3 test_columnar_store.py -b
+python3 test_offline_index.py -b
+python3 test_tweet_graph.py -b
+python3 test_friend_graph.py -b
+python3 test_projection.py -b
+python3 test_raw_archive.py -b
+python3 test_multi_term.py -b
+python3 test_search_budget.py -b
+python3 test_hydrate.py -b
+python3 test_engagement.py -b
+python3 test_credential_pool.py -b
+python3 test_sharding.py -b
+python3 test_response_cache.py -b
+python3 test_elasticsearch_index_conf.py -b
+python3 test_rollup.py -b
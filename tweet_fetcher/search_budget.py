@@ -0,0 +1,111 @@
+"""
+Page budget of the search API. The search endpoint has a fixed number of calls per 15 minute
+window. Instead of letting the first busy term use all of them, each search gets a budget planned
+from the remaining quota and the yield of earlier runs of the same term:
+
+- a quiet term, one whose earlier runs found less than a page of tweets, gets one page
+- other terms get a fair share of the remaining quota over the searches still to run
+- pages a search does not use stay in the quota and raise the share of the later searches
+
+The yield history is kept as an exponentially weighted moving average per term.
+"""
+import json
+import os
+
+MAX_SEARCH_PAGES = 80
+PAGE_SIZE = 100
+EWMA_ALPHA = 0.3
+SEARCH_RESOURCE = '/search/tweets'
+
+
+class SearchBudget(object):
+    """ Plans the number of pages of each search. """
+    def __init__(self, history_path=None, max_pages=MAX_SEARCH_PAGES, alpha=EWMA_ALPHA):
+        self.history_path = history_path
+        self.max_pages = max_pages
+        self.alpha = alpha
+        self.remaining = None  # Unknown until the quota has been read.
+        self.reset = None
+        self.pending = 1
+        self.history = {}
+        if history_path is not None:
+            try:
+                with open(history_path, 'r') as handle:
+                    self.history = json.load(handle)
+            except FileNotFoundError:
+                pass
+
+    def refresh_quota(self, api):
+        """ Reads the remaining search quota from the rate limit status endpoint. With a
+        credential pool the quota is the sum over the credentials. """
+        pool = getattr(api, 'credential_pool', None)
+        apis = pool.credential_apis(api) if pool is not None else [api]
+        remaining = 0
+        resets = []
+        for credential_api in apis:
+            try:
+                status = credential_api.rate_limit_status(resources='search')
+                limits = status['resources']['search'][SEARCH_RESOURCE]
+            except Exception as ex:
+                print('Could not read the search quota: %s' % ex)
+                continue
+            remaining += int(limits['remaining'])
+            resets.append(int(limits['reset']))
+        if resets:
+            self.remaining = remaining
+            self.reset = min(resets)
+
+    def start(self, searches):
+        """ Tells how many searches the quota is shared with. """
+        self.pending = max(1, searches)
+
+    def is_quiet(self, term):
+        stats = self.history.get(term)
+        return stats is not None and stats['tweets'] < PAGE_SIZE
+
+    def fair_share(self):
+        if self.remaining is None:
+            return self.max_pages
+        return min(self.max_pages, self.remaining // self.pending)
+
+    def pages_for(self, term):
+        """ Page budget of the next search of the term. """
+        if self.remaining is not None and self.remaining <= 0:
+            return 0
+        if self.is_quiet(term):
+            return 1
+        return max(1, self.fair_share())
+
+    def extend(self, term, used):
+        """ Extra pages for a quiet term whose page came back full. """
+        if not self.is_quiet(term):
+            return 0
+        return max(0, self.fair_share() - used)
+
+    def consume(self, headers=None):
+        """ Accounts one page. The rate limit headers of the response are used when present. """
+        if headers is not None and 'x-rate-limit-remaining' in headers:
+            self.remaining = int(headers['x-rate-limit-remaining'])
+            self.reset = int(headers.get('x-rate-limit-reset', self.reset or 0))
+        elif self.remaining is not None:
+            self.remaining = max(0, self.remaining - 1)
+
+    def record(self, term, pages, tweets):
+        """ Updates the yield history of the term after a search. A search that fetched no page,
+        e.g. because the quota was used up, tells nothing of the yield and is not recorded. """
+        self.pending = max(1, self.pending - 1)
+        if pages <= 0:
+            return
+        stats = self.history.get(term)
+        if stats is None:
+            self.history[term] = {'pages': float(pages), 'tweets': float(tweets)}
+        else:
+            stats['pages'] += self.alpha * (pages - stats['pages'])
+            stats['tweets'] += self.alpha * (tweets - stats['tweets'])
+
+    def save(self):
+        if self.history_path is None:
+            return
+        with open(self.history_path + '.tmp', 'w') as handle:
+            json.dump(self.history, handle, indent=1, sort_keys=True)
+        os.replace(self.history_path + '.tmp', self.history_path)
@@ -0,0 +1,91 @@
+"""
+Splitting the user list between nodes without a coordinator. Every node reads the same user list
+and keeps only the ids of its own shard, so adding a node only needs a new --shard K/N on each
+node. The modulo method moves most users to another shard when N changes. The jump method
+(jump consistent hash, Lamping & Veach) moves only about 1/N of them.
+
+Each shard keeps a checkpoint of the users done during the current pass over the list, so a
+restarted node continues where it stopped.
+"""
+import os
+
+SHARD_METHODS = ('modulo', 'jump')
+_MASK64 = (1 << 64) - 1
+
+
+def parse_shard(spec):
+    """ 'K/N' -> (K, N). K is 1 based, 1 <= K <= N. """
+    try:
+        k, n = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError('Shard must be given as K/N, not %s' % spec)
+    if n < 1 or not 1 <= k <= n:
+        raise ValueError('Shard %s is not between 1/N and N/N' % spec)
+    return k, n
+
+
+def mix64(key):
+    """ splitmix64 finalizer. Spreads nearby ids over the whole 64 bit range. """
+    key = (key + 0x9e3779b97f4a7c15) & _MASK64
+    key = ((key ^ (key >> 30)) * 0xbf58476d1ce4e5b9) & _MASK64
+    key = ((key ^ (key >> 27)) * 0x94d049bb133111eb) & _MASK64
+    return key ^ (key >> 31)
+
+
+def jump_hash(key, buckets):
+    """ Jump consistent hash of a 64 bit key to 0 .. buckets - 1. """
+    b = -1
+    j = 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & _MASK64
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+class Shard(object):
+    """ Shard K of N. """
+    def __init__(self, k, n, method='modulo'):
+        if method not in SHARD_METHODS:
+            raise ValueError('Unknown shard method %s' % method)
+        self.k = k
+        self.n = n
+        self.method = method
+
+    def bucket(self, user_id):
+        """ 1 based shard of the user id. """
+        if self.method == 'jump':
+            return jump_hash(mix64(user_id), self.n) + 1
+        return user_id % self.n + 1
+
+    def owns(self, user_id):
+        return self.bucket(user_id) == self.k
+
+    def select(self, user_ids):
+        return [user_id for user_id in user_ids if self.owns(user_id)]
+
+    def checkpoint_path(self, storage_path):
+        return '%s.shard-%d-of-%d.%s' % (storage_path, self.k, self.n, self.method)
+
+
+class ListCheckpoint(object):
+    """ User ids done during the current pass. Appended one line per user. """
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        try:
+            with open(path, 'r') as handle:
+                self.done.update(int(line) for line in handle if line.strip())
+        except FileNotFoundError:
+            pass
+
+    def mark(self, user_id):
+        with open(self.path, 'a') as handle:
+            handle.write('%d\n' % user_id)
+        self.done.add(user_id)
+
+    def finish(self):
+        """ The pass is complete. The next run starts from the beginning of the list. """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.done = set()
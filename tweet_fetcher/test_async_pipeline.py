@@ -0,0 +1,75 @@
+import unittest
+from unittest.mock import MagicMock
+
+import async_pipeline
+from tweepy.errors import TooManyRequests
+
+from pipeline_metrics import PipelineMetrics
+from test_elasticsearch_tweepy import MockTweepy, MockResp
+
+
+class TestTweetPipeline(unittest.TestCase):
+    def setUp(self):
+        self.es = MagicMock()
+        self.es.bulk.return_value = {'errors': False}
+
+    def test_list_jobs(self):
+        test_api = MockTweepy()
+        jobs = async_pipeline.user_list_jobs(test_api, './test_data/test_user_list.txt')
+        self.assertEqual(len(jobs), 3)
+
+        ret = test_api.pipeline_to_es(jobs, es_handle = self.es, parallels = 2, queue_size = 1)
+        self.assertTrue(ret)
+        self.assertEqual(self.es.bulk.call_count, 3)
+
+    def test_rate_limit_in_list(self):
+        test_api = MockTweepy()
+        jobs = async_pipeline.user_list_jobs(test_api, './test_data/test_list_ratelimit.txt')
+        test_api.pipeline_to_es(jobs, es_handle = self.es, test = True)
+        self.assertEqual(test_api.simulate_sleep, [61, 244, 549, 976, 1525])
+        self.es.bulk.assert_called_once()
+
+    def test_search_pages(self):
+        test_api = MockTweepy()
+        jobs = [async_pipeline.search_job(test_api, 'dummy_search', -1)]
+        ret = test_api.pipeline_to_es(jobs, es_handle = self.es)
+        self.assertTrue(ret)
+        self.es.bulk.assert_called_once()
+
+    def test_failed_batch(self):
+        test_api = MockTweepy()
+        self.es.bulk.return_value = {'errors': True}
+        jobs = [async_pipeline.user_timeline_job(test_api, 'mikko', with_id = False)]
+        self.assertFalse(test_api.pipeline_to_es(jobs, es_handle = self.es))
+
+    def test_failing_stage_does_not_block_fetchers(self):
+        test_api = MockTweepy()
+        test_api.es_bulk = MagicMock(side_effect=ConnectionError('cluster down'))
+        emits = 50
+
+        def job(emit):
+            for _ in range(emits):
+                emit(['tweet'])
+        test_api.create_es_bulk_string_from_timeline = MagicMock(return_value='bulk')
+        pipeline = async_pipeline.TweetPipeline(test_api, self.es, queue_size = 2)
+        self.assertFalse(pipeline.run([job]))
+        self.assertEqual(test_api.es_bulk.call_count, emits)
+        self.assertEqual(len(pipeline.results), emits)
+
+    def test_rate_limit_label(self):
+        test_api = MockTweepy()
+        test_api.metrics = PipelineMetrics()
+        calls = []
+
+        def job(emit):
+            calls.append(1)
+            if len(calls) == 1:
+                raise TooManyRequests(MockResp())
+        job.endpoint = 'search'
+        pipeline = async_pipeline.TweetPipeline(test_api, self.es, test = True)
+        pipeline.run([job])
+        self.assertEqual(test_api.metrics.get('rate_limit_waits_total', endpoint='search'), 1)
+        self.assertEqual(async_pipeline.search_job(test_api, 'x', -1).endpoint, 'search')
+
+if __name__ == "__main__":
+    unittest.main()
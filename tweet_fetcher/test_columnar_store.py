@@ -0,0 +1,105 @@
+import unittest
+import os
+import shutil
+from unittest.mock import patch
+
+import columnar_store
+
+RECORDS_PATH = './test_data/test_bulk_records.txt'
+ARCHIVE_DIR = './test_data/test_columnar'
+RECORDS_DIR = './test_data/test_columnar_records'
+
+
+class TestColumnarStore(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(ARCHIVE_DIR):
+            shutil.rmtree(ARCHIVE_DIR)
+
+    def tearDown(self):
+        shutil.rmtree(ARCHIVE_DIR)
+        if os.path.exists(RECORDS_DIR):
+            shutil.rmtree(RECORDS_DIR)
+
+    def test_export_and_load(self):
+        rows = columnar_store.export_columnar(RECORDS_PATH, ARCHIVE_DIR, batch_size = 4)
+        self.assertEqual(rows, 6)
+        self.assertTrue(columnar_store.is_columnar_archive(ARCHIVE_DIR))
+
+        archive = columnar_store.ColumnarArchive(ARCHIVE_DIR)
+        self.assertEqual(archive.rows, 6)
+        self.assertEqual(archive.column('id')[0], 1301026162362195971)
+        self.assertEqual(archive.column('timestamp')[0], 1599023783)
+        self.assertEqual(list(archive.column('is_retweet')), [0, 1, 1, 0, 1, 0])
+
+        hashtags = archive.dictionary('hashtags')
+        codes = archive.codes('hashtags')
+        offsets = archive.offsets('hashtags')
+        last_row = [hashtags[code] for code in codes[offsets[5]:offsets[6]]]
+        self.assertEqual(last_row, ['c64', 'retro', 'gaming'])
+        sources = archive.dictionary('source')
+        self.assertEqual(sources[archive.codes('source')[0]], 'Twitter for Android')
+        maps = list(archive._maps)
+        archive.close()
+        self.assertTrue(maps and all(mapped.closed for mapped in maps))
+        with self.assertRaises(ValueError):
+            codes[0]
+
+    def test_manifest_written_per_batch_of_files(self):
+        os.makedirs(RECORDS_DIR)
+        for i in range(5):
+            shutil.copy(RECORDS_PATH, os.path.join(RECORDS_DIR, 'records_%d.txt' % i))
+        commit = columnar_store.ColumnarWriter.commit
+        with patch.object(columnar_store.ColumnarWriter, 'commit', autospec = True,
+                          side_effect = commit) as mock_commit:
+            rows = columnar_store.export_columnar(RECORDS_DIR, ARCHIVE_DIR, commit_files = 2)
+        # The copies hold the same tweets, they are exported once.
+        self.assertEqual(rows, 6)
+        # After the 2nd and 4th file and at the end.
+        self.assertEqual(mock_commit.call_count, 3)
+        self.assertEqual(columnar_store.ColumnarArchive(ARCHIVE_DIR).rows, 6)
+        self.assertEqual(columnar_store.export_columnar(RECORDS_DIR, ARCHIVE_DIR), 0)
+
+    def test_tweets_exported_once(self):
+        columnar_store.export_columnar(RECORDS_PATH, ARCHIVE_DIR)
+        os.makedirs(RECORDS_DIR)
+        shutil.copy(RECORDS_PATH, os.path.join(RECORDS_DIR, 'records_again.txt'))
+        self.assertEqual(columnar_store.export_columnar(RECORDS_DIR, ARCHIVE_DIR), 0)
+        report = columnar_store.analyse_columnar(ARCHIVE_DIR).report()
+        self.assertEqual(report['tweets'], 6)
+
+    def test_archive_closed_on_error(self):
+        columnar_store.export_columnar(RECORDS_PATH, ARCHIVE_DIR)
+        with patch.object(columnar_store.ColumnarArchive, 'close', autospec = True) as close:
+            with patch.object(columnar_store.ColumnarArchive, 'dictionary',
+                              side_effect = KeyError('hashtags')):
+                with self.assertRaises(KeyError):
+                    columnar_store.analyse_columnar(ARCHIVE_DIR)
+        close.assert_called_once()
+
+    def test_incremental_export(self):
+        columnar_store.export_columnar(RECORDS_PATH, ARCHIVE_DIR)
+        self.assertEqual(columnar_store.export_columnar(RECORDS_PATH, ARCHIVE_DIR), 0)
+
+        # Rows written after the last manifest are dropped by the next export.
+        writer = columnar_store.ColumnarWriter(ARCHIVE_DIR)
+        writer.append_batch([{'id': 1, '@timestamp': '2020-01-01T00:00:00', 'time_of_day': 0,
+                              'user': {'id_str': '1', 'screen_name': 'x'}, 'source': 'x',
+                              'is_retweet_status': False, 'is_quote_status': False,
+                              'entities': {'hashtags': ['x'], 'urls': []}}])
+        columnar_store.ColumnarWriter(ARCHIVE_DIR)
+        archive = columnar_store.ColumnarArchive(ARCHIVE_DIR)
+        self.assertEqual(archive.rows, 6)
+        self.assertEqual(os.path.getsize(os.path.join(ARCHIVE_DIR, 'id.col')), 6 * 8)
+        self.assertEqual(len(archive.codes('hashtags')), 6)
+
+    def test_analyse_columnar(self):
+        columnar_store.export_columnar(RECORDS_PATH, ARCHIVE_DIR)
+        report = columnar_store.analyse_columnar(ARCHIVE_DIR).report(top = 3)
+        self.assertEqual(report['tweets'], 6)
+        self.assertEqual(report['retweet_ratio'], 0.5)
+        self.assertEqual(report['top_hashtags'][0], ('gaming', 2))
+        self.assertEqual(report['time_of_day'][13], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from configparser import ConfigParser
+from unittest.mock import patch
+
+from tweepy.errors import TooManyRequests, Unauthorized
+
+from credential_pool import Credential, CredentialPool
+from test_multi_term import MockSearch
+
+
+class MockResponse(object):
+    def __init__(self, status_code, remaining, reset=2000):
+        self.status_code = status_code
+        self.reason = ''
+        self.headers = {'x-rate-limit-remaining': str(remaining), 'x-rate-limit-reset': str(reset)}
+
+    def json(self):
+        return {}
+
+
+class FakeServer(object):
+    """ Answers API.request by the auth of the calling API object. """
+    def __init__(self, quota, revoked=()):
+        self.quota = dict(quota)
+        self.revoked = revoked
+        self.calls = []
+
+    def request(self, api, method, endpoint, *args, **kwargs):
+        self.calls.append(api.auth)
+        if api.auth in self.revoked:
+            api.last_response = MockResponse(401, 0)
+            raise Unauthorized(api.last_response)
+        if self.quota[api.auth] <= 0:
+            api.last_response = MockResponse(429, 0)
+            raise TooManyRequests(api.last_response)
+        self.quota[api.auth] -= 1
+        api.last_response = MockResponse(200, self.quota[api.auth])
+        return api.auth
+
+
+class TestCredentialPool(unittest.TestCase):
+    def make_api(self, server, names):
+        api = MockSearch({})
+        api.auth = None
+        api.credential_pool = CredentialPool([Credential(name, name) for name in names],
+                                             clock=lambda: 1000)
+        self.patcher = patch('credential_pool.API.request', server.request)
+        self.patcher.start()
+        self.addCleanup(self.patcher.stop)
+        return api
+
+    def test_most_remaining_quota(self):
+        server = FakeServer({'a': 3, 'b': 5})
+        api = self.make_api(server, ['a', 'b'])
+        answers = [api.request('GET', 'search/tweets') for _ in range(6)]
+        # First every credential is tried once, then the one with most quota left is used.
+        self.assertEqual(answers, ['a', 'b', 'b', 'b', 'a', 'b'])
+        self.assertEqual(api.last_response.headers['x-rate-limit-remaining'], '1')
+
+    def test_failover(self):
+        server = FakeServer({'a': 0, 'b': 1, 'c': 5}, revoked=('c',))
+        api = self.make_api(server, ['a', 'b', 'c'])
+        self.assertEqual(api.request('GET', 'statuses/lookup'), 'b')
+        with self.assertRaises(TooManyRequests):
+            api.request('GET', 'statuses/lookup')
+        self.assertEqual(server.calls, ['a', 'b', 'c'])
+        self.assertTrue(api.credential_pool.credentials[2].revoked)
+        self.assertEqual(api.credential_pool.choose('statuses/lookup'), None)
+        # Other endpoints have their own limits.
+        self.assertEqual(api.credential_pool.choose('search/tweets').name, 'a')
+
+    def test_window_reset(self):
+        pool = CredentialPool([Credential('a', 'a')], clock=lambda: 3000)
+        pool.exhausted(pool.credentials[0], 'search/tweets', {'x-rate-limit-reset': '2000'})
+        self.assertEqual(pool.choose('search/tweets').name, 'a')
+
+    def test_from_config(self):
+        config = ConfigParser()
+        keys = 'api_key = k\napi_secret = s\nacc_token = t\nacc_secret = u\n'
+        config.read_string('[Twitter API]\n' + keys + '[Twitter API second]\n' + keys)
+        pool = CredentialPool.from_config(config, config['Twitter API'])
+        self.assertEqual([c.name for c in pool.credentials], ['default', 'second'])
+
+
+if __name__ == '__main__':
+    unittest.main()
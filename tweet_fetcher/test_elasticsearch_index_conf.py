@@ -0,0 +1,92 @@
+import unittest
+import json
+from configparser import ConfigParser
+from unittest.mock import MagicMock
+
+import twitter_es_schema
+import mapping_benchmark
+from elasticsearch_index_conf import index_body, dynamic_index_body, set_es_index, index_options
+
+TWEET_FILES = ['./test_data/tweet_user_mentions.json', './test_data/retweet_media.json',
+               './test_data/quote_tweet.json']
+
+
+def unmapped_fields(doc, properties, prefix=''):
+    """ Paths of the document not covered by the explicit properties. """
+    missing = []
+    for key, value in doc.items():
+        path = prefix + key
+        if key not in properties:
+            missing.append(path)
+            continue
+        field = properties[key]
+        if field.get('enabled') is False:
+            continue
+        values = value if isinstance(value, list) else [value]
+        for item in values:
+            if isinstance(item, dict):
+                missing.extend(unmapped_fields(item, field.get('properties', {}), path + '.'))
+    return missing
+
+
+class TestIndexBody(unittest.TestCase):
+    def test_transformed_fields_are_mapped(self):
+        properties = index_body()['mappings']['properties']
+        for path in TWEET_FILES:
+            with open(path, 'r') as handle:
+                schema = twitter_es_schema.TwitterEsSchema()
+                schema.populate(json.load(handle))
+            self.assertEqual(unmapped_fields(schema.tweet, properties), [], path)
+
+    def test_no_text_keyword_multi_fields(self):
+        body = index_body()
+        template = body['mappings']['dynamic_templates'][0]['strings_as_keywords']
+        self.assertEqual(template['match_mapping_type'], 'string')
+        self.assertEqual(template['mapping']['type'], 'keyword')
+        self.assertNotIn('"fields"', json.dumps(body))
+
+    def test_display_only_and_blobs(self):
+        properties = index_body()['mappings']['properties']
+        self.assertFalse(properties['entities']['properties']['urls']['properties']['url']['index'])
+        self.assertFalse(properties['place']['enabled'])
+        self.assertEqual(properties['full_text']['type'], 'text')
+        self.assertEqual(properties['lang']['type'], 'keyword')
+
+    def test_settings(self):
+        self.assertNotIn('index.codec', index_body()['settings'])
+        settings = index_body(best_compression=True, sort_by_timestamp=True)['settings']
+        self.assertEqual(settings['index.codec'], 'best_compression')
+        self.assertEqual(settings['index.sort.field'], '@timestamp')
+        self.assertEqual(settings['index.sort.order'], 'desc')
+
+    def test_index_options(self):
+        config = ConfigParser()
+        config.read_string('[ElasticSearch]\nindex_codec = best_compression\n'
+                           'index_sort_by_timestamp = True\n')
+        self.assertEqual(index_options(config['ElasticSearch']),
+                         {'best_compression': True, 'sort_by_timestamp': True})
+        config.read_string('[Other]\nurl = x\n')
+        self.assertEqual(index_options(config['Other']),
+                         {'best_compression': False, 'sort_by_timestamp': False})
+
+    def test_set_es_index_creates_with_options(self):
+        es = MagicMock()
+        es.indices.exists.return_value = False
+        set_es_index('tweets', es, best_compression=True)
+        body = es.indices.create.call_args.kwargs['body']
+        self.assertEqual(body['settings']['index.codec'], 'best_compression')
+
+        es = MagicMock()
+        es.indices.exists.return_value = True
+        set_es_index('tweets', es)
+        es.indices.create.assert_not_called()
+
+    def test_benchmark_compares_with_dynamic(self):
+        names = [name for name, _ in mapping_benchmark.benchmark_bodies()]
+        self.assertEqual(names[0], 'dynamic')
+        self.assertEqual(mapping_benchmark.benchmark_bodies()[0][1], dynamic_index_body())
+        self.assertIn('explicit', names)
+
+
+if __name__ == '__main__':
+    unittest.main()
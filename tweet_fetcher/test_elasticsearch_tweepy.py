@@ -223,7 +223,8 @@ class TestTermSearchWithEs(unittest.TestCase):
         Elasticsearch.search = MagicMock(return_value = empty_response_json)
         test_api.search_term_to_es('Rate limit', es_handle = es, debug = True)
 
-        Elasticsearch.bulk.assert_called()
+        # Nothing was fetched, so nothing is pushed.
+        Elasticsearch.bulk.assert_not_called()
         self.assertEqual(test_api.latest_since, '-1')
 
     def test_search_term_push_es_normal(self):
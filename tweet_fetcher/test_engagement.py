@@ -0,0 +1,80 @@
+import unittest
+import json
+from unittest.mock import MagicMock, patch
+
+import engagement
+from es_bulk import BulkResult, split_bulk_string
+from test_hydrate import MockLookup
+
+
+class TestEngagement(unittest.TestCase):
+    def test_changed_counters(self):
+        stored = {'favorite_count': 3, 'retweet_count': 1}
+        self.assertEqual(engagement.changed_counters(
+            stored, {'favorite_count': 5, 'retweet_count': 1}), {'favorite_count': 5})
+        self.assertEqual(engagement.changed_counters(
+            stored, {'favorite_count': 3, 'retweet_count': 1}), {})
+
+        items = split_bulk_string(engagement.update_bulk_string([(7, {'retweet_count': 2})]))
+        self.assertEqual(json.loads(items[0][0]), {'update': {'_id': 7}})
+        self.assertEqual(json.loads(items[0][1]), {'doc': {'retweet_count': 2}})
+
+    def test_recent_counters_query(self):
+        hits = [{'_id': '12', '_source': {'favorite_count': 1, 'retweet_count': 0}}]
+        with patch('engagement.scan', return_value=iter(hits)) as mock_scan:
+            self.assertEqual(list(engagement.recent_counters('es', 'tweets', days=3)),
+                             [(12, {'favorite_count': 1, 'retweet_count': 0})])
+        self.assertEqual(mock_scan.call_args[1]['query']['query'],
+                         {'range': {'@timestamp': {'gte': 'now-3d'}}})
+
+    def test_refresh_only_changed(self):
+        api = MockLookup()
+        api.index = 'tweets'
+        # Even ids are found. FakeTweet has no counters, give them some.
+        stored = [(tweet_id, {'favorite_count': 1, 'retweet_count': 0})
+                  for tweet_id in range(1, 151)]
+        api.es_bulk = MagicMock(return_value=BulkResult())
+        lookup = api.lookup_statuses
+
+        def lookup_with_counters(id, tweet_mode='extended'):
+            tweets = lookup(id, tweet_mode)
+            for tweet in tweets:
+                tweet._json['favorite_count'] = 2 if tweet.id % 4 == 0 else 1
+                tweet._json['retweet_count'] = 0
+            return tweets
+        api.lookup_statuses = lookup_with_counters
+
+        with patch('engagement.scan', return_value=iter([
+                {'_id': str(tweet_id), '_source': counters} for tweet_id, counters in stored])):
+            self.assertTrue(api.refresh_engagement('es', days=7, test=True))
+
+        self.assertEqual([len(ids) for ids in api.lookups], [100, 50])
+        bulk_strings = [call[0][1] for call in api.es_bulk.call_args_list]
+        updated = [json.loads(action)['update']['_id'] for bulk_string in bulk_strings
+                   for action, _ in split_bulk_string(bulk_string)]
+        self.assertEqual(updated, list(range(4, 151, 4)))
+
+    def test_scroll_read_before_lookups(self):
+        api = MockLookup()
+        api.index = 'tweets'
+        api.es_bulk = MagicMock(return_value=BulkResult())
+        events = []
+
+        def hits():
+            for tweet_id in range(1, 251):
+                yield {'_id': str(tweet_id), '_source': {}}
+            events.append('scroll done')
+        lookup = api.lookup_statuses
+
+        def recording_lookup(id, tweet_mode='extended'):
+            events.append('lookup')
+            return lookup(id, tweet_mode)
+        api.lookup_statuses = recording_lookup
+
+        with patch('engagement.scan', return_value=hits()):
+            api.refresh_engagement('es', test=True)
+        self.assertEqual(events, ['scroll done', 'lookup', 'lookup', 'lookup'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+import json
+import os
+from unittest.mock import MagicMock, patch
+
+from elasticsearch import exceptions as es_exceptions
+
+import es_bulk
+import pipeline_metrics
+
+BULK_STRING = ('{ "index": { "_id": 1} }\n{"id": 1}\n'
+               '{ "index": { "_id": 2} }\n{"id": 2}\n'
+               '{ "index": { "_id": 3} }\n{"id": 3}\n')
+
+
+def item(_id, status, error_type=None):
+    response = {'_id': str(_id), 'status': status}
+    if error_type is not None:
+        response['error'] = {'type': error_type, 'reason': 'test'}
+    return {'index': response}
+
+
+class TestPushBulk(unittest.TestCase):
+    def test_split_and_join(self):
+        items = es_bulk.split_bulk_string(BULK_STRING + '{ "delete": { "_id": 4} }\n')
+        self.assertEqual(len(items), 4)
+        self.assertEqual(items[3][1], None)
+        self.assertEqual(es_bulk.join_bulk_items(items[:3]), BULK_STRING)
+
+    def test_retry_only_rejected_items(self):
+        es = MagicMock()
+        es.bulk.side_effect = [
+            {'errors': True, 'items': [item(1, 201), item(2, 429, 'es_rejected_execution_exception'),
+                                       item(3, 201)]},
+            {'errors': False, 'items': [item(2, 201)]},
+        ]
+        sleeps = []
+        result = es_bulk.push_bulk(es, BULK_STRING, 'test-index', sleep_function=sleeps.append,
+                                   metrics=pipeline_metrics.PipelineMetrics())
+
+        self.assertTrue(result.ok)
+        self.assertEqual(result.succeeded, 3)
+        self.assertEqual(result.retried, 1)
+        self.assertEqual(len(sleeps), 1)
+        es.bulk.assert_called_with('{ "index": { "_id": 2} }\n{"id": 2}\n', index='test-index')
+
+    def test_dead_letter_permanent_failures(self):
+        dead_letter_path = './test_data/test_dead_letter.ndjson'
+        if os.path.exists(dead_letter_path):
+            os.remove(dead_letter_path)
+        es = MagicMock()
+        es.bulk.return_value = {'errors': True, 'items': [
+            item(1, 201), item(2, 400, 'mapper_parsing_exception'),
+            item(3, 429, 'es_rejected_execution_exception')]}
+
+        result = es_bulk.push_bulk(es, BULK_STRING, 'test-index', max_retries=0,
+                                   dead_letter_path=dead_letter_path,
+                                   metrics=pipeline_metrics.PipelineMetrics())
+        self.assertFalse(result.ok)
+        self.assertTrue(result.partial)
+        self.assertEqual(result.succeeded, 1)
+        self.assertEqual(result.dead_lettered, 2)
+
+        with open(dead_letter_path, 'r') as handle:
+            dead_letters = [json.loads(line) for line in handle]
+        os.remove(dead_letter_path)
+        self.assertEqual(dead_letters[0]['error']['type'], 'mapper_parsing_exception')
+        self.assertEqual(dead_letters[0]['source'], {'id': 2})
+        self.assertEqual(dead_letters[1]['status'], 429)
+
+    def test_no_item_information(self):
+        es = MagicMock()
+        es.bulk.return_value = {'errors': True}
+        result = es_bulk.push_bulk(es, BULK_STRING, 'test-index',
+                                   metrics=pipeline_metrics.PipelineMetrics())
+        self.assertFalse(result.ok)
+        self.assertEqual(result.failed, 3)
+        es.bulk.assert_called_once()
+
+    def test_retry_failed_request(self):
+        es = MagicMock()
+        es.bulk.side_effect = [
+            es_exceptions.ConnectionError('N/A', 'connection refused', None),
+            es_exceptions.TransportError(429, 'too many requests', None),
+            {'errors': False, 'items': [item(1, 201), item(2, 201), item(3, 201)]},
+        ]
+        sleeps = []
+        result = es_bulk.push_bulk(es, BULK_STRING, 'test-index', sleep_function=sleeps.append,
+                                   metrics=pipeline_metrics.PipelineMetrics())
+        self.assertTrue(result.ok)
+        self.assertEqual(result.succeeded, 3)
+        self.assertEqual(len(sleeps), 2)
+
+        es.bulk.side_effect = es_exceptions.ConnectionError('N/A', 'connection refused', None)
+        with self.assertRaises(es_exceptions.ConnectionError):
+            es_bulk.push_bulk(es, BULK_STRING, 'test-index', sleep_function=sleeps.append,
+                              max_retries=2, metrics=pipeline_metrics.PipelineMetrics())
+
+        es.bulk.side_effect = es_exceptions.RequestError(400, 'parsing_exception', None)
+        with self.assertRaises(es_exceptions.RequestError):
+            es_bulk.push_bulk(es, BULK_STRING, 'test-index', sleep_function=sleeps.append,
+                              metrics=pipeline_metrics.PipelineMetrics())
+
+    def test_dropped_failures_are_reported(self):
+        es = MagicMock()
+        es.bulk.return_value = {'errors': True, 'items': [
+            item(1, 201), item(2, 400, 'mapper_parsing_exception'), item(3, 201)]}
+        with patch('builtins.print') as mock_print:
+            result = es_bulk.push_bulk(es, BULK_STRING, 'test-index',
+                                       metrics=pipeline_metrics.PipelineMetrics())
+        self.assertEqual(result.failed, 1)
+        self.assertIn('mapper_parsing_exception', mock_print.call_args_list[0][0][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from configparser import ConfigParser
+
+import es_client
+
+CONFIG = """
+[ElasticSearch]
+url = https://localhost:9200
+auth_user = example-user
+use_ssl = True
+verify_certs = True
+pool_maxsize = 8
+"""
+
+
+class TestEsClient(unittest.TestCase):
+    def setUp(self):
+        self.config = ConfigParser()
+        self.config.read_string(CONFIG)
+
+    def test_defaults(self):
+        options = es_client.es_client_options(self.config['ElasticSearch'], 'secret')
+        self.assertEqual(options['http_auth'], ('example-user', 'secret'))
+        self.assertTrue(options['use_ssl'])
+        self.assertTrue(options['verify_certs'])
+        self.assertTrue(options['http_compress'])
+        self.assertTrue(options['retry_on_timeout'])
+        self.assertEqual(options['maxsize'], 8)
+        self.assertEqual(options['headers'], {'Connection': 'keep-alive'})
+
+    def test_pool_matches_concurrency(self):
+        options = es_client.es_client_options(self.config['ElasticSearch'], 'secret',
+                                              pool_size = 17)
+        self.assertEqual(options['maxsize'], 17)
+
+    def test_create_client(self):
+        self.config['ElasticSearch']['http_compress'] = 'False'
+        es = es_client.create_es_client(self.config['ElasticSearch'], 'secret')
+        connection = es.transport.get_connection()
+        self.assertFalse(connection.http_compress)
+        self.assertEqual(connection.pool.pool.maxsize, 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+import os
+import shutil
+
+from unittest.mock import MagicMock, patch
+
+import es_spool
+import pipeline_metrics
+from test_elasticsearch_tweepy import MockTweepy
+
+SPOOL_DIR = './test_data/test_spool'
+BULK_STRING = '{ "index": { "_id": 1} }\n{"id": 1}\n'
+
+
+class TestEsSpool(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(SPOOL_DIR):
+            shutil.rmtree(SPOOL_DIR)
+        self.metrics = pipeline_metrics.PipelineMetrics()
+
+    def tearDown(self):
+        shutil.rmtree(SPOOL_DIR)
+
+    def test_append_and_drain(self):
+        spool = es_spool.EsSpool(SPOOL_DIR, fsync_every = 2, metrics = self.metrics)
+        spool.append('index-a', BULK_STRING)
+        spool.append('index-b', BULK_STRING)
+        self.assertEqual(spool.pending_segments(), [])
+        spool.seal()
+        self.assertEqual(len(spool.pending_segments()), 1)
+
+        shipped = []
+        self.assertTrue(spool.drain(lambda index, body: shipped.append((index, body))))
+        self.assertEqual(shipped, [('index-a', BULK_STRING), ('index-b', BULK_STRING)])
+        self.assertEqual(spool.segments(), [])
+
+    def test_resume_after_failure(self):
+        spool = es_spool.EsSpool(SPOOL_DIR, metrics = self.metrics)
+        for i in range(3):
+            spool.append('index-a', BULK_STRING.replace('1', str(i)))
+        spool.seal()
+
+        shipped = []
+
+        def flaky_push(index, body):
+            if len(shipped) == 1:
+                shipped.append(None)
+                raise ConnectionError('cluster down')
+            shipped.append(body)
+
+        name = spool.pending_segments()[0]
+        with self.assertRaises(ConnectionError):
+            spool.drain_segment(name, flaky_push)
+
+        # A new spool on the same directory continues after the acknowledged batch.
+        spool = es_spool.EsSpool(SPOOL_DIR, metrics = self.metrics)
+        spool.drain_segment(name, flaky_push)
+        self.assertEqual(shipped, [BULK_STRING.replace('1', '0'), None,
+                                   BULK_STRING.replace('1', '1'), BULK_STRING.replace('1', '2')])
+        self.assertEqual(spool.segments(), [])
+
+    def test_torn_record(self):
+        spool = es_spool.EsSpool(SPOOL_DIR, metrics = self.metrics)
+        spool.append('index-a', BULK_STRING)
+        spool.seal()
+        path = os.path.join(SPOOL_DIR, spool.segments()[0])
+        with open(path, 'ab') as handle:
+            handle.write(b'\x00\x00\x01\x00garbage')
+
+        records = list(es_spool.read_records(path))
+        self.assertEqual(len(records), 1)
+
+    def test_segments_of_other_runs(self):
+        other = es_spool.EsSpool(SPOOL_DIR, metrics = self.metrics)
+        other.append('index-a', BULK_STRING)
+        spool = es_spool.EsSpool(SPOOL_DIR, metrics = self.metrics)
+        spool.append('index-b', BULK_STRING)
+        # Both runs write their own segment.
+        self.assertEqual(len(spool.segments()), 2)
+
+        # The segment still written by the other run is not shipped.
+        shipped = []
+        spool.seal()
+        self.assertFalse(spool.drain(lambda index, body: shipped.append(index)))
+        self.assertEqual(shipped, ['index-b'])
+        other.seal()
+        self.assertTrue(spool.drain(lambda index, body: shipped.append(index)))
+        self.assertEqual(shipped, ['index-b', 'index-a'])
+        self.assertEqual(spool.segments(), [])
+
+    def test_background_drainer(self):
+        spool = es_spool.EsSpool(SPOOL_DIR, metrics = self.metrics)
+        shipped = []
+        spool.start_drainer(lambda index, body: shipped.append(index))
+        spool.append('index-a', BULK_STRING)
+        self.assertTrue(spool.close(drain_timeout = 5))
+        self.assertEqual(shipped, ['index-a'])
+
+
+class TestSpoolPusher(unittest.TestCase):
+    def setUp(self):
+        self.es = MagicMock()
+        self.es.indices.exists.return_value = True
+        self.es.bulk.return_value = {'errors': True, 'items': [
+            {'index': {'_id': '1', 'status': 400, 'error': {'type': 'mapper_parsing_exception'}}}]}
+
+    def test_failed_items_go_to_the_spool_dead_letters(self):
+        test_api = MockTweepy()
+        test_api.spool = es_spool.EsSpool(SPOOL_DIR)
+        try:
+            test_api.spool_pusher(self.es)('tweets', BULK_STRING)
+            with open(test_api.spool.dead_letter_path, 'r') as handle:
+                self.assertEqual(len(handle.readlines()), 1)
+        finally:
+            shutil.rmtree(SPOOL_DIR)
+
+    def test_rejected_items_keep_the_batch(self):
+        test_api = MockTweepy()
+        test_api.dead_letter_path = './test_data/test_spool_dead_letters.txt'
+        self.es.bulk.return_value = {'errors': True, 'items': [
+            {'index': {'_id': '1', 'status': 429, 'error': {'type': 'es_rejected_execution'}}}]}
+        push = test_api.spool_pusher(self.es)
+        with patch('es_bulk.backoff_seconds', return_value = 0):
+            with self.assertRaises(RuntimeError):
+                push('tweets', BULK_STRING)
+        self.assertFalse(os.path.exists(test_api.dead_letter_path))
+
+    def test_dead_lettered_items_are_acknowledged(self):
+        test_api = MockTweepy()
+        test_api.dead_letter_path = './test_data/test_spool_dead_letters.txt'
+        try:
+            test_api.spool_pusher(self.es)('tweets', BULK_STRING)
+        finally:
+            os.remove(test_api.dead_letter_path)
+
+    def test_since_id_without_cluster(self):
+        test_api = MockTweepy()
+        test_api.index = 'tweets'
+        self.es.search.side_effect = ConnectionError('down')
+        with self.assertRaises(ConnectionError):
+            test_api.get_id_most_recent_tweet_in_es_index(self.es)
+        test_api.spool = MagicMock()
+        self.assertEqual(test_api.get_id_most_recent_tweet_in_es_index(self.es), '-1')
+
+
+if __name__ == "__main__":
+    unittest.main()
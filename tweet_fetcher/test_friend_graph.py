@@ -0,0 +1,64 @@
+import unittest
+import os
+import shutil
+
+from friend_graph import FriendGraph
+from test_elasticsearch_tweepy import MockTweepy
+
+GRAPH_DIR = './test_data/test_friend_graph'
+
+
+class TestFriendGraph(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(GRAPH_DIR):
+            shutil.rmtree(GRAPH_DIR)
+        graph = FriendGraph()
+        graph = graph.with_seed('a', [5, 3, 1, 3])
+        graph = graph.with_seed('b', [3, 4, 5])
+        graph = graph.with_seed('c', [9])
+        graph.save(GRAPH_DIR)
+        self.graph = FriendGraph.load(GRAPH_DIR)
+
+    def tearDown(self):
+        shutil.rmtree(GRAPH_DIR)
+
+    def test_csr_rows(self):
+        self.assertEqual(self.graph.seeds, ['a', 'b', 'c'])
+        self.assertEqual(list(self.graph.indptr), [0, 3, 6, 7])
+        self.assertEqual(list(self.graph.row('a')), [1, 3, 5])
+
+        replaced = self.graph.with_seed('a', [1])
+        self.assertEqual(replaced.seeds, ['b', 'c', 'a'])
+        self.assertEqual(list(replaced.row('a')), [1])
+        self.assertEqual(list(replaced.row('b')), [3, 4, 5])
+
+    def test_overlap_queries(self):
+        self.assertEqual(self.graph.jaccard('a', 'b'), 0.5)
+        self.assertEqual(self.graph.pairwise_jaccard(top = 1), [('a', 'b', 0.5)])
+        graph = self.graph.with_seed('d', [1, 4, 9])
+        self.assertEqual(sorted(graph.pairwise_jaccard()),
+                         sorted((a, b, graph.jaccard(a, b))
+                                for i, a in enumerate(graph.seeds) for b in graph.seeds[i + 1:]))
+        self.assertEqual(self.graph.most_shared(2), [(3, 2), (5, 2)])
+        self.assertEqual(self.graph.followed_by_at_least(2), [3, 5])
+
+    def test_seeds_in_lowercase(self):
+        graph = self.graph.with_seed('Mikko', [1]).with_seed('MIKKO', [2, 3])
+        self.assertEqual(graph.seeds, ['a', 'b', 'c', 'mikko'])
+        self.assertEqual(list(graph.row('Mikko')), [2, 3])
+
+    def test_generate_mode_keeps_graph(self):
+        storage_path = './test_data/test_id_storage_graph.txt'
+        test_api = MockTweepy()
+        test_api.save_friends_file('mikko', storage_path, friend_graph_path = GRAPH_DIR)
+        test_api.save_friends_file('joni', storage_path, friend_graph_path = GRAPH_DIR)
+        os.remove(storage_path)
+
+        graph = FriendGraph.load(GRAPH_DIR)
+        self.assertEqual(graph.seeds, ['a', 'b', 'c', 'mikko', 'joni'])
+        self.assertEqual(list(graph.row('joni')), [22, 67, 96])
+        self.assertEqual(graph.jaccard('mikko', 'joni'), 0.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
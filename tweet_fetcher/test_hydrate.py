@@ -0,0 +1,75 @@
+import unittest
+import os
+from unittest.mock import MagicMock
+
+from tweepy.errors import TooManyRequests
+
+import hydrate
+from test_multi_term import FakeTweet, MockSearch
+from test_elasticsearch_tweepy import MockResp
+
+ID_PATH = './test_data/test_hydrate_ids.txt'
+CHECKPOINT_PATH = './test_data/test_hydrate.checkpoint'
+
+
+class MockLookup(MockSearch):
+    def __init__(self, rate_limited=0):
+        MockSearch.__init__(self, {})
+        self.lookups = []
+        self.rate_limited = rate_limited
+
+    def lookup_statuses(self, id, tweet_mode='extended'):
+        if self.rate_limited:
+            self.rate_limited -= 1
+            raise TooManyRequests(MockResp())
+        self.lookups.append(list(id))
+        # Odd ids have been deleted.
+        return [FakeTweet(tweet_id, 'text') for tweet_id in id if tweet_id % 2 == 0]
+
+
+class TestHydrate(unittest.TestCase):
+    def setUp(self):
+        with open(ID_PATH, 'w') as handle:
+            handle.write('id\n')
+            for tweet_id in range(1, 251):
+                handle.write('%d,extra\n' % tweet_id)
+            handle.write('4\n')
+
+    def tearDown(self):
+        for path in (ID_PATH, CHECKPOINT_PATH, CHECKPOINT_PATH + '.seen'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_batches(self):
+        batches = list(hydrate.iter_id_batches(ID_PATH, seen={1, 2}))
+        self.assertEqual([len(ids) for ids, _ in batches], [100, 100, 48])
+        self.assertEqual(batches[0][0][0], 3)
+        rest = list(hydrate.iter_id_batches(ID_PATH, offset=batches[1][1]))
+        self.assertEqual(rest[0][0][0], 203)
+
+    def test_hydrate_and_resume(self):
+        api = MockLookup()
+        api.create_es_bulk_string_from_timeline = lambda tweets: 'bulk'
+        api.push_bulk_string_tweets_to_es = MagicMock(side_effect=[True, False, True, True])
+        self.assertFalse(api.hydrate_ids_to_es(ID_PATH, CHECKPOINT_PATH, es_handle=None,
+                                               test=True))
+        state = hydrate.HydrationState(CHECKPOINT_PATH, ID_PATH)
+        self.assertEqual((state.hydrated, state.missing, len(state.seen)), (50, 50, 100))
+
+        api.lookups = []
+        self.assertTrue(api.hydrate_ids_to_es(ID_PATH, CHECKPOINT_PATH, es_handle=None,
+                                              test=True))
+        self.assertEqual([ids[0] for ids in api.lookups], [101, 201])
+        state = hydrate.HydrationState(CHECKPOINT_PATH, ID_PATH)
+        self.assertEqual((state.hydrated, state.missing), (125, 125))
+
+    def test_rate_limit(self):
+        api = MockLookup(rate_limited=5)
+        self.assertFalse(api.hydrate_ids_to_es(ID_PATH, CHECKPOINT_PATH, es_handle=None,
+                                               test=True))
+        self.assertEqual(api.simulate_sleep, [61, 244, 549, 976, 1525])
+        self.assertFalse(os.path.exists(CHECKPOINT_PATH))
+
+
+if __name__ == '__main__':
+    unittest.main()
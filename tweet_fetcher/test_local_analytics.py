@@ -0,0 +1,53 @@
+import unittest
+from collections import Counter
+
+import local_analytics
+
+RECORDS_PATH = './test_data/test_bulk_records.txt'
+
+
+class TestLocalAnalytics(unittest.TestCase):
+    def test_iter_batches(self):
+        batches = list(local_analytics.iter_batches(RECORDS_PATH, batch_size = 4))
+        self.assertEqual([len(batch) for batch in batches], [4, 2])
+        self.assertEqual(batches[0][0]['id'], 1301026162362195971)
+
+    def test_iter_column_batches(self):
+        batches = list(local_analytics.iter_column_batches(RECORDS_PATH, batch_size = 4))
+        self.assertEqual([len(columns['source']) for columns in batches], [4, 2])
+        expected = [local_analytics.to_columns(batch)
+                    for batch in local_analytics.iter_batches(RECORDS_PATH, batch_size = 4)]
+        self.assertEqual(batches, expected)
+
+    def test_report(self):
+        analysis = local_analytics.analyse_path(RECORDS_PATH, batch_size = 4)
+        report = analysis.report(top = 3)
+
+        self.assertEqual(report['tweets'], 6)
+        self.assertEqual(report['retweet_ratio'], 0.5)
+        self.assertEqual(report['top_hashtags'][0], ('gaming', 2))
+        self.assertEqual(report['top_domains'], [('twitter.com', 3)])
+        self.assertEqual(sum(report['time_of_day']), 6)
+        self.assertEqual(report['time_of_day'][13], 1)
+        self.assertEqual(dict(report['top_users']), {'jvitorpalo': 3, 'mikko': 3})
+        self.assertTrue('Tweets: 6' in local_analytics.format_report(report))
+
+    def test_prune(self):
+        counter = Counter({'a': 5, 'b': 4, 'c': 1, 'd': 1})
+        local_analytics._prune(counter, 3)
+        self.assertEqual(counter, Counter({'a': 5}))
+        self.assertFalse(local_analytics._prune(counter, 3))
+
+    def test_pruning_is_reported(self):
+        analysis = local_analytics.analyse_path(RECORDS_PATH, batch_size = 4, max_distinct = 2)
+        report = analysis.report()
+        self.assertIn('hashtags', report['pruned'])
+        self.assertNotIn('user', report['pruned'])
+        self.assertIn('are lower bounds', local_analytics.format_report(report))
+        report = local_analytics.analyse_path(RECORDS_PATH).report()
+        self.assertEqual(report['pruned'], [])
+        self.assertNotIn('lower bounds', local_analytics.format_report(report))
+
+
+if __name__ == "__main__":
+    unittest.main()
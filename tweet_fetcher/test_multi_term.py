@@ -0,0 +1,140 @@
+import unittest
+import json
+import os
+from unittest.mock import MagicMock, patch
+
+import elasticsearch_tweepy
+import multi_term
+
+CHECKPOINT_PATH = './test_data/test_term_checkpoints.json'
+
+
+class FakeTweet(object):
+    def __init__(self, tweet_id, text, hashtags=()):
+        self.id = tweet_id
+        self._json = {'id': tweet_id, 'full_text': text,
+                      'entities': {'hashtags': [{'text': tag} for tag in hashtags],
+                                   'user_mentions': []}}
+
+
+class MockSearch(elasticsearch_tweepy.ElasticSearchTweepy):
+    def __init__(self, pages):
+        self.index = -1
+        self.pages = pages
+        self.queries = []
+
+    def search(self, search_term, count=20, result_type='recent', max_id='-1', since_id='-1'):
+        self.queries.append((search_term, since_id))
+        if max_id == -1:
+            return self.pages.get(search_term, [])
+        return []
+
+
+class PagedSearch(MockSearch):
+    """ 250 matching tweets, ids 1 to 250, served in pages of 100 newest first. """
+    def search(self, search_term, count=20, result_type='recent', max_id='-1', since_id='-1'):
+        self.queries.append((search_term, since_id, max_id))
+        ids = [tweet_id for tweet_id in range(250, 0, -1)
+               if tweet_id > int(since_id) and (max_id == -1 or tweet_id <= max_id)]
+        return [FakeTweet(tweet_id, 'amiga') for tweet_id in ids[:count]]
+
+
+class TestMultiTerm(unittest.TestCase):
+    def tearDown(self):
+        for path in (CHECKPOINT_PATH, CHECKPOINT_PATH + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_pack_terms(self):
+        terms = ['#c64', 'amiga', 'retro computing', 'x' * 495]
+        packed = multi_term.pack_terms(terms, max_length=40)
+        self.assertEqual(packed[0], ('#c64 OR amiga OR "retro computing"',
+                                     ['#c64', 'amiga', 'retro computing']))
+        self.assertEqual(packed[1][1], ['x' * 495])
+        for query, _ in multi_term.pack_terms(['#tag%d' % i for i in range(150)]):
+            self.assertLessEqual(len(query), multi_term.MAX_QUERY_LENGTH)
+
+    def test_matcher(self):
+        matcher = multi_term.TermMatcher(['#c64', 'amiga', 'retro computing', '@mikko'])
+        raw = FakeTweet(1, 'Retro computing with an Amiga', ['C64'])._json
+        self.assertEqual(matcher.match(raw), ['#c64', 'amiga', 'retro computing'])
+        raw['entities']['user_mentions'].append({'screen_name': 'Mikko'})
+        self.assertIn('@mikko', matcher.match(raw))
+        self.assertEqual(matcher.match(FakeTweet(2, 'amigos')._json), [])
+
+    def test_routing_and_checkpoints(self):
+        api = MockSearch({'#c64 OR amiga': [FakeTweet(30, 'amiga news'),
+                                            FakeTweet(20, 'old #c64', ['c64'])]})
+        with open(CHECKPOINT_PATH, 'w') as handle:
+            json.dump({'#c64': 25, 'amiga': 10}, handle)
+        checkpoints = multi_term.load_checkpoints(CHECKPOINT_PATH)
+
+        tweets, routes = api.fetch_search_results_for_terms(['#c64', 'amiga'], checkpoints)
+        self.assertEqual(api.queries[0], ('#c64 OR amiga', 10))
+        self.assertEqual([tweet.id for tweet in tweets], [30, 20])
+        # Tweet 20 is older than the checkpoint of #c64.
+        self.assertEqual(routes, {30: ['amiga'], 20: []})
+        self.assertEqual(checkpoints, {'#c64': 30, 'amiga': 30})
+
+    def test_search_cut_short_by_budget(self):
+        api = PagedSearch({})
+        checkpoints = {'amiga': 0}
+        fetched = []
+        with patch('elasticsearch_tweepy.MAX_SEARCH_PAGES', 1):
+            for _ in range(2):
+                tweets, _ = api.fetch_search_results_for_terms(['amiga'], checkpoints)
+                fetched.extend(tweet.id for tweet in tweets)
+                # The checkpoint stays until the older tweets have been searched.
+                self.assertEqual(checkpoints['amiga'], 0)
+            self.assertEqual(checkpoints[multi_term.RESUME_KEY],
+                             {'amiga': {'since_id': 0, 'max_id': 50, 'newest': 250}})
+            tweets, _ = api.fetch_search_results_for_terms(['amiga'], checkpoints)
+            fetched.extend(tweet.id for tweet in tweets)
+        self.assertEqual(checkpoints, {'amiga': 250})
+        self.assertEqual(sorted(fetched), list(range(1, 251)))
+        self.assertEqual([query[2] for query in api.queries], [-1, 150, 50])
+
+    def test_term_to_file_cut_short(self):
+        api = PagedSearch({})
+        api.create_es_bulk_string_from_timeline = MagicMock(return_value='bulk')
+        with patch('elasticsearch_tweepy.MAX_SEARCH_PAGES', 2):
+            api.search_term_to_file('amiga', './test_data/terms', CHECKPOINT_PATH)
+            with open(CHECKPOINT_PATH, 'r') as handle:
+                self.assertEqual(json.load(handle),
+                                 {'since_id': -1, 'max_id': 50, 'newest': 250})
+            api.search_term_to_file('amiga', './test_data/terms', CHECKPOINT_PATH)
+        with open(CHECKPOINT_PATH, 'r') as handle:
+            self.assertEqual(handle.read(), '250')
+        for name in os.listdir('./test_data'):
+            if name.startswith('terms-'):
+                os.remove(os.path.join('./test_data', name))
+
+    def test_terms_to_file(self):
+        api = MockSearch({})
+        self.assertEqual(api.search_terms_to_file(['amiga'], './test_data/terms',
+                                                  CHECKPOINT_PATH), '')
+        self.assertEqual(multi_term.load_checkpoints(CHECKPOINT_PATH), {})
+
+    def test_terms_to_es_per_query(self):
+        api = MockSearch({'#c64': [FakeTweet(30, 'c64 news', ['c64'])],
+                          'amiga': [FakeTweet(40, 'amiga news'), FakeTweet(30, 'c64 news')]})
+        api.create_es_bulk_string_from_timeline = MagicMock(return_value='bulk')
+        # The push of the second query fails.
+        api.push_bulk_string_tweets_to_es = MagicMock(side_effect=[True, False])
+        with patch('multi_term.pack_terms', return_value=[('#c64', ['#c64']),
+                                                          ('amiga', ['amiga'])]):
+            self.assertFalse(api.search_terms_to_es(['#c64', 'amiga'], CHECKPOINT_PATH, 'es'))
+        self.assertEqual(multi_term.load_checkpoints(CHECKPOINT_PATH), {'#c64': 30})
+        # Tweet 30 was already indexed with the first query.
+        pushed = api.create_es_bulk_string_from_timeline.call_args_list[1][0][0]
+        self.assertEqual([tweet.id for tweet in pushed], [40])
+
+    def test_terms_to_es_nothing_found(self):
+        api = MockSearch({})
+        api.es_bulk = MagicMock()
+        self.assertTrue(api.search_terms_to_es(['amiga'], CHECKPOINT_PATH, 'es'))
+        api.es_bulk.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import os
+import shutil
+from unittest.mock import patch
+
+import offline_index
+
+RECORDS_PATH = './test_data/test_bulk_records.txt'
+INDEX_DIR = './test_data/test_offline_index'
+
+
+class TestOfflineIndex(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(INDEX_DIR):
+            shutil.rmtree(INDEX_DIR)
+        self.index = offline_index.OfflineIndex(INDEX_DIR)
+        self.assertEqual(self.index.add_path(RECORDS_PATH), 6)
+
+    def tearDown(self):
+        shutil.rmtree(INDEX_DIR)
+
+    def test_tokenize(self):
+        self.assertEqual(offline_index.tokenize('Kick the robots. https://t.co/9GuBIzg7jE'),
+                         ['kick', 'the', 'robots'])
+
+    def test_queries(self):
+        self.assertEqual(self.index.search('#gaming'), [1304775835556237314, 1301026162362195971])
+        self.assertEqual(self.index.search('commodore games'), [1304775835556237314])
+        self.assertEqual(self.index.search('robots OR commodore'),
+                         [1304775835556237314, 1302696994704678913])
+        self.assertEqual(self.index.search('gaming since:2020-09-10'), [1304775835556237314])
+        self.assertEqual(self.index.search('gaming until:2020-09-10'), [1301026162362195971])
+        self.assertEqual(self.index.search('nonexistingword'), [])
+
+    def test_date_only_queries(self):
+        everything = self.index.search('since:2000-01-01')
+        self.assertEqual(len(everything), 6)
+        self.assertEqual(everything, sorted(everything, reverse=True))
+        since = self.index.search('since:2020-09-10')
+        self.assertIn(1304775835556237314, since)
+        self.assertNotIn(1301026162362195971, since)
+        self.assertEqual(sorted(since + self.index.search('until:2020-09-10'), reverse=True),
+                         everything)
+
+    def test_queries_without_index_terms(self):
+        for query in ('x', 'https://t.co/abc', 'OR', '', 'x since:2000-01-01'):
+            self.assertEqual(self.index.search(query), [], query)
+
+    def test_sorted_lists(self):
+        self.assertEqual(offline_index.intersect_sorted([2, 5, 9], [1, 2, 3, 5, 8, 10]), [2, 5])
+        self.assertEqual(offline_index.merge_unique([[1, 4, 6], [2, 4], [6, 7]]),
+                         [1, 2, 4, 6, 7])
+
+    def test_incremental_and_compact(self):
+        self.assertEqual(self.index.add_path(RECORDS_PATH), 0)
+        self.assertEqual(len(self.index.manifest['segments']), 1)
+
+        self.index.manifest['files'] = {}
+        self.index.add_path(RECORDS_PATH)
+        self.assertEqual(len(self.index.manifest['segments']), 2)
+        everything = self.index.search('since:2000-01-01')
+        with patch.object(offline_index, 'WRITE_CHUNK', 2):
+            self.index.compact()
+        self.assertEqual(len(self.index.manifest['segments']), 1)
+        self.assertEqual(self.index.search('since:2000-01-01'), everything)
+
+        reopened = offline_index.OfflineIndex(INDEX_DIR)
+        self.assertEqual(reopened.search('#gaming'), [1304775835556237314, 1301026162362195971])
+
+
+if __name__ == "__main__":
+    unittest.main()
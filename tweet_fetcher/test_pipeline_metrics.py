@@ -0,0 +1,50 @@
+import unittest
+import json
+
+import pipeline_metrics
+
+
+class TestPipelineMetrics(unittest.TestCase):
+    def test_counters_and_summary(self):
+        metrics = pipeline_metrics.PipelineMetrics()
+        metrics.inc('api_calls_total', endpoint='search')
+        metrics.inc('api_calls_total', 2, endpoint='search')
+        metrics.inc('tweets_fetched_total', 200)
+
+        self.assertEqual(metrics.get('api_calls_total', endpoint='search'), 3)
+        self.assertEqual(metrics.get('api_calls_total', endpoint='user_timeline'), 0)
+
+        summary = json.loads(json.dumps(metrics.summary()))
+        self.assertEqual(summary['counters']['api_calls_total']['{endpoint="search"}'], 3)
+        self.assertEqual(summary['counters']['tweets_fetched_total'][''], 200)
+
+    def test_bulk_response_item_errors(self):
+        metrics = pipeline_metrics.PipelineMetrics()
+        res = {
+            'errors': True,
+            'items': [
+                {'index': {'_id': '1', 'status': 201}},
+                {'index': {'_id': '2', 'status': 429,
+                           'error': {'type': 'es_rejected_execution_exception'}}},
+            ]
+        }
+        metrics.record_bulk_response('{ "index": {} }\n{}\n', res)
+        self.assertEqual(metrics.get('bulk_requests_total'), 1)
+        self.assertEqual(metrics.get('bulk_bytes_total'), 19)
+        self.assertEqual(metrics.get('bulk_item_errors_total',
+                                     reason='es_rejected_execution_exception'), 1)
+
+    def test_prometheus_histogram(self):
+        metrics = pipeline_metrics.PipelineMetrics(buckets=(0.1, 1.0))
+        metrics.observe('es_latency_seconds', 0.05, operation='bulk')
+        metrics.observe('es_latency_seconds', 0.5, operation='bulk')
+        text = metrics.to_prometheus()
+
+        self.assertIn('# TYPE tweet_fetcher_es_latency_seconds histogram', text)
+        self.assertIn('tweet_fetcher_es_latency_seconds_bucket{operation="bulk",le="0.1"} 1', text)
+        self.assertIn('tweet_fetcher_es_latency_seconds_bucket{operation="bulk",le="+Inf"} 2', text)
+        self.assertIn('tweet_fetcher_es_latency_seconds_count{operation="bulk"} 2', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
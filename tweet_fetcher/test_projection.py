@@ -0,0 +1,86 @@
+import unittest
+import json
+from configparser import ConfigParser
+
+import projection
+import twitter_es_schema
+from elasticsearch_index_conf import index_body
+from test_elasticsearch_tweepy import MockTweepy
+
+RECORDS_PATH = './test_data/test_bulk_records.txt'
+
+
+class TestProjection(unittest.TestCase):
+    def setUp(self):
+        self.config = ConfigParser()
+        self.config.read_string('[Projection slim]\nextends = default\ndrop = place, in_reply_to_*\n'
+                                '[Projection ids]\nkeep = user.screen_name, entities.hashtags\n')
+
+    def test_populate_with_profile(self):
+        with open('./test_data/tweet_user_mentions.json', 'r') as handle:
+            test_tweet = json.load(handle)
+        schema = twitter_es_schema.TwitterEsSchema(projection.load_profile('default'))
+        schema.populate(test_tweet)
+
+        self.assertNotIn('geo', schema.tweet)
+        self.assertNotIn('indices', schema.tweet['entities']['user_mentions'][0])
+        self.assertEqual(schema.tweet['entities']['user_mentions'][1]['screen_name'], 'TeamYouTube')
+        self.assertIn('in_reply_to_status_id', schema.tweet)
+
+    def test_config_profiles(self):
+        doc = {'id': 1, 'place': None, 'geo': None, 'in_reply_to_user_id': 2, 'lang': 'en',
+               'user': {'screen_name': 'mikko', 'location': 'Oulu'},
+               'entities': {'hashtags': ['c64'], 'urls': []}}
+        slim = projection.load_profile('slim', self.config).apply(json.loads(json.dumps(doc)))
+        self.assertEqual(sorted(slim.keys()), ['entities', 'id', 'lang', 'user'])
+
+        kept = projection.load_profile('ids', self.config).apply(doc)
+        self.assertEqual(kept, {'id': 1, 'user': {'screen_name': 'mikko'},
+                                'entities': {'hashtags': ['c64']}})
+
+        self.assertIsNone(projection.load_profile('full'))
+        with self.assertRaises(ValueError):
+            projection.load_profile('missing', self.config)
+
+    def test_drop_keeps_required_fields(self):
+        profile = projection.ProjectionProfile('careless', 'drop', ['id', 'i*', '@timestamp', 'lang'])
+        doc = profile.apply({'id': 1, 'id_str': '1', '@timestamp': 't', 'lang': 'en', 'in': 2})
+        self.assertEqual(doc, {'id': 1, 'id_str': '1', '@timestamp': 't'})
+        properties = index_body(profile)['mappings']['properties']
+        self.assertIn('id', properties)
+        self.assertIn('@timestamp', properties)
+
+    def test_recordings_are_not_projected(self):
+        api = MockTweepy()
+        api.projection = projection.load_profile('ids', self.config)
+
+        class Tweet(object):
+            def __init__(self):
+                with open('./test_data/tweet_user_mentions.json', 'r') as handle:
+                    self._json = json.load(handle)
+        for_es = json.loads(api.create_es_bulk_string_from_timeline([Tweet()]).split('\n')[1])
+        self.assertNotIn('source', for_es)
+        recorded = json.loads(api.create_es_bulk_string_from_timeline(
+            [Tweet()], to_file = True).split('\n')[1])
+        self.assertIn('source', recorded)
+        self.assertIn('user_mentions', recorded['entities'])
+
+    def test_mapping(self):
+        properties = index_body(projection.load_profile('default'))['mappings']['properties']
+        self.assertNotIn('indices', properties['entities']['properties']['urls']['properties'])
+        self.assertIn('display_url', properties['entities']['properties']['urls']['properties'])
+
+        properties = index_body(projection.load_profile('ids', self.config))['mappings']['properties']
+        self.assertEqual(sorted(properties.keys()),
+                         ['@timestamp', 'entities', 'id', 'id_str', 'user'])
+        self.assertEqual(list(properties['user']['properties'].keys()), ['screen_name'])
+
+    def test_measure_savings(self):
+        profiles = [(name, projection.load_profile(name)) for name in ('full', 'default', 'lean')]
+        sizes = dict(projection.measure_savings(RECORDS_PATH, profiles))
+        self.assertGreater(sizes['full'], sizes['default'])
+        self.assertGreater(sizes['default'], sizes['lean'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+import json
+import os
+import shutil
+from unittest.mock import MagicMock
+
+from raw_archive import RawArchive, transform_segment, transform_archive, swap_alias
+import projection
+
+ARCHIVE_DIR = './test_data/test_raw_archive'
+RAW_FILES = ['./test_data/tweet_user_mentions.json', './test_data/retweet_media.json',
+             './test_data/quote_tweet.json']
+
+
+def raw_tweets():
+    tweets = []
+    for path in RAW_FILES:
+        with open(path, 'r') as handle:
+            tweets.append(json.load(handle))
+    return tweets
+
+
+class TestRawArchive(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists(ARCHIVE_DIR):
+            shutil.rmtree(ARCHIVE_DIR)
+
+    def test_append_and_read(self):
+        archive = RawArchive(ARCHIVE_DIR)
+        tweets = raw_tweets()
+        self.assertEqual(archive.append_batch(tweets[:2]), 2)
+        self.assertEqual(archive.append_batch(tweets[2:]), 1)
+        self.assertEqual(archive.append_batch([]), 0)
+        self.assertEqual(len(archive.segments()), 1)
+        self.assertEqual(list(archive), tweets)
+
+    def test_segments_roll_over(self):
+        archive = RawArchive(ARCHIVE_DIR, segment_max_bytes=1)
+        for tweet in raw_tweets():
+            archive.append_batch([tweet])
+        self.assertEqual(len(archive.segments()), 3)
+        self.assertEqual([t['id'] for t in archive], [t['id'] for t in raw_tweets()])
+
+    def test_truncated_batch(self):
+        archive = RawArchive(ARCHIVE_DIR)
+        archive.append_batch(raw_tweets())
+        segment = archive.segments()[0]
+        with open(segment, 'ab') as handle:
+            handle.write(b'\x1f\x8b\x08\x00partial')
+        self.assertEqual(len(list(archive)), 3)
+
+    def test_batch_after_torn_batch(self):
+        archive = RawArchive(ARCHIVE_DIR)
+        tweets = raw_tweets()
+        archive.append_batch(tweets[:1])
+        archive.append_batch(tweets[1:2])
+        segment = archive.segments()[0]
+        # Half of the second batch was written when the writer crashed.
+        with open(segment, 'rb') as handle:
+            data = handle.read()
+        first_end = data.find(b'\x1f\x8b\x08', 1)
+        with open(segment, 'wb') as handle:
+            handle.write(data[:first_end + (len(data) - first_end) // 2])
+
+        archive = RawArchive(ARCHIVE_DIR)
+        archive.append_batch(tweets[2:])
+        self.assertEqual(len(archive.segments()), 2)
+        # Even a batch appended after the torn one in the same segment is read.
+        with open(segment, 'ab') as handle:
+            handle.write(data[first_end:])
+        self.assertEqual([t['id'] for t in archive],
+                         [tweets[0]['id'], tweets[1]['id'], tweets[2]['id']])
+
+    def test_transform(self):
+        archive = RawArchive(ARCHIVE_DIR)
+        archive.append_batch(raw_tweets())
+        bulk_strings = transform_segment(archive.segments()[0], projection.load_profile('lean'),
+                                         batch_size=2)
+        self.assertEqual(len(bulk_strings), 2)
+        doc = json.loads(bulk_strings[0].split('\n')[1])
+        self.assertEqual(doc['id'], 1301026162362195971)
+        self.assertNotIn('user_mentions', doc['entities'])
+
+        pushed = []
+        self.assertEqual(transform_archive(archive, pushed.append, workers=2), 1)
+        self.assertEqual(pushed[0].count('"index"'), 3)
+
+    def test_transform_in_order(self):
+        archive = RawArchive(ARCHIVE_DIR, segment_max_bytes=1)
+        tweets = raw_tweets() * 3
+        for tweet in tweets:
+            archive.append_batch([tweet])
+        pushed = []
+        self.assertEqual(transform_archive(archive, pushed.append, workers=1), len(tweets))
+        self.assertEqual([json.loads(bulk_string.split('\n')[1])['id'] for bulk_string in pushed],
+                         [tweet['id'] for tweet in tweets])
+
+    def test_swap_alias(self):
+        es = MagicMock()
+        es.indices.exists_alias.return_value = True
+        es.indices.get_alias.return_value = {'tweets-1': {}}
+        self.assertEqual(swap_alias(es, 'tweets', 'tweets-2'), ['tweets-1'])
+        es.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'remove': {'index': 'tweets-1', 'alias': 'tweets'}},
+            {'add': {'index': 'tweets-2', 'alias': 'tweets'}}]})
+
+    def test_first_switch_from_index(self):
+        es = MagicMock()
+        es.indices.exists.return_value = True
+        es.indices.exists_alias.return_value = False
+        es.reindex.return_value = {'created': 5, 'failures': []}
+        self.assertEqual(swap_alias(es, 'tweets', 'tweets-2'), ['tweets'])
+        body = es.reindex.call_args.kwargs['body']
+        self.assertEqual(body['dest'], {'index': 'tweets-2', 'op_type': 'create'})
+        es.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'remove_index': {'index': 'tweets'}},
+            {'add': {'index': 'tweets-2', 'alias': 'tweets'}}]})
+
+        es = MagicMock()
+        es.indices.exists_alias.return_value = False
+        es.reindex.return_value = {'failures': [{'cause': 'disk full'}]}
+        with self.assertRaises(RuntimeError):
+            swap_alias(es, 'tweets', 'tweets-2')
+        es.indices.update_aliases.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
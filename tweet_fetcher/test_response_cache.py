@@ -0,0 +1,107 @@
+import unittest
+import os
+import shutil
+from unittest.mock import patch
+
+import requests
+import tweepy
+
+import response_cache
+from elasticsearch_tweepy import ElasticSearchTweepy
+from response_cache import CachingSession, ResponseCache, ReplayMiss, request_key
+
+CACHE_DIR = './test_data/test_response_cache'
+
+
+def fake_response(body, status=200):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.headers['content-type'] = 'application/json'
+    response.headers['x-rate-limit-remaining'] = '10'
+    return response
+
+
+def make_api(mode, max_bytes=10 ** 6):
+    api = ElasticSearchTweepy(tweepy.OAuth1UserHandler('k', 's', 't', 'u'))
+    api.session = CachingSession(ResponseCache(CACHE_DIR, max_bytes=max_bytes), mode)
+    return api
+
+
+class TestResponseCache(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists(CACHE_DIR):
+            shutil.rmtree(CACHE_DIR)
+
+    def test_record_and_replay_timeline(self):
+        with open('./test_data/tweet_user_mentions.json', 'rb') as handle:
+            body = b'[' + handle.read() + b']'
+        with patch('requests.Session.request', return_value=fake_response(body)) as network:
+            recorded = make_api('record').user_timeline(user_id=1571691295, count=200,
+                                                       tweet_mode='extended')
+        self.assertEqual(network.call_count, 1)
+
+        api = make_api('replay')
+        with patch('requests.Session.request') as network:
+            replayed = api.user_timeline(user_id=1571691295, count=200, tweet_mode='extended')
+            self.assertEqual(network.call_count, 0)
+        self.assertEqual([t.id for t in replayed], [t.id for t in recorded])
+        self.assertIn('"_id": 1301026162362195971',
+                      api.create_es_bulk_string_from_timeline(replayed))
+
+        with self.assertRaises(tweepy.errors.TweepyException):
+            api.user_timeline(user_id=1, count=200, tweet_mode='extended')
+
+    def test_content_addressed(self):
+        cache = ResponseCache(CACHE_DIR)
+        cache.put(request_key('GET', 'u', {'a': 1, 'b': 2}), 200, {}, b'same body')
+        cache.put(request_key('GET', 'u', {'a': 2}), 200, {}, b'same body')
+        self.assertEqual(len(list(cache._objects())), 1)
+        self.assertEqual(cache.get(request_key('GET', 'u', {'b': 2, 'a': 1}))[2], b'same body')
+        self.assertEqual(len(ResponseCache(CACHE_DIR).index), 2)
+
+    def test_eviction(self):
+        cache = ResponseCache(CACHE_DIR, max_bytes=100)
+        for i in range(5):
+            cache.put(request_key('GET', 'u', {'page': i}), 200, {}, os.urandom(40))
+            os.utime(cache._object_path(cache.index[request_key('GET', 'u', {'page': i})]['hash']),
+                     (i, i))
+        self.assertLessEqual(cache.size(), 100)
+        self.assertIsNone(cache.get(request_key('GET', 'u', {'page': 0})))
+        self.assertIsNotNone(cache.get(request_key('GET', 'u', {'page': 4})))
+        self.assertNotIn(request_key('GET', 'u', {'page': 0}), ResponseCache(CACHE_DIR).index)
+
+    def test_eviction_low_water_mark(self):
+        cache = ResponseCache(CACHE_DIR, max_bytes=1000)
+        for i in range(30):
+            cache.put(request_key('GET', 'u', {'page': i}), 200, {}, os.urandom(100))
+            self.assertLessEqual(cache.total_bytes, 1000)
+        self.assertEqual(cache.total_bytes, cache.size())
+        cache.max_bytes = cache.total_bytes - 1
+        self.assertGreater(cache.evict(), 0)
+        self.assertLessEqual(cache.total_bytes, cache.max_bytes * response_cache.LOW_WATER_MARK)
+        # Recently read bodies are evicted last.
+        first = next(iter(cache.objects))
+        key = [k for k, entry in cache.index.items() if entry['hash'] == first][0]
+        cache.max_bytes = 1000
+        cache.get(key)
+        for i in range(31, 34):
+            cache.put(request_key('GET', 'u', {'page': i}), 200, {}, os.urandom(100))
+        self.assertIsNotNone(cache.get(key))
+
+    def test_index_compaction(self):
+        cache = ResponseCache(CACHE_DIR)
+        key = request_key('GET', 'u', {})
+        for i in range(response_cache.COMPACT_MIN_LINES + 1):
+            cache.put(key, 200, {}, b'body')
+        with open(os.path.join(CACHE_DIR, response_cache.INDEX_FILE), 'r') as handle:
+            self.assertEqual(len(handle.readlines()), 1)
+
+    def test_replay_miss(self):
+        session = CachingSession(ResponseCache(CACHE_DIR), 'replay')
+        with self.assertRaises(ReplayMiss):
+            session.request('GET', 'https://api.twitter.com/1.1/search/tweets.json', params={})
+
+
+if __name__ == '__main__':
+    unittest.main()
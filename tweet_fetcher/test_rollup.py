@@ -0,0 +1,202 @@
+import unittest
+import json
+from unittest.mock import MagicMock, patch
+
+import rollup
+import twitter_es_schema
+from es_bulk import push_bulk, split_bulk_string
+from test_multi_term import MockSearch
+
+
+class RawTweet(object):
+    def __init__(self, raw):
+        self.id = raw['id']
+        self._json = raw
+
+
+def load_tweet(path):
+    with open(path, 'r') as handle:
+        return json.load(handle)
+
+
+def bulk_response(bulk_string, results):
+    """ Bulk API response giving each item the result of its _id in results. """
+    items = []
+    for action, _ in split_bulk_string(bulk_string):
+        op, meta = next(iter(json.loads(action).items()))
+        items.append({op: {'_id': str(meta['_id']), 'status': 201,
+                           'result': results.get(str(meta['_id']), 'created')}})
+    return {'errors': False, 'items': items}
+
+
+class TestRollup(unittest.TestCase):
+    def setUp(self):
+        schema = twitter_es_schema.TwitterEsSchema()
+        schema.populate(load_tweet('./test_data/tweet_user_mentions.json'))
+        self.doc = schema.tweet
+
+    def test_dimension_values(self):
+        raw = load_tweet('./test_data/tweet_user_mentions.json')
+        raw['entities']['hashtags'] = [{'text': 'C64', 'indices': [0, 4]},
+                                       {'text': 'c64', 'indices': [5, 9]},
+                                       {'text': 'Context', 'indices': [10, 18]}]
+        raw['entities']['urls'] = [
+            {'url': 'https://t.co/a', 'expanded_url': 'https://www.Example.com/a',
+             'display_url': 'example.com/a', 'indices': [19, 30]},
+            {'url': 'https://t.co/b', 'expanded_url': 'http://example.com/b',
+             'display_url': 'example.com/b', 'indices': [31, 42]}]
+        schema = twitter_es_schema.TwitterEsSchema()
+        schema.populate(raw)
+        self.assertEqual(rollup.dimension_values(schema.tweet),
+                         [('all', ''), ('hashtag', 'c64'), ('hashtag', 'context'),
+                          ('domain', 'example.com'), ('source', 'Twitter for Android'),
+                          ('user', 'jvitorpalo')])
+        self.assertEqual(rollup.hour_of('2020-09-02T05:16:23'), '2020-09-02T05:00:00')
+
+    def test_upserts(self):
+        buckets = {('2020-09-02T05:00:00', 'hashtag', 'c64'): 3}
+        items = split_bulk_string(rollup.upsert_bulk_string(buckets))
+        self.assertEqual(len(items), 1)
+        action = json.loads(items[0][0])['update']
+        self.assertEqual(action['_id'], rollup.bucket_id('2020-09-02T05:00:00', 'hashtag', 'c64'))
+        body = json.loads(items[0][1])
+        self.assertEqual(body['script']['params'], {'count': 3})
+        self.assertEqual(body['upsert'], {'@timestamp': '2020-09-02T05:00:00', 'hour_of_day': 5,
+                                          'dimension': 'hashtag', 'value': 'c64', 'count': 3})
+
+    def test_only_created_are_counted(self):
+        counter = rollup.Rollup('tweets-rollup')
+        counter.stage({'id': 1, '@timestamp': '2020-09-02T05:16:23'})
+        counter.stage({'id': 2, '@timestamp': '2020-09-02T05:50:00'})
+        # A batch of another pipeline worker, not pushed yet.
+        counter.stage({'id': 3, '@timestamp': '2020-09-02T06:01:00'})
+        counter.commit(created_ids={'1'}, item_ids={'1', '2'})
+        self.assertEqual(counter.buckets, {('2020-09-02T05:00:00', 'all', ''): 1})
+        self.assertEqual(list(counter.staged), ['3'])
+
+        bulk_string, buckets = counter.bulk_string()
+        self.assertEqual(counter.buckets, {})
+        counter.restore(buckets)
+        counter.restore(buckets)
+        self.assertEqual(counter.buckets, {('2020-09-02T05:00:00', 'all', ''): 2})
+
+    def test_bulk_result_created(self):
+        es = MagicMock()
+        bulk_string = '{ "index": { "_id": 1} }\n{}\n{ "index": { "_id": 2} }\n{}\n'
+        es.bulk.return_value = bulk_response(bulk_string, {'2': 'updated'})
+        result = push_bulk(es, bulk_string, 'tweets')
+        self.assertEqual(result.created, {'1'})
+        self.assertEqual(result.item_ids, {'1', '2'})
+
+    def test_flush_after_push(self):
+        api = MockSearch({})
+        api.index = 'tweets'
+        api.rollup = rollup.Rollup('tweets-rollup')
+        es = MagicMock()
+        es.bulk.side_effect = lambda body, index: bulk_response(body, {})
+        raw = load_tweet('./test_data/tweet_user_mentions.json')
+        bulk_string = api.create_es_bulk_string_from_timeline([RawTweet(raw)])
+        self.assertTrue(api.es_bulk(es, bulk_string).ok)
+
+        self.assertEqual([call.kwargs['index'] for call in es.bulk.call_args_list],
+                         ['tweets', 'tweets-rollup'])
+        upserts = [json.loads(source)['upsert']
+                   for _, source in split_bulk_string(es.bulk.call_args_list[1].args[0])]
+        self.assertIn({'@timestamp': rollup.hour_of(self.doc['@timestamp']),
+                       'hour_of_day': int(self.doc['@timestamp'][11:13]), 'dimension': 'all',
+                       'value': '', 'count': 1}, upserts)
+
+        # Fetched again: the document is only updated and nothing is rolled up.
+        es.bulk.reset_mock()
+        es.bulk.side_effect = lambda body, index: bulk_response(body, {str(raw['id']): 'updated'})
+        bulk_string = api.create_es_bulk_string_from_timeline([RawTweet(load_tweet(
+            './test_data/tweet_user_mentions.json'))])
+        api.es_bulk(es, bulk_string)
+        self.assertEqual(es.bulk.call_count, 1)
+        self.assertEqual(api.rollup.staged, {})
+
+    def test_failed_push_discards_staged(self):
+        api = MockSearch({})
+        api.index = 'tweets'
+        api.rollup = rollup.Rollup('tweets-rollup')
+        es = MagicMock()
+        es.bulk.side_effect = ConnectionError('down')
+        bulk_string = api.create_es_bulk_string_from_timeline([RawTweet(load_tweet(
+            './test_data/tweet_user_mentions.json'))])
+        self.assertEqual(len(api.rollup.staged), 1)
+        with self.assertRaises(ConnectionError):
+            api.es_bulk(es, bulk_string)
+        self.assertEqual(api.rollup.staged, {})
+
+    def test_failed_flush_is_retried(self):
+        api = MockSearch({})
+        api.index = 'tweets'
+        api.rollup = rollup.Rollup('tweets-rollup')
+        api.rollup.add_document({'id': 1, '@timestamp': '2020-09-02T05:16:23'})
+        es = MagicMock()
+        es.bulk.side_effect = ConnectionError('down')
+        api.flush_rollup(es)
+        self.assertEqual(api.rollup.buckets, {('2020-09-02T05:00:00', 'all', ''): 1})
+
+    def test_spooled_batch_counted_when_shipped(self):
+        api = MockSearch({})
+        api.index = 'tweets'
+        api.rollup = rollup.Rollup('tweets-rollup')
+        api.spool = MagicMock()
+        raw = load_tweet('./test_data/tweet_user_mentions.json')
+        bulk_string = api.create_es_bulk_string_from_timeline([RawTweet(raw)])
+        api.es_bulk('es', bulk_string)
+        self.assertEqual(api.spool.append.call_count, 1)
+        self.assertEqual(api.rollup.buckets, {})
+
+        es = MagicMock()
+        es.bulk.side_effect = lambda body, index: bulk_response(body, {str(raw['id']): 'updated'})
+        push = api.spool_pusher(es)
+        push('tweets', bulk_string)
+        # Already in the index: nothing is rolled up.
+        self.assertEqual(es.bulk.call_count, 1)
+        self.assertEqual(api.rollup.staged, {})
+
+        # A batch spooled by an earlier run is staged from the bulk string.
+        es.bulk.side_effect = lambda body, index: bulk_response(body, {})
+        push('tweets', bulk_string)
+        self.assertEqual([call.kwargs['index'] for call in es.bulk.call_args_list],
+                         ['tweets', 'tweets', 'tweets-rollup'])
+
+    def test_replace_index(self):
+        es = MagicMock()
+        es.indices.exists.return_value = True
+        es.indices.exists_alias.return_value = False
+        self.assertEqual(rollup.replace_index(es, 'tweets-rollup', 'tweets-rollup-2'),
+                         ['tweets-rollup'])
+        es.indices.delete.assert_not_called()
+
+        es.indices.exists_alias.return_value = True
+        es.indices.get_alias.return_value = {'tweets-rollup-1': {}}
+        self.assertEqual(rollup.replace_index(es, 'tweets-rollup', 'tweets-rollup-2'),
+                         ['tweets-rollup-1'])
+        self.assertEqual(es.indices.update_aliases.call_args.kwargs['body']['actions'], [
+            {'remove': {'index': 'tweets-rollup-1', 'alias': 'tweets-rollup'}},
+            {'add': {'index': 'tweets-rollup-2', 'alias': 'tweets-rollup'}}])
+        es.indices.delete.assert_called_once_with(index='tweets-rollup-1')
+
+    def test_backfill(self):
+        hits = [{'_id': str(i), '_source': {'@timestamp': '2020-09-02T05:%02d:00' % i,
+                                            'user': {'screen_name': 'mikko'}}}
+                for i in range(5)]
+        pushed = []
+        with patch('rollup.scan', return_value=iter(hits)):
+            documents = rollup.backfill('es', 'tweets', rollup.Rollup('tweets-rollup'),
+                                        pushed.append, batch_size=2)
+        self.assertEqual(documents, 5)
+        counts = {}
+        for bulk_string in pushed:
+            for _, source in split_bulk_string(bulk_string):
+                upsert = json.loads(source)['upsert']
+                key = (upsert['dimension'], upsert['value'])
+                counts[key] = counts.get(key, 0) + upsert['count']
+        self.assertEqual(counts, {('all', ''): 5, ('user', 'mikko'): 5})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import os
+
+from search_budget import SearchBudget
+from test_multi_term import FakeTweet, MockSearch
+
+HISTORY_PATH = './test_data/test_search_history.json'
+
+
+def page(first_id, size):
+    return [FakeTweet(first_id - i, 'tweet') for i in range(size)]
+
+
+class MockPagedSearch(MockSearch):
+    """ Serves pages of the given sizes, then empty pages. """
+    def __init__(self, page_sizes):
+        MockSearch.__init__(self, {})
+        self.page_sizes = page_sizes
+
+    def search(self, search_term, count=20, result_type='recent', max_id='-1', since_id='-1'):
+        self.queries.append((search_term, since_id))
+        served = sum(1 for query, _ in self.queries if query == search_term)
+        sizes = self.page_sizes.get(search_term, [])
+        if served > len(sizes):
+            return []
+        return page(10 ** 6 - served * count, sizes[served - 1])
+
+
+class TestSearchBudget(unittest.TestCase):
+    def tearDown(self):
+        for path in (HISTORY_PATH, HISTORY_PATH + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_plan(self):
+        budget = SearchBudget()
+        self.assertEqual(budget.pages_for('new'), 80)
+        budget.remaining = 90
+        budget.start(3)
+        self.assertEqual(budget.pages_for('new'), 30)
+        budget.record('quiet', 1, 12)
+        self.assertEqual(budget.pages_for('quiet'), 1)
+        budget.remaining = 0
+        self.assertEqual(budget.pages_for('new'), 0)
+
+    def test_consume_headers(self):
+        budget = SearchBudget()
+        budget.remaining = 10
+        budget.consume()
+        self.assertEqual(budget.remaining, 9)
+        budget.consume({'x-rate-limit-remaining': '4', 'x-rate-limit-reset': '1600000000'})
+        self.assertEqual((budget.remaining, budget.reset), (4, 1600000000))
+
+    def test_unused_budget_rolls_over(self):
+        api = MockPagedSearch({'busy': [100] * 50, 'quiet': [7]})
+        api.search_budget = SearchBudget(HISTORY_PATH)
+        api.search_budget.remaining = 60
+        api.search_budget.record('quiet', 1, 5)
+        api.search_budget.start(2)
+
+        api.fetch_search_results_from_twitter('quiet', -1)
+        self.assertEqual(api.search_budget.remaining, 59)
+        results = api.fetch_search_results_from_twitter('busy', -1)
+        # The whole rest of the quota goes to the last search.
+        self.assertEqual(len(results), 50 * 100)
+        self.assertEqual(api.search_budget.remaining, 8)
+
+    def test_quiet_term_gets_busy(self):
+        api = MockPagedSearch({'quiet': [100, 100, 100]})
+        api.search_budget = SearchBudget(HISTORY_PATH)
+        api.search_budget.remaining = 20
+        api.search_budget.record('quiet', 1, 5)
+        results = api.fetch_search_results_from_twitter('quiet', -1)
+        self.assertEqual(len(results), 300)
+        self.assertGreater(api.search_budget.history['quiet']['tweets'], 90)
+
+        api.search_budget.save()
+        self.assertIn('quiet', SearchBudget(HISTORY_PATH).history)
+
+    def test_exhausted_quota_keeps_history(self):
+        api = MockPagedSearch({'busy': [100] * 5})
+        api.search_budget = SearchBudget(HISTORY_PATH)
+        api.search_budget.record('busy', 20, 2000)
+        api.search_budget.remaining = 0
+        self.assertEqual(api.fetch_search_results_from_twitter('busy', -1), [])
+        self.assertEqual(api.fetch_search_results_from_twitter('new', -1), [])
+        self.assertEqual(api.queries, [])
+        self.assertEqual(api.search_budget.history, {'busy': {'pages': 20.0, 'tweets': 2000.0}})
+        self.assertFalse(api.search_budget.is_quiet('busy'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import os
+
+from unittest.mock import MagicMock
+
+from tweepy.errors import TooManyRequests
+
+import async_pipeline
+import sharding
+from es_bulk import BulkResult
+from sharding import Shard
+from test_elasticsearch_tweepy import MockResp
+from test_elasticsearch_tweepy import MockTweepy
+
+USERS_PATH = './test_data/test_shard_users.txt'
+
+
+class TestSharding(unittest.TestCase):
+    def setUp(self):
+        with open(USERS_PATH, 'w') as handle:
+            for user_id in range(1000, 1012):
+                handle.write('%d\n' % user_id)
+
+    def tearDown(self):
+        for path in os.listdir('./test_data'):
+            if path.startswith('test_shard_users'):
+                os.remove(os.path.join('./test_data', path))
+
+    def test_parse(self):
+        self.assertEqual(sharding.parse_shard('2/4'), (2, 4))
+        for spec in ('0/4', '5/4', 'x', '1/0'):
+            with self.assertRaises(ValueError):
+                sharding.parse_shard(spec)
+
+    def test_shards_partition_users(self):
+        user_ids = list(range(100000, 110000))
+        for method in sharding.SHARD_METHODS:
+            shards = [Shard(k, 4, method).select(user_ids) for k in range(1, 5)]
+            self.assertEqual(sorted(sum(shards, [])), user_ids)
+            for shard in shards:
+                self.assertGreater(len(shard), 2000)
+
+    def test_jump_hash_is_consistent(self):
+        user_ids = range(100000, 110000)
+        moved = sum(1 for user_id in user_ids
+                    if Shard(1, 4, 'jump').bucket(user_id) != Shard(1, 5, 'jump').bucket(user_id))
+        # About 1/5 of the users move to the new shard. Modulo would move 4/5.
+        self.assertLess(moved, 2500)
+        self.assertEqual(sharding.jump_hash(0, 1), 0)
+
+    def test_list_checkpoint(self):
+        api = MockTweepy()
+        fetched = []
+
+        def user_timeline_to_es(target, es_handle, debug=False):
+            fetched.append(target)
+            if target == 1006:
+                raise KeyboardInterrupt()
+            return True
+        api.user_timeline_to_es = user_timeline_to_es
+        shard = Shard(1, 2)
+        api.list_timeline_to_es(USERS_PATH, 1, es_handle=None, test=True, shard=shard)
+        self.assertEqual(fetched, [1000, 1002, 1004, 1006, 1008, 1010])
+        checkpoint = sharding.ListCheckpoint(shard.checkpoint_path(USERS_PATH))
+        self.assertEqual(len(checkpoint.done), 5)
+
+        fetched.clear()
+        api.user_timeline_to_es = lambda target, es_handle, debug=False: fetched.append(target)
+        api.list_timeline_to_es(USERS_PATH, 1, es_handle=None, test=True, shard=shard)
+        self.assertEqual(fetched, [1006])
+        self.assertFalse(os.path.exists(shard.checkpoint_path(USERS_PATH)))
+
+    def test_pipeline_checkpoint(self):
+        api = MockTweepy()
+
+        def fetch_user_timeline(target, with_id=True, debug=False):
+            if target == 1004:
+                raise TooManyRequests(MockResp())
+            return ['tweet of %d' % target]
+        api.fetch_user_timeline = fetch_user_timeline
+        api.create_es_bulk_string_from_timeline = lambda tweets: tweets[0]
+
+        def es_bulk(es_handle, bulk_string, debug=False):
+            result = BulkResult()
+            result.failed = 1 if bulk_string == 'tweet of 1008' else 0
+            return result
+        api.es_bulk = es_bulk
+        shard = Shard(1, 2)
+        checkpoint = sharding.ListCheckpoint(shard.checkpoint_path(USERS_PATH))
+        jobs = async_pipeline.user_list_jobs(api, USERS_PATH, shard=shard, checkpoint=checkpoint)
+        api.pipeline_to_es(jobs, es_handle=None, test=True)
+        # 1004 stayed rate limited and the batch of 1008 failed to index.
+        self.assertEqual(sorted(checkpoint.done), [1000, 1002, 1006, 1010])
+        reopened = sharding.ListCheckpoint(shard.checkpoint_path(USERS_PATH))
+        jobs = async_pipeline.user_list_jobs(api, USERS_PATH, shard=shard, checkpoint=reopened)
+        self.assertEqual([job.target for job in jobs], [1004, 1008])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import json
+import os
+import threading
+import time
+
+import tracing
+
+
+class TestTracer(unittest.TestCase):
+    def test_null_tracer(self):
+        tracer = tracing.NULL_TRACER
+        self.assertFalse(tracer.enabled)
+        with tracer.span('transform') as span:
+            pass
+        self.assertIs(span, tracer.span('bulk'))
+
+    def test_spans_to_trace_file(self):
+        trace_path = './test_data/test_trace.json'
+        tracer = tracing.Tracer()
+        with tracer.span('user', user_id=42):
+            with tracer.span('transform'):
+                sum(range(1000))
+
+        totals = tracer.totals()
+        self.assertEqual(sorted(totals.keys()), ['transform', 'user'])
+        self.assertGreaterEqual(totals['user'][0], totals['transform'][0])
+
+        tracer.write(trace_path)
+        with open(trace_path, 'r') as handle:
+            trace = json.load(handle)
+        os.remove(trace_path)
+
+        names = [event['name'] for event in trace['traceEvents']]
+        self.assertEqual(names, ['transform', 'user'])
+        self.assertEqual(trace['traceEvents'][1]['args']['user_id'], 42)
+        self.assertIn('cpu_ms', trace['traceEvents'][0]['args'])
+
+    def test_span_cpu_is_per_thread(self):
+        tracer = tracing.Tracer()
+        stop = threading.Event()
+
+        def spin():
+            while not stop.is_set():
+                pass
+        spinner = threading.Thread(target = spin)
+        spinner.start()
+        try:
+            with tracer.span('wait'):
+                time.sleep(0.3)
+        finally:
+            stop.set()
+            spinner.join()
+        # The CPU burnt by the other thread is not charged to the span.
+        self.assertLess(tracer.totals()['wait'][1], 0.1)
+
+    def test_run_profiled(self):
+        profile_path = './test_data/test_profile.pstats'
+        ret = tracing.run_profiled(profile_path, sorted, [3, 1, 2])
+        self.assertEqual(ret, [1, 2, 3])
+        self.assertTrue(os.path.exists(profile_path))
+        self.assertTrue(os.path.exists(profile_path + '.txt'))
+        os.remove(profile_path)
+        os.remove(profile_path + '.txt')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import json
+import os
+import shutil
+
+import local_analytics
+import projection
+from test_elasticsearch_tweepy import MockTweepy
+from tweet_graph import TweetGraph
+
+RECORDS_PATH = './test_data/test_bulk_records.txt'
+GRAPH_DIR = './test_data/test_graph'
+
+
+class TestTweetGraph(unittest.TestCase):
+    def setUp(self):
+        self.graph = TweetGraph()
+        for batch in local_analytics.iter_batches(RECORDS_PATH):
+            self.graph.add_batch(batch)
+
+    def tearDown(self):
+        if os.path.exists(GRAPH_DIR):
+            shutil.rmtree(GRAPH_DIR)
+
+    def test_edges(self):
+        self.assertEqual(self.graph.neighbours('#gaming', 'hashtag'),
+                         [('#c64', 1), ('#retro', 1), ('#youtube', 1)])
+        self.assertEqual(self.graph.neighbours('@jvitorpalo', 'retweet'),
+                         [('@nescartridges', 1), ('@raysipe', 1)])
+        self.assertEqual(dict(self.graph.neighbours('@jvitorpalo', 'mention')),
+                         {'@moistcr1tikal': 1, '@teamyoutube': 1})
+        self.assertEqual(self.graph.neighbours('@mikko', 'mention'), [])
+
+    def test_tweets_counted_once(self):
+        for batch in local_analytics.iter_batches(RECORDS_PATH):
+            self.assertEqual(self.graph.add_batch(batch), 0)
+        self.graph.save(GRAPH_DIR)
+        loaded = TweetGraph.load(GRAPH_DIR)
+        self.assertEqual(len(loaded.seen), 6)
+        self.assertEqual(loaded.add_path(RECORDS_PATH), 0)
+        self.assertEqual(loaded.neighbours('@jvitorpalo', 'retweet'),
+                         [('@nescartridges', 1), ('@raysipe', 1)])
+        self.assertEqual(loaded.neighbours('#youtube', 'hashtag'), [('#gaming', 1)])
+
+    def test_graph_fed_before_projection(self):
+        api = MockTweepy()
+        api.projection = projection.load_profile('lean')
+        api.graph = TweetGraph()
+
+        class Tweet(object):
+            def __init__(self, raw):
+                self._json = raw
+        with open('./test_data/tweet_user_mentions.json', 'r') as handle:
+            tweet = Tweet(json.load(handle))
+        bulk_string = api.create_es_bulk_string_from_timeline([tweet])
+        self.assertNotIn('user_mentions', bulk_string)
+        self.assertIn('@moistcr1tikal', dict(api.graph.neighbours('@jvitorpalo', 'mention')))
+
+    def test_save_load_merge(self):
+        self.graph.save(GRAPH_DIR)
+        loaded = TweetGraph.load(GRAPH_DIR)
+        self.assertEqual(sorted(loaded.edge_list('hashtag')),
+                         sorted(self.graph.edge_list('hashtag')))
+        self.assertEqual(loaded.neighbours('#gaming', 'hashtag'),
+                         self.graph.neighbours('#gaming', 'hashtag'))
+
+        loaded.merge(self.graph)
+        self.assertEqual(loaded.top_edges('hashtag', 1)[0][2], 2)
+
+    def test_add_path_once(self):
+        graph = TweetGraph()
+        self.assertEqual(graph.add_path(RECORDS_PATH), 6)
+        self.assertEqual(graph.add_path(RECORDS_PATH), 0)
+        graph.write_edge_lists(GRAPH_DIR)
+        with open(os.path.join(GRAPH_DIR, 'retweet_edges.tsv'), 'r') as handle:
+            self.assertEqual(len(handle.readlines()), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Lightweight spans for timing the stages of a run and helpers for opt-in cProfile runs. The trace
+is written in Chrome trace event format, so it can be opened as a timeline in chrome://tracing or
+https://ui.perfetto.dev.
+"""
+import cProfile
+import json
+import os
+import pstats
+import threading
+from time import perf_counter, thread_time
+
+
+class _NullSpan(object):
+    """ Span that does nothing. Shared by all calls when tracing is off. """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class NullTracer(object):
+    """ Tracer used when tracing is not requested. The cost of a span is one method call. """
+    enabled = False
+
+    def span(self, name, **args):
+        return _NULL_SPAN
+
+
+class _Span(object):
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.wall_start = perf_counter()
+        self.cpu_start = thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = perf_counter() - self.wall_start
+        cpu = thread_time() - self.cpu_start
+        self.tracer.record(self.name, self.wall_start, wall, cpu, self.args)
+        return False
+
+
+class Tracer(object):
+    """ Records the wall time and the CPU time of the calling thread of each span. """
+    enabled = True
+
+    def __init__(self):
+        self.origin = perf_counter()
+        self.events = []
+        self._lock = threading.Lock()
+
+    def span(self, name, **args):
+        """ Returns a context manager that records the enclosed block as a span. """
+        return _Span(self, name, args)
+
+    def record(self, name, start, wall, cpu, args=None):
+        event = {
+            'name': name,
+            'ph': 'X',
+            'ts': round((start - self.origin) * 1e6, 1),
+            'dur': round(wall * 1e6, 1),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': dict(args or {}, cpu_ms=round(cpu * 1e3, 3)),
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def totals(self):
+        """ Returns the summed wall and CPU seconds per span name. """
+        totals = {}
+        with self._lock:
+            for event in self.events:
+                wall, cpu = totals.get(event['name'], (0.0, 0.0))
+                totals[event['name']] = (wall + event['dur'] / 1e6,
+                                         cpu + event['args']['cpu_ms'] / 1e3)
+        return totals
+
+    def write(self, file_path):
+        """ Stores the spans to a trace file. """
+        with self._lock:
+            events = list(self.events)
+        with open(file_path, 'w') as handle:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, handle)
+
+
+NULL_TRACER = NullTracer()
+
+
+def run_profiled(profile_path, func, *args, **kwargs):
+    """ Runs func under cProfile and stores the pstats output to profile_path. A human readable
+    listing sorted by cumulative time is written next to it. """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profile_path)
+        with open(profile_path + '.txt', 'w') as handle:
+            stats = pstats.Stats(profiler, stream=handle)
+            stats.sort_stats('cumulative').print_stats(40)
@@ -0,0 +1,212 @@
+"""
+Incremental co-occurrence graphs built from transformed tweets: hashtag-hashtag co-occurrence,
+user -> mentioned user and user -> retweeted user. Node names are interned to integers and each
+edge is a single integer key (source << 32 | target) with a count, which keeps even large graphs
+compact. The graph is stored to a folder and new batches are merged in without rescanning old
+tweets.
+
+Every tweet is counted once. The ids of the tweets already in the graph are kept as a sorted
+array, so tweets fetched again by later runs or stored in several files do not inflate the counts.
+"""
+import json
+import os
+from array import array
+from bisect import bisect_left
+from heapq import merge, nlargest
+from itertools import combinations
+
+import local_analytics
+
+EDGE_KINDS = ('hashtag', 'mention', 'retweet')
+# Hashtag co-occurrence is symmetric. The edge is stored once, smaller node id first.
+UNDIRECTED = ('hashtag',)
+NODES_FILE = 'nodes.json'
+SEEN_FILE = 'seen.ids'
+KEY_TYPE = 'q'
+_SHIFT = 32
+_MASK = (1 << _SHIFT) - 1
+
+
+def hashtag_node(tag):
+    return '#' + tag.lower()
+
+
+def user_node(screen_name):
+    return '@' + screen_name.lower()
+
+
+class TweetGraph(object):
+    """ Sparse edge counts over interned node names. """
+    def __init__(self):
+        self.node_ids = {}
+        self.names = []
+        self.edges = dict((kind, {}) for kind in EDGE_KINDS)
+        # node -> neighbour nodes, both ways for undirected kinds
+        self.adjacency = dict((kind, {}) for kind in EDGE_KINDS)
+        self.files = {}
+        self.seen = array(KEY_TYPE)  # sorted ids of the tweets of the stored graph
+        self.new_ids = set()
+
+    def is_seen(self, tweet_id):
+        position = bisect_left(self.seen, tweet_id)
+        if position < len(self.seen) and self.seen[position] == tweet_id:
+            return True
+        return tweet_id in self.new_ids
+
+    def node(self, name):
+        """ Integer id of the node. New names get the next free id. """
+        try:
+            return self.node_ids[name]
+        except KeyError:
+            self.node_ids[name] = len(self.names)
+            self.names.append(name)
+            return self.node_ids[name]
+
+    def add_edge(self, kind, source, target, count=1):
+        a = self.node(source)
+        b = self.node(target)
+        if kind in UNDIRECTED and b < a:
+            a, b = b, a
+        key = (a << _SHIFT) | b
+        edges = self.edges[kind]
+        if key not in edges:
+            self._link(kind, a, b)
+        edges[key] = edges.get(key, 0) + count
+
+    def _link(self, kind, a, b):
+        adjacency = self.adjacency[kind]
+        adjacency.setdefault(a, set()).add(b)
+        if kind in UNDIRECTED:
+            adjacency.setdefault(b, set()).add(a)
+
+    def add_document(self, doc):
+        """ Adds the edges of one transformed tweet. Returns False without adding anything when
+        the tweet is already in the graph. """
+        if self.is_seen(doc['id']):
+            return False
+        self.new_ids.add(doc['id'])
+        user = user_node(doc['user']['screen_name'])
+
+        tags = sorted(set(doc['entities']['hashtags']))
+        for a, b in combinations(tags, 2):
+            self.add_edge('hashtag', hashtag_node(a), hashtag_node(b))
+
+        retweeted = None
+        if doc.get('is_retweet_status') and 'retweeted_status' in doc:
+            retweeted = user_node(doc['retweeted_status']['user']['screen_name'])
+            self.add_edge('retweet', user, retweeted)
+
+        for mention in doc['entities'].get('user_mentions', []):
+            mentioned = user_node(mention['screen_name'])
+            # A retweet mentions the original author. That is already the retweet edge.
+            if mentioned != retweeted:
+                self.add_edge('mention', user, mentioned)
+        return True
+
+    def add_batch(self, docs):
+        """ Adds the tweets not in the graph yet. Returns how many were added. """
+        return sum(1 for doc in docs if self.add_document(doc))
+
+    def add_path(self, src_path, debug=False):
+        """ Adds the stored files under src_path that have not been added before. Returns the
+        number of new tweets. """
+        documents = 0
+        for file_path in local_analytics.stored_files(src_path):
+            stat = os.stat(file_path)
+            signature = [stat.st_size, int(stat.st_mtime)]
+            key = os.path.abspath(file_path)
+            if self.files.get(key) == signature:
+                continue
+            for batch in local_analytics.iter_batches(file_path):
+                documents += self.add_batch(batch)
+            self.files[key] = signature
+            if debug:
+                print('Added [{}] to the graph'.format(file_path))
+        return documents
+
+    def merge(self, other):
+        """ Adds the edge counts of another graph to this one. The graphs are expected to be
+        built from different tweets. """
+        for kind in EDGE_KINDS:
+            for source, target, count in other.edge_list(kind):
+                self.add_edge(kind, source, target, count)
+
+    def edge_list(self, kind):
+        """ Yields (source, target, count) with node names. """
+        for key, count in self.edges[kind].items():
+            yield self.names[key >> _SHIFT], self.names[key & _MASK], count
+
+    def neighbours(self, name, kind, k=10):
+        """ Top k neighbours of a node by edge count, ties by name. Directed edges are followed
+        outwards. The adjacency index keeps this proportional to the degree of the node. """
+        try:
+            node = self.node_ids[name]
+        except KeyError:
+            return []
+        edges = self.edges[kind]
+        found = []
+        for other in self.adjacency[kind].get(node, ()):
+            a, b = (other, node) if kind in UNDIRECTED and other < node else (node, other)
+            found.append((self.names[other], edges[(a << _SHIFT) | b]))
+        found.sort()
+        return nlargest(k, found, key=lambda pair: pair[1])
+
+    def top_edges(self, kind, k=10):
+        return nlargest(k, self.edge_list(kind), key=lambda edge: edge[2])
+
+    def save(self, directory):
+        """ Stores the graph. Edges go to binary key and count arrays per kind. """
+        os.makedirs(directory, exist_ok=True)
+        for kind in EDGE_KINDS:
+            edges = self.edges[kind]
+            with open(os.path.join(directory, kind + '.keys'), 'wb') as handle:
+                array(KEY_TYPE, edges.keys()).tofile(handle)
+            with open(os.path.join(directory, kind + '.counts'), 'wb') as handle:
+                array(KEY_TYPE, edges.values()).tofile(handle)
+        if self.new_ids:
+            self.seen = array(KEY_TYPE, merge(self.seen, sorted(self.new_ids)))
+            self.new_ids = set()
+        with open(os.path.join(directory, SEEN_FILE), 'wb') as handle:
+            self.seen.tofile(handle)
+        path = os.path.join(directory, NODES_FILE)
+        with open(path + '.tmp', 'w') as handle:
+            json.dump({'names': self.names, 'files': self.files}, handle)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, directory):
+        """ Loads a stored graph. Returns an empty graph when there is nothing stored. """
+        graph = cls()
+        try:
+            with open(os.path.join(directory, NODES_FILE), 'r') as handle:
+                stored = json.load(handle)
+        except FileNotFoundError:
+            return graph
+        graph.names = stored['names']
+        graph.files = stored.get('files', {})
+        graph.node_ids = dict((name, i) for i, name in enumerate(graph.names))
+        for kind in EDGE_KINDS:
+            keys = array(KEY_TYPE)
+            counts = array(KEY_TYPE)
+            with open(os.path.join(directory, kind + '.keys'), 'rb') as handle:
+                keys.frombytes(handle.read())
+            with open(os.path.join(directory, kind + '.counts'), 'rb') as handle:
+                counts.frombytes(handle.read())
+            graph.edges[kind] = dict(zip(keys, counts))
+            for key in keys:
+                graph._link(kind, key >> _SHIFT, key & _MASK)
+        try:
+            with open(os.path.join(directory, SEEN_FILE), 'rb') as handle:
+                graph.seen.frombytes(handle.read())
+        except FileNotFoundError:
+            pass
+        return graph
+
+    def write_edge_lists(self, directory):
+        """ Writes a tab separated edge list per kind: source, target, count. """
+        os.makedirs(directory, exist_ok=True)
+        for kind in EDGE_KINDS:
+            with open(os.path.join(directory, kind + '_edges.tsv'), 'w') as handle:
+                for source, target, count in sorted(self.edge_list(kind),
+                                                    key=lambda edge: -edge[2]):
+                    handle.write('%s\t%s\t%d\n' % (source, target, count))
@@ -1,12 +1,16 @@
 #%%
 from json import dump
+import json
 import sys
 import os
 import argparse
 from configparser import ConfigParser
-from elasticsearch import Elasticsearch
+from es_client import create_es_client
 
-from elasticsearch_index_conf import set_es_index
+from elasticsearch_index_conf import set_es_index, index_options
+from es_bulk import push_bulk
+from pipeline_metrics import METRICS
+from tracing import NULL_TRACER, Tracer, run_profiled
 
 
 #%%
@@ -23,6 +27,12 @@ def set_arguments():
                         help = 'Name of the index to be used.')
     parser.add_argument('-p', dest = 'path', type = str,
                         help = 'Path to file where the timeline was stored')
+    parser.add_argument('--metrics-file', dest = 'metrics_file', type = str,
+                        help = 'Write a JSON summary of the upload metrics to this file.')
+    parser.add_argument('--profile', dest = 'profile', type = str,
+                        help = 'Run under cProfile and store the pstats output to this file.')
+    parser.add_argument('--trace', dest = 'trace', type = str,
+                        help = 'Record wall and CPU time of each upload to this trace file.')
     parser.set_defaults(debug = False)
 
     arguments = parser.parse_args()
@@ -35,22 +45,19 @@ def set_arguments():
 
 
 #%%
-def upload_records(file_path, es_handle, index, debug = False):
+def upload_records(file_path, es_handle, index, debug = False, tracer = NULL_TRACER,
+                   dead_letter_path = None):
+    """ Uploads a single record file. Returns True when every tweet was indexed. """
     if debug:
         print("Handling file [{}] for the index [{}]".format(file_path, index))
 
-    with open (file_path, 'r') as handle:
-        record_json = handle.read()
+    with tracer.span('read_file'):
+        with open (file_path, 'r') as handle:
+            record_json = handle.read()
 
-    res = es_handle.bulk(record_json, index=index)
-    if res['errors']:
-        if debug:
-            print("At least some ingests FAILED!")
-        return False
-    else:
-        if debug:
-            print("Clean run!")
-    return True
+    result = push_bulk(es_handle, record_json, index, dead_letter_path = dead_letter_path,
+                       tracer = tracer, debug = debug)
+    return result.ok
 
 
 #%%
@@ -59,6 +66,18 @@ def main():
     if args is None:
         return -1
 
+    tracer = Tracer() if args.trace is not None else NULL_TRACER
+    try:
+        if args.profile is not None:
+            return run_profiled(args.profile, run, args, tracer)
+        return run(args, tracer)
+    finally:
+        if args.trace is not None:
+            tracer.write(args.trace)
+
+
+def run(args, tracer = NULL_TRACER):
+    """ Uploads all the record files in the given folder. """
     config = ConfigParser()
     try:
         config.read(args.config)
@@ -84,23 +103,29 @@ def main():
         print('    url = https://xxxxxxxxxx.xxx')
         return -1
 
-    es = Elasticsearch(
-            [elasitc_url],
-            http_auth=(config['ElasticSearch']['auth_user'], elastic_pass),
-            use_ssl = (config['ElasticSearch']['use_ssl'] == 'True'),
-            verify_certs = (config['ElasticSearch']['verify_certs'] == 'True')
-        )
+    es = create_es_client(config['ElasticSearch'], elastic_pass)
 
-    set_es_index(index_name, es_handle=es, debug=args.debug)
+    set_es_index(index_name, es_handle=es, debug=args.debug,
+                 **index_options(config['ElasticSearch']))
+    dead_letter_path = config['Local Storage'].get('dead_letter_path') \
+        if config.has_section('Local Storage') else None
 
     records = os.listdir(args.path)
     for rec in records:
         if rec.endswith('txt'):
             full_path = args.path + '/' + rec
-            upload_records(full_path, es_handle = es, index = index_name, debug=args.debug)
+            with tracer.span('upload', file=rec):
+                upload_records(full_path, es_handle = es, index = index_name, debug=args.debug,
+                               tracer = tracer, dead_letter_path = dead_letter_path)
+            METRICS.inc('files_uploaded_total')
         else:
             print('Skipping file [{}] as irrelevant'. format(rec))
 
+    if args.metrics_file is not None:
+        METRICS.write_summary(args.metrics_file)
+    if args.debug:
+        print(json.dumps(METRICS.summary(), indent=2))
+
 
 #%%
 if __name__ == "__main__":
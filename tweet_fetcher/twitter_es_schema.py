@@ -4,9 +4,11 @@ import re
 
 class TwitterEsSchema(object):
     """ Modification of twitter provided tweet object to ElasticSearch document. Strips a way
-    several fields to improve ES performance. """
-    def __init__(self):
+    several fields to improve ES performance. An optional projection profile drops further
+    fields after the trimming. """
+    def __init__(self, projection=None):
         self.empty = True
+        self.projection = projection
 
     def trim_user(self, twitter_user):
         """ Trims nonintersting fields out of Twitter's user object. """
@@ -114,6 +116,8 @@ class TwitterEsSchema(object):
             self.trim_quote()
         if 'media' in self.tweet['entities']:
             self.trim_media()
+        if self.projection is not None:
+            self.projection.apply(self.tweet)
 
     def get_json(self):
         """ Return json string. Suitable for bulk ingest in ElasticSearch. """